@@ -0,0 +1,374 @@
+# 图像调整流水线
+# 亮度、对比度、RGBA 增益、Gamma 都是逐通道的点运算，合成为每通道 256 项的查找表后一次应用
+import math
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+from PIL import Image, ImageEnhance, ImageFilter
+
+# 模糊与锐化滤镜的默认半径（像素）
+DEFAULT_FILTER_RADIUS = 2.0
+
+AdjustmentParams = namedtuple(
+    "AdjustmentParams",
+    ["brightness", "contrast", "saturation", "sharpness", "rgba", "gamma", "filter_name", "filter_radius"],
+    defaults=[DEFAULT_FILTER_RADIUS]
+)
+
+IDENTITY_PARAMS = AdjustmentParams(1.0, 1.0, 1.0, 1.0, (1.0, 1.0, 1.0, 1.0), 1.0, "无")
+
+# 半径可调的滤镜；模糊基于扩展方框模糊近似高斯，耗时与半径无关
+RADIUS_FILTERS = ("模糊", "锐化", "方框模糊")
+
+# 阶段缓存默认容量
+STAGE_CACHE_BYTES = 256 * 1024 * 1024
+
+# 固定卷积核滤镜的半径，分块渲染时每块四周需额外读取这么多像素
+FILTER_RADIUS = {"无": 0, "浮雕": 1}
+# ImageEnhance.Sharpness 内部使用 3x3 平滑核
+SHARPNESS_RADIUS = 1
+
+# 分块渲染的最小块大小；块边长至少是 halo 的 TILE_HALO_RATIO 倍，重叠边多读的像素不超过约 56%
+TILE_SIZE = 512
+TILE_HALO_RATIO = 8
+# 分块线程池的线程数
+TILE_WORKERS = os.cpu_count() or 1
+
+_RAMP = np.arange(256, dtype=np.float64)
+_RAMP32 = _RAMP.astype(np.float32)
+_IDENTITY_LUT = np.tile(np.arange(256, dtype=np.uint8), (4, 1))
+
+
+# 与 Image.blend（ImageEnhance 的实现）逐位一致：degenerate + factor * (v - degenerate)
+# 按 float32 计算并截断取整；用 float64 计算时约七分之一的滑块取值会差 1 级
+def _blend_lut(degenerate, factor):
+    degenerate = np.float32(degenerate)
+    values = degenerate + np.float32(factor) * (_RAMP32 - degenerate)
+    return np.clip(np.floor(values), 0, 255).astype(np.uint8)
+
+
+# point() 的查找表按四舍五入取整
+
+
+def _point_lut(values):
+    return np.clip(np.rint(values), 0, 255).astype(np.uint8)
+
+
+def channel_histogram(image):
+    # 每通道 256 级直方图，对同一源图只需统计一次
+    return np.asarray(image.histogram(), dtype=np.float64).reshape(-1, 256)[:4]
+
+
+def _luma_mean(histogram, lut):
+    # 由直方图推算经过查找表后的灰度均值，系数与 PIL 的 L 转换一致
+    counts = histogram[:3].sum(axis=1)
+    means = (histogram[:3] * lut[:3]).sum(axis=1) / np.maximum(counts, 1)
+    return 0.299 * means[0] + 0.587 * means[1] + 0.114 * means[2]
+
+
+def pre_tone_luts(params, histogram):
+    # 亮度与对比度只作用于 RGB，Alpha 保持不变；全部为恒等时返回 None
+    lut = _IDENTITY_LUT.copy()
+    identity = True
+    if params.brightness != 1.0:
+        lut[:3] = _blend_lut(0, params.brightness)[lut[:3]]
+        identity = False
+    if params.contrast != 1.0:
+        # 与 ImageEnhance.Contrast 相同，以亮度调整后灰度图的均值为中心
+        degenerate = int(_luma_mean(histogram, lut) + 0.5)
+        lut[:3] = _blend_lut(degenerate, params.contrast)[lut[:3]]
+        identity = False
+    return None if identity else lut
+
+
+def post_tone_luts(params):
+    lut = _IDENTITY_LUT.copy()
+    identity = True
+    for channel, gain in enumerate(params.rgba):
+        if gain != 1.0:
+            lut[channel] = _point_lut(_RAMP * gain)[lut[channel]]
+            identity = False
+    if params.gamma != 1.0:
+        # 与原实现一致，Gamma 作用于全部四个通道
+        lut = _point_lut(((_RAMP / 255.0) ** (1 / params.gamma)) * 255)[lut]
+        identity = False
+    return None if identity else lut
+
+
+def compose_luts(first, second):
+    if first is None:
+        return second
+    if second is None:
+        return first
+    return np.take_along_axis(second, first.astype(np.intp), axis=1)
+
+
+def apply_luts(image, luts):
+    if luts is None:
+        return image
+    # Image.point 接受 4x256 的扁平查找表，一次遍历完成全部通道
+    return image.point(luts.ravel().tolist())
+
+
+def is_identity(params):
+    # 未选滤镜时半径不影响结果
+    return params._replace(filter_radius=DEFAULT_FILTER_RADIUS) == IDENTITY_PARAMS
+
+
+def apply_filter(image, filter_name, radius=DEFAULT_FILTER_RADIUS):
+    if filter_name == "模糊":
+        return image.filter(ImageFilter.GaussianBlur(radius))
+    if filter_name == "锐化":
+        return image.filter(ImageFilter.UnsharpMask(radius, percent=150, threshold=3))
+    if filter_name == "方框模糊":
+        return image.filter(ImageFilter.BoxBlur(radius))
+    if filter_name == "浮雕":
+        return image.filter(ImageFilter.EMBOSS)
+    return image
+
+
+def filter_key(params):
+    if params.filter_name in RADIUS_FILTERS:
+        return params.filter_name, params.filter_radius
+    return params.filter_name
+
+
+def stage_keys(params):
+    # 每个阶段的缓存键包含它自己及之前所有阶段的参数
+    keys = []
+    for part in ((params.brightness, params.contrast), params.saturation, params.sharpness,
+                 (params.rgba, params.gamma), filter_key(params)):
+        keys.append((keys[-1] if keys else ()) + (part,))
+    return keys
+
+
+def _render_steps(params, histogram):
+    # 返回 (完成到的阶段序号, 处理函数) 列表；处理函数为 None 表示该阶段为恒等
+    pre = None
+    if params.brightness != 1.0 or params.contrast != 1.0:
+        pre = pre_tone_luts(params, histogram)
+    post = post_tone_luts(params)
+    filter_step = (4, None if params.filter_name == "无" else
+                   lambda image: apply_filter(image, params.filter_name, params.filter_radius))
+    if params.saturation == 1.0 and params.sharpness == 1.0:
+        # 中间没有非点运算时，前后两段查找表合成为一次遍历
+        fused = compose_luts(pre, post)
+        return [(3, None if fused is None else lambda image: apply_luts(image, fused)), filter_step]
+    # 饱和度和锐化依赖相邻通道或像素，无法并入查找表
+    return [
+        (0, None if pre is None else lambda image: apply_luts(image, pre)),
+        (1, None if params.saturation == 1.0 else lambda image: ImageEnhance.Color(image).enhance(params.saturation)),
+        (2, None if params.sharpness == 1.0 else lambda image: ImageEnhance.Sharpness(image).enhance(params.sharpness)),
+        (3, None if post is None else lambda image: apply_luts(image, post)),
+        filter_step,
+    ]
+
+
+def render_adjustments(image, params, histogram=None, cache=None, source_key=None):
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+    if histogram is None and (params.brightness != 1.0 or params.contrast != 1.0):
+        histogram = channel_histogram(image)
+    steps = _render_steps(params, histogram)
+    if cache is None:
+        for _, func in steps:
+            if func is not None:
+                image = func(image)
+        return image
+
+    # 从最后一个命中缓存的阶段继续，之前的阶段全部跳过
+    keys = stage_keys(params)
+    start = 0
+    for index in range(len(steps) - 1, -1, -1):
+        cached = cache.get((source_key, keys[steps[index][0]]))
+        if cached is not None:
+            image = cached
+            start = index + 1
+            break
+    cache.record(start > 0)
+    for stage, func in steps[start:]:
+        if func is not None:
+            image = func(image)
+            cache.put((source_key, keys[stage]), image)
+    return image
+
+
+# 按字节数限制容量的 LRU 缓存，保存流水线各阶段的中间结果
+class StageCache:
+    def __init__(self, max_bytes=STAGE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            image = self.entries.get(key)
+            if image is not None:
+                self.entries.move_to_end(key)
+            return image
+
+    def put(self, key, image):
+        size = image.width * image.height * len(image.getbands())
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old.width * old.height * len(old.getbands())
+            self.entries[key] = image
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= evicted.width * evicted.height * len(evicted.getbands())
+
+    def record(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def summary(self):
+        return f"命中 {self.hits} 次, 未命中 {self.misses} 次, 占用 {self.total_bytes / 1024 / 1024:.1f} MB"
+
+
+def filter_halo(params):
+    if params.filter_name == "方框模糊":
+        halo = math.ceil(params.filter_radius) + 1
+    elif params.filter_name in RADIUS_FILTERS:
+        # 高斯模糊由三次扩展方框模糊实现，每次的半径约为标准差
+        halo = 3 * (math.ceil(params.filter_radius) + 1)
+    else:
+        halo = FILTER_RADIUS.get(params.filter_name, 0)
+    if params.sharpness != 1.0:
+        halo += SHARPNESS_RADIUS
+    return halo
+
+
+def scale_params(params, factor):
+    # 在降采样代理图上预览时，滤镜半径按同样比例缩小
+    if factor == 1 or params.filter_name not in RADIUS_FILTERS:
+        return params
+    return params._replace(filter_radius=params.filter_radius / factor)
+
+
+def proxy_factor(display_scale):
+    # 缩小显示时按 2 的幂降采样，代理图分辨率不低于屏幕显示分辨率
+    factor = 1
+    while display_scale > 0 and factor * 2 <= 1.0 / display_scale:
+        factor *= 2
+    return factor
+
+
+def render_region(image, params, box, histogram=None, cache=None):
+    # 只渲染 box 区域，四周多读 halo 像素保证滤镜结果与整图渲染一致
+    if histogram is None:
+        histogram = channel_histogram(image)
+    left, top, right, bottom = box
+    halo = filter_halo(params)
+    outer = (max(0, left - halo), max(0, top - halo),
+             min(image.width, right + halo), min(image.height, bottom + halo))
+    rendered = render_adjustments(image.crop(outer), params, histogram, cache, ("region", outer))
+    return rendered.crop((left - outer[0], top - outer[1], right - outer[0], bottom - outer[1]))
+
+
+_tile_executor = None
+
+
+def tile_executor():
+    # 进程内共享的分块线程池；PIL 的逐像素运算会释放 GIL，线程可以并行
+    global _tile_executor
+    if _tile_executor is None:
+        _tile_executor = ThreadPoolExecutor(max_workers=TILE_WORKERS, thread_name_prefix="tile")
+    return _tile_executor
+
+
+def tile_boxes(width, height, tile_size=TILE_SIZE):
+    for top in range(0, height, tile_size):
+        for left in range(0, width, tile_size):
+            yield left, top, min(width, left + tile_size), min(height, top + tile_size)
+
+
+def tile_layout(width, height, halo, workers=TILE_WORKERS):
+    # 按滤镜 halo 选择块大小；返回 None 表示整图渲染更快：
+    # 只有一个线程，或只切出一块，或各块连同重叠边的总面积摊到线程上仍不小于整图
+    if workers <= 1:
+        return None
+    tile_size = max(TILE_SIZE, TILE_HALO_RATIO * halo)
+    boxes = list(tile_boxes(width, height, tile_size))
+    if len(boxes) < 2:
+        return None
+    padded = sum((min(width, right + halo) - max(0, left - halo)) * (min(height, bottom + halo) - max(0, top - halo))
+                 for left, top, right, bottom in boxes)
+    if padded / min(workers, len(boxes)) >= width * height:
+        return None
+    return tile_size
+
+
+def render_tiled(image, params, histogram=None, tile_size=None, executor=None, progress=None, cancelled=None,
+                 workers=None):
+    # 把整图切成带重叠边的块并行渲染，便于报告进度和中途取消；取消时返回 None
+    # 不指定 tile_size 时由 tile_layout 决定块大小，不值得分块时直接整图渲染
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+    if histogram is None:
+        histogram = channel_histogram(image)
+    if tile_size is None:
+        tile_size = tile_layout(image.width, image.height, filter_halo(params), workers or TILE_WORKERS)
+        if tile_size is None:
+            if cancelled is not None and cancelled():
+                return None
+            result = render_adjustments(image, params, histogram)
+            if progress is not None:
+                progress(100)
+            return result
+    if executor is None:
+        executor = tile_executor()
+    futures = {
+        executor.submit(render_region, image, params, box, histogram): box
+        for box in tile_boxes(image.width, image.height, tile_size)
+    }
+    result = Image.new("RGBA", image.size)
+    try:
+        for done, future in enumerate(as_completed(futures), 1):
+            if cancelled is not None and cancelled():
+                return None
+            box = futures[future]
+            result.paste(future.result(), box[:2])
+            if progress is not None:
+                progress(done * 100 // len(futures))
+    finally:
+        for future in futures:
+            future.cancel()
+    return result
+
+
+def render_stack(image, adjustments, histogram=None, progress=None, cancelled=None):
+    # 依次渲染调整栈；只有第一项可以复用调用方提供的直方图
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+    total = max(1, len(adjustments))
+    for index, params in enumerate(adjustments):
+        if is_identity(params):
+            continue
+        step_progress = None
+        if progress is not None:
+            step_progress = lambda value, index=index: progress((index * 100 + value) // total)
+        image = render_tiled(image, params, histogram if index == 0 else None,
+                             progress=step_progress, cancelled=cancelled)
+        if image is None:
+            return None
+    if progress is not None:
+        progress(100)
+    return image
@@ -0,0 +1,264 @@
+# 背景去除服务
+# rembg 会话（ONNX 模型）在进程内只创建一次，所有去除背景调用共享
+# 推理得到的 Alpha 蒙版按输入像素和模型名缓存到磁盘，命中时无需加载模型
+# 超大图像可在缩小的代理图上推理，再以原图为引导把蒙版放大回全分辨率
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+from rembg import new_session, remove
+
+# 可选的分割模型，第一个为默认模型
+MODEL_NAMES = ["u2net", "u2netp", "isnet-general-use", "u2net_human_seg", "silueta"]
+DEFAULT_MODEL = MODEL_NAMES[0]
+
+# 蒙版磁盘缓存的默认位置与容量
+MASK_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")), "image-editor", "masks"
+)
+MASK_CACHE_BYTES = 1024 * 1024 * 1024
+
+# 代理推理：长边超过 PROXY_SIDE 的图像先缩小到该尺寸再推理；
+# rembg 的模型输入最大为 1024 (isnet)，更大的代理图只会在模型内部再次缩小
+PROXY_SIDE = 1024
+# 引导滤波参数（在代理分辨率下）与全分辨率合成时每次处理的行数
+GUIDED_RADIUS = 4
+GUIDED_EPS = 1e-4
+REFINE_STRIP_ROWS = 512
+
+
+class SessionManager:
+    def __init__(self):
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.stats = {}  # 模型名 -> {"init": 会话创建耗时, "count": 推理次数, "total": 推理总耗时}
+
+    def get_session(self, model_name=DEFAULT_MODEL):
+        with self.lock:
+            session = self.sessions.get(model_name)
+            if session is None:
+                start = time.perf_counter()
+                session = new_session(model_name)
+                elapsed = time.perf_counter() - start
+                self.sessions[model_name] = session
+                self.stats[model_name] = {"init": elapsed, "count": 0, "total": 0.0}
+                logging.info(f"rembg 会话已创建: {model_name}, 耗时 {elapsed:.2f} s")
+            return session
+
+    def warm_up(self, model_name=DEFAULT_MODEL):
+        # 创建会话并跑一次小图推理，让 ONNX Runtime 完成初始化
+        try:
+            start = time.perf_counter()
+            self.predict_mask(Image.new("RGBA", (64, 64), (255, 255, 255, 255)), model_name, record=False)
+            logging.info(f"rembg 模型预热完成: {model_name}, 耗时 {time.perf_counter() - start:.2f} s")
+        except Exception as e:
+            logging.error(f"rembg 模型预热失败: {model_name}: {e}")
+
+    def warm_up_async(self, model_name=DEFAULT_MODEL):
+        thread = threading.Thread(target=self.warm_up, args=(model_name,), name=f"rembg-warmup-{model_name}",
+                                  daemon=True)
+        thread.start()
+        return thread
+
+    def predict_mask(self, image, model_name=DEFAULT_MODEL, record=True):
+        start = time.perf_counter()
+        session = self.get_session(model_name)
+        infer_start = time.perf_counter()
+        mask = remove(image, session=session, only_mask=True)
+        if not isinstance(mask, Image.Image):
+            raise ValueError("rembg 返回了非图像结果。")
+        if record:
+            self.record(model_name, time.perf_counter() - infer_start, time.perf_counter() - start)
+        return mask.convert("L")
+
+    def record(self, model_name, inference_time, total_time):
+        with self.lock:
+            stats = self.stats[model_name]
+            stats["count"] += 1
+            stats["total"] += inference_time
+            count, average = stats["count"], stats["total"] / stats["count"]
+        if count == 1:
+            logging.info(f"去除背景首次结果: {model_name}, 耗时 {total_time:.2f} s (推理 {inference_time:.2f} s)")
+        else:
+            logging.info(f"去除背景耗时: {model_name}, 本次 {inference_time:.2f} s, 稳定平均 {average:.2f} s ({count} 次)")
+
+
+# 以输入像素和模型名的哈希为键的 Alpha 蒙版磁盘缓存，超出容量时淘汰最久未使用的条目
+class MaskCache:
+    def __init__(self, directory=MASK_CACHE_DIR, max_bytes=MASK_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    def key(self, pixels, size, model_name):
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(f"{model_name}:{size[0]}x{size[1]}:".encode("utf-8"))
+        digest.update(memoryview(pixels).cast("B"))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.png")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with Image.open(path) as mask:
+                mask.load()
+            # 更新修改时间，作为 LRU 的最近使用时间
+            os.utime(path)
+            return mask
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"蒙版缓存读取失败，已忽略: {path}: {e}")
+            return None
+
+    def put(self, key, mask):
+        path = self.path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再改名，避免其他线程或批处理进程读到不完整的文件
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            mask.save(temp_path, "PNG", compress_level=9)
+            os.replace(temp_path, path)
+        except Exception as e:
+            logging.warning(f"蒙版缓存写入失败: {path}: {e}")
+            return
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            entries = []
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    if name.endswith(".png"):
+                        stat = os.stat(os.path.join(root, name))
+                        entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+
+def _box_sum(array, radius):
+    padded = np.pad(array, ((radius + 1, radius), (radius + 1, radius)))
+    integral = padded.cumsum(0, dtype=np.float64).cumsum(1)
+    size = 2 * radius + 1
+    return (integral[size:, size:] - integral[:-size, size:]
+            - integral[size:, :-size] + integral[:-size, :-size])
+
+
+def _luma(image):
+    # PIL 的 L 模式转换使用 ITU-R 601-2 亮度权重
+    return np.asarray(image.convert("L"), dtype=np.float32) / 255.0
+
+
+def refine_mask(pixels, proxy_image, proxy_mask, radius=GUIDED_RADIUS, eps=GUIDED_EPS,
+                strip_rows=REFINE_STRIP_ROWS):
+    # 快速引导滤波：在代理分辨率下求线性系数 a、b，放大后以全分辨率亮度为引导重建蒙版，
+    # 使蒙版边缘贴合原图边缘；全分辨率部分按行分条处理，控制峰值内存
+    guide = _luma(proxy_image)
+    mask = np.asarray(proxy_mask, dtype=np.float32) / 255.0
+    # 边界处按实际覆盖的像素数求均值
+    count = _box_sum(np.ones_like(guide), radius)
+
+    def box_mean(array):
+        return _box_sum(array, radius) / count
+
+    mean_i = box_mean(guide)
+    mean_p = box_mean(mask)
+    cov_ip = box_mean(guide * mask) - mean_i * mean_p
+    var_i = box_mean(guide * guide) - mean_i * mean_i
+    a = cov_ip / (var_i + eps)
+    b = mean_p - a * mean_i
+    # 系数预先乘 255，放大后直接得到 0-255 的蒙版值
+    coeff_a = Image.fromarray((box_mean(a) * 255.0).astype(np.float32), "F")
+    coeff_b = Image.fromarray((box_mean(b) * 255.0 + 0.5).astype(np.float32), "F")
+
+    height, width = pixels.shape[:2]
+    if not pixels.flags.c_contiguous:
+        pixels = np.ascontiguousarray(pixels)
+    scale_y = proxy_image.height / height
+    result = np.empty((height, width), np.uint8)
+    for top in range(0, height, strip_rows):
+        bottom = min(top + strip_rows, height)
+        rows = bottom - top
+        box = (0, top * scale_y, proxy_image.width, bottom * scale_y)
+        strip = np.asarray(coeff_a.resize((width, rows), Image.BILINEAR, box=box)).copy()
+        strip *= _luma(Image.frombuffer("RGBA", (width, rows), pixels[top:bottom], "raw", "RGBA", 0, 1))
+        strip += np.asarray(coeff_b.resize((width, rows), Image.BILINEAR, box=box))
+        np.clip(strip, 0, 255, out=strip)
+        result[top:bottom] = strip
+    return Image.fromarray(result, "L")
+
+
+def predict_proxy_mask(image, model_name=DEFAULT_MODEL, pixels=None, proxy_side=PROXY_SIDE):
+    # 长边不超过 proxy_side 时直接全分辨率推理
+    if max(image.size) <= proxy_side:
+        return session_manager().predict_mask(image, model_name)
+    if pixels is None:
+        pixels = np.asarray(image.convert("RGBA"))
+    factor = proxy_side / max(image.size)
+    proxy_size = (max(1, round(image.width * factor)), max(1, round(image.height * factor)))
+    proxy_image = image.resize(proxy_size, Image.BOX)
+    proxy_mask = session_manager().predict_mask(proxy_image, model_name)
+    logging.debug(f"代理推理: {image.width}x{image.height} -> {proxy_size[0]}x{proxy_size[1]}")
+    return refine_mask(pixels, proxy_image, proxy_mask)
+
+
+def apply_mask(image, mask):
+    # 与 rembg 默认输出一致：蒙版外的像素变为全透明
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+    return Image.composite(image, Image.new("RGBA", image.size, 0), mask)
+
+
+def remove_background(image, model_name=DEFAULT_MODEL, pixels=None, cache=None, proxy_side=None):
+    # pixels 为与 image 内容相同的 (高, 宽, 4) 数组，用于计算缓存键和引导放大而不复制像素
+    # proxy_side 为 None 时始终全分辨率推理
+    if cache is None:
+        cache = mask_cache()
+    proxied = proxy_side is not None and max(image.size) > proxy_side
+    # 代理推理的结果与全分辨率推理不同，缓存键中区分
+    mode = f"{model_name}@{proxy_side}" if proxied else model_name
+    key = cache.key(pixels if pixels is not None else image.tobytes(), image.size, mode)
+    mask = cache.get(key)
+    if mask is not None and mask.size == image.size:
+        logging.info(f"命中蒙版缓存: {model_name}, {image.width}x{image.height}")
+        return apply_mask(image, mask)
+    if proxied:
+        mask = predict_proxy_mask(image, model_name, pixels, proxy_side)
+    else:
+        mask = session_manager().predict_mask(image, model_name)
+    cache.put(key, mask)
+    return apply_mask(image, mask)
+
+
+_session_manager = None
+_mask_cache = None
+_singleton_lock = threading.Lock()
+
+
+def session_manager():
+    global _session_manager
+    with _singleton_lock:
+        if _session_manager is None:
+            _session_manager = SessionManager()
+        return _session_manager
+
+
+def mask_cache():
+    global _mask_cache
+    with _singleton_lock:
+        if _mask_cache is None:
+            _mask_cache = MaskCache()
+        return _mask_cache
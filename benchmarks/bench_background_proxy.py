@@ -0,0 +1,66 @@
+# 代理推理基准：比较全分辨率推理与缩小推理后引导放大的耗时和峰值内存
+# 每种模式在独立子进程中运行，峰值内存取子进程的最大常驻内存
+# 用法: python benchmarks/bench_background_proxy.py [--megapixels 12 48] [--model u2net]
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from background_removal import PROXY_SIDE, MaskCache, remove_background, session_manager
+
+
+def run_once(megapixels, model_name, proxy_side):
+    width = int((megapixels * 1e6 * 1.5) ** 0.5)
+    height = int(megapixels * 1e6 / width)
+    image = Image.new("RGBA", (width, height), (40, 90, 180, 255))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((width // 5, height // 5, width * 4 // 5, height * 4 // 5), fill=(230, 190, 60, 255))
+    pixels = np.asarray(image)
+    # 预先创建会话，只计推理与合成
+    session_manager().get_session(model_name)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        remove_background(image, model_name, pixels, cache=MaskCache(directory), proxy_side=proxy_side)
+        elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{elapsed} {peak} {baseline}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--megapixels", type=float, nargs="+", default=[12, 48])
+    parser.add_argument("--model", default="u2net")
+    parser.add_argument("--proxy-side", type=int, default=PROXY_SIDE)
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        proxy_side = int(args.child[1]) or None
+        run_once(float(args.child[0]), args.model, proxy_side)
+        return
+
+    print(f"模型 {args.model}, 代理长边 {args.proxy_side}")
+    print(f"{'MP':>5} {'模式':>6} {'耗时(s)':>9} {'峰值内存(MB)':>13} {'推理增量(MB)':>13}")
+    for megapixels in args.megapixels:
+        for label, proxy_side in (("全图", 0), ("代理", args.proxy_side)):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--model", args.model,
+                 "--child", str(megapixels), str(proxy_side)],
+                check=True, capture_output=True, text=True).stdout.split()
+            elapsed, peak, baseline = float(output[0]), int(output[1]), int(output[2])
+            # ru_maxrss 在 Linux 上以 KB 为单位
+            print(f"{megapixels:>5g} {label:>6} {elapsed:>9.2f} {peak / 1024:>13.0f} {(peak - baseline) / 1024:>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
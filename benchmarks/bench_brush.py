@@ -0,0 +1,127 @@
+# 画笔基准：在大图层上模拟高频鼠标输入，比较每次事件复制整幅像素与绘制到后备图像的耗时
+# 每 16 个事件处理一次界面事件（约等于 1000 Hz 输入下的 60 Hz 刷新），计入重绘开销
+# 另按真实时间以 1000 Hz 向笔画引擎输入点，统计实际绘制次数
+# 用法: python benchmarks/bench_brush.py [--megapixels 12] [--events 1000]
+import argparse
+import math
+import os
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtGui import QPixmap, QColor, QPainter, QPen
+from PyQt5.QtCore import Qt, QPointF, QRectF
+
+from image_editor import ImageEditor, ResizableGraphicsPixmapItem
+
+EVENTS_PER_FRAME = 16
+INPUT_RATE = 1000
+
+
+def paint_by_copy(editor, layer, start_point, end_point):
+    # 旧实现：每个事件 toImage -> 绘制 -> fromImage -> setPixmap
+    image = layer.pixmap().toImage()
+    painter = QPainter(image)
+    painter.setPen(QPen(editor.brush_tool.current_color, editor.brush_tool.size_slider.value(), Qt.SolidLine,
+                        Qt.RoundCap, Qt.RoundJoin))
+    painter.drawLine(layer.mapFromScene(start_point), layer.mapFromScene(end_point))
+    painter.end()
+    layer.setPixmap(QPixmap.fromImage(image))
+
+
+def paint_on_backing(editor, layer, start_point, end_point):
+    # 每个事件直接绘制到图层的后备图像，不复制整幅像素，也不记录撤销图块
+    image = layer.backing_image()
+    painter = QPainter(image)
+    pen = editor.brush_tool.pen()
+    painter.setCompositionMode(editor.brush_tool.composition_mode())
+    painter.setPen(pen)
+    layer_point_start = layer.mapFromScene(start_point)
+    layer_point_end = layer.mapFromScene(end_point)
+    painter.drawLine(layer_point_start, layer_point_end)
+    painter.end()
+    # 只重绘线段外扩半个笔宽的区域
+    margin = pen.widthF() / 2 + 1
+    layer.mark_painted(QRectF(layer_point_start, layer_point_end).normalized().adjusted(-margin, -margin, margin, margin))
+
+
+def run_stroke(app, editor, layer, paint, events):
+    width = layer.pixmap().width()
+    height = layer.pixmap().height()
+    points = [QPointF(width / 2 + math.cos(i / 40) * width / 3, height / 2 + math.sin(i / 25) * height / 3)
+              for i in range(events + 1)]
+    start = time.perf_counter()
+    for i in range(events):
+        paint(editor, layer, points[i], points[i + 1])
+        if i % EVENTS_PER_FRAME == 0:
+            app.processEvents()
+    app.processEvents()
+    # 笔画结束后读取一次像素，计入延迟同步
+    layer.pixmap()
+    return (time.perf_counter() - start) / events
+
+
+def run_paced_stroke(app, editor, layer, events):
+    # 按 INPUT_RATE 的节奏输入点，期间正常处理定时器与重绘
+    engine = editor.stroke_engine
+    engine.paint_count = 0
+    width = layer.pixmap().width()
+    height = layer.pixmap().height()
+    points = [QPointF(width / 2 + math.cos(i / 40) * width / 3, height / 2 + math.sin(i / 25) * height / 3)
+              for i in range(events + 1)]
+    busy = 0.0
+    start = time.perf_counter()
+    engine.begin(layer, points[0], editor.brush_tool.pen(), editor.brush_tool.composition_mode())
+    for i in range(1, events + 1):
+        work_start = time.perf_counter()
+        engine.add_point(points[i])
+        app.processEvents()
+        busy += time.perf_counter() - work_start
+        while time.perf_counter() - start < i / INPUT_RATE:
+            pass
+    work_start = time.perf_counter()
+    engine.end(points[-1])
+    layer.pixmap()
+    busy += time.perf_counter() - work_start
+    return busy / events, engine.paint_count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--megapixels", type=float, default=12)
+    parser.add_argument("--events", type=int, default=1000)
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    editor = ImageEditor()
+    editor.show()
+    width = int((args.megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(args.megapixels * 1e6 / width)
+    results = {}
+    for label, paint in (("复制整幅", paint_by_copy), ("后备图像", paint_on_backing)):
+        pixmap = QPixmap(width, height)
+        pixmap.fill(QColor(200, 220, 240))
+        layer = ResizableGraphicsPixmapItem(pixmap, "画笔基准")
+        editor.scene.addItem(layer)
+        results[label] = run_stroke(app, editor, layer, paint, args.events)
+        editor.scene.removeItem(layer)
+    pixmap = QPixmap(width, height)
+    pixmap.fill(QColor(200, 220, 240))
+    layer = ResizableGraphicsPixmapItem(pixmap, "画笔基准")
+    editor.scene.addItem(layer)
+    engine_per_event, paints = run_paced_stroke(app, editor, layer, args.events)
+    editor.scene.removeItem(layer)
+
+    print(f"图层 {width}x{height}, {args.events} 个事件")
+    for label, per_event in results.items():
+        print(f"{label}: 每事件 {per_event * 1000:.3f} ms, 可跟上 {1 / per_event:.0f} Hz 输入")
+    print(f"笔画引擎 ({INPUT_RATE} Hz 输入): 每事件 {engine_per_event * 1000:.3f} ms, "
+          f"{args.events} 个事件共绘制 {paints} 次")
+    editor.close()
+
+
+if __name__ == "__main__":
+    main()
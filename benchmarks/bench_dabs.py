@@ -0,0 +1,86 @@
+# 印章笔刷基准：不同直径下每秒可放置的笔刷印数量
+# 对比：缓存的笔刷印贴图（单独统计及含每帧合成）与 每个笔刷印用径向渐变抗锯齿绘制椭圆（不缓存）
+# 用法: python benchmarks/bench_dabs.py [--dabs 2000] [--hardness 0.3]
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtGui import QGuiApplication, QImage, QPainter, QColor, QRadialGradient, QBrush
+from PyQt5.QtCore import Qt, QPointF
+
+from brush_engine import BrushSettings, DabStroke, dab_image
+
+SIZES = [5, 10, 25, 50, 100, 200]
+# 每帧合成一次，按 1000 Hz 输入、60 Hz 刷新估算每帧约 16 个输入点
+DABS_PER_FRAME = 16
+
+
+def stroke_points(count, spacing):
+    return [QPointF(100 + (i * spacing) % 3600, 200 + (i * spacing) // 3600 * 50 % 2600) for i in range(count)]
+
+
+def bench_cached(image, settings, count):
+    stroke = DabStroke(image, settings, QColor(30, 60, 200))
+    points = stroke_points(count, stroke.spacing)
+    stamp_time = composite_time = 0.0
+    for i in range(0, count, DABS_PER_FRAME):
+        # 折线上相邻点相距正好一个间距，每个点对应一个笔刷印
+        start = time.perf_counter()
+        rect = stroke.stamp_polyline(points[i:i + DABS_PER_FRAME])
+        stamp_time += time.perf_counter() - start
+        start = time.perf_counter()
+        stroke.composite(rect)
+        composite_time += time.perf_counter() - start
+    return stroke.dab_count / stamp_time, stroke.dab_count / (stamp_time + composite_time)
+
+
+def bench_gradient(image, settings, count):
+    spacing = max(1.0, settings.diameter * settings.spacing)
+    points = stroke_points(count, spacing)
+    radius = settings.diameter / 2
+    color = QColor(30, 60, 200)
+    transparent = QColor(30, 60, 200, 0)
+    start = time.perf_counter()
+    painter = QPainter(image)
+    painter.setRenderHint(QPainter.Antialiasing)
+    painter.setPen(Qt.NoPen)
+    painter.setOpacity(settings.flow)
+    for point in points:
+        gradient = QRadialGradient(point, radius)
+        gradient.setColorAt(settings.hardness, color)
+        gradient.setColorAt(1.0, transparent)
+        painter.setBrush(QBrush(gradient))
+        painter.drawEllipse(point, radius, radius)
+    painter.end()
+    elapsed = time.perf_counter() - start
+    return count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dabs", type=int, default=2000)
+    parser.add_argument("--hardness", type=float, default=0.3)
+    args = parser.parse_args()
+
+    app = QGuiApplication(sys.argv)
+    image = QImage(4000, 3000, QImage.Format_ARGB32_Premultiplied)
+    image.fill(QColor(255, 255, 255))
+    print(f"画布 4000x3000, 每个尺寸 {args.dabs} 个笔刷印, 硬度 {args.hardness}, 间距 10%")
+    print(f"{'直径':>6} {'生成笔刷印(ms)':>14} {'仅贴图(个/秒)':>14} {'含合成(个/秒)':>14} {'渐变绘制(个/秒)':>16}")
+    for size in SIZES:
+        settings = BrushSettings(size, args.hardness, 1.0, 0.5, 0.1)
+        start = time.perf_counter()
+        dab_image(float(size), round(args.hardness, 2))
+        build = (time.perf_counter() - start) * 1000
+        stamp_only, with_composite = bench_cached(image, settings, args.dabs)
+        gradient = bench_gradient(image, settings, args.dabs)
+        print(f"{size:>6} {build:>14.2f} {stamp_only:>14.0f} {with_composite:>14.0f} {gradient:>16.0f}")
+    app.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# 图层缓存基准：场景中放置大量缩放、旋转过的图层，拖动其中一个选中图层，统计每帧重绘耗时
+# 分别在关闭和开启静态图层缓存时测量，两次使用相同的场景和拖动路径
+# 用法: python benchmarks/bench_layer_cache.py [--layers 60] [--frames 200]
+import argparse
+import math
+import os
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtGui import QPixmap, QColor, QPainter, QLinearGradient
+from PyQt5.QtCore import QPointF
+
+from image_editor import ImageEditor, ResizableGraphicsPixmapItem, AddLayerCommand
+
+LAYER_SIZE = 512
+
+
+def make_pixmap(index):
+    pixmap = QPixmap(LAYER_SIZE, LAYER_SIZE)
+    pixmap.fill(QColor(0, 0, 0, 0))
+    painter = QPainter(pixmap)
+    gradient = QLinearGradient(0, 0, LAYER_SIZE, LAYER_SIZE)
+    gradient.setColorAt(0, QColor.fromHsv(index * 37 % 360, 200, 230, 200))
+    gradient.setColorAt(1, QColor.fromHsv(index * 53 % 360, 160, 180, 120))
+    painter.setBrush(gradient)
+    painter.drawEllipse(0, 0, LAYER_SIZE, LAYER_SIZE)
+    painter.end()
+    return pixmap
+
+
+def add_layers(editor, count):
+    layers = []
+    for i in range(count):
+        layer = ResizableGraphicsPixmapItem(make_pixmap(i), f"图层 {i + 1}")
+        # 部分图层缩放、旋转，未缓存时每帧都要做带变换的平滑采样
+        layer.setScale(0.6 + (i % 5) * 0.15)
+        layer.setRotation((i % 7) * 11)
+        layer.setPos(QPointF((i % 10) * 180, (i // 10) * 160))
+        editor.undo_stack.push(AddLayerCommand(editor, layer))
+        layers.append(layer)
+    return layers
+
+
+def run_drag(app, editor, layer, frames):
+    viewport = editor.view.viewport()
+    origin = layer.pos()
+    times = []
+    for i in range(frames):
+        angle = i / frames * 2 * math.pi
+        layer.setPos(origin + QPointF(math.cos(angle) * 400, math.sin(angle) * 250))
+        start = time.perf_counter()
+        viewport.repaint()
+        app.processEvents()
+        times.append(time.perf_counter() - start)
+    layer.setPos(origin)
+    times.sort()
+    return sum(times) / frames, times[int(frames * 0.95)], times[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--layers", type=int, default=60)
+    parser.add_argument("--frames", type=int, default=200)
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    editor = ImageEditor()
+    editor.resize(1600, 1000)
+    editor.show()
+    layers = add_layers(editor, args.layers)
+    editor.view.fitInView(editor.scene.itemsBoundingRect())
+    target = layers[len(layers) // 2]
+    editor.scene.clearSelection()
+    target.setSelected(True)
+    app.processEvents()
+
+    print(f"{args.layers} 个 {LAYER_SIZE}x{LAYER_SIZE} 图层, 视口 "
+          f"{editor.view.viewport().width()}x{editor.view.viewport().height()}, 拖动 {args.frames} 帧")
+    for label, enabled in (("关闭缓存", False), ("开启缓存", True)):
+        editor.layer_cache_act.setChecked(enabled)
+        # 预热一帧，开启缓存时首帧生成各图层的缓存像素图
+        editor.view.viewport().repaint()
+        mean, p95, worst = run_drag(app, editor, target, args.frames)
+        print(f"{label}: 平均 {mean * 1000:.2f} ms, P95 {p95 * 1000:.2f} ms, 最长 {worst * 1000:.2f} ms")
+    editor.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# 像素桥接基准：比较 PNG 往返与直接映射 QImage 缓冲的转换耗时
+# 用法: python benchmarks/bench_pixel_bridge.py [--repeat N]
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtGui import QPixmap, QImage, QColor
+from PyQt5.QtCore import QBuffer, QIODevice
+from PIL import Image
+
+from pixel_bridge import qpixmap_to_pil, qpixmap_to_numpy, pil_to_qimage
+
+# 百万像素 -> (宽, 高)，按 3:2 比例
+SIZES = {1: (1224, 816), 12: (4240, 2832), 48: (8484, 5656)}
+
+
+def png_round_trip(pixmap):
+    buffer = QBuffer()
+    buffer.open(QIODevice.WriteOnly)
+    pixmap.save(buffer, "PNG")
+    pil_image = Image.open(BytesIO(buffer.data().data())).convert("RGBA")
+    data = pil_image.tobytes("raw", "RGBA")
+    return QPixmap.fromImage(QImage(data, pil_image.width, pil_image.height, QImage.Format_RGBA8888))
+
+
+def bridge_round_trip(pixmap):
+    return QPixmap.fromImage(pil_to_qimage(qpixmap_to_pil(pixmap)))
+
+
+def best_of(func, arg, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(arg)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    print(f"{'MP':>4} {'PNG往返(s)':>12} {'转PIL(s)':>10} {'转NumPy(s)':>11} {'桥接往返(s)':>12} {'加速比':>8}")
+    for megapixels, (width, height) in SIZES.items():
+        pixmap = QPixmap(width, height)
+        pixmap.fill(QColor(120, 80, 200, 180))
+        png = best_of(png_round_trip, pixmap, args.repeat)
+        to_pil = best_of(qpixmap_to_pil, pixmap, args.repeat)
+        to_numpy = best_of(qpixmap_to_numpy, pixmap, args.repeat)
+        bridge = best_of(bridge_round_trip, pixmap, args.repeat)
+        print(f"{megapixels:>4} {png:>12.3f} {to_pil:>10.3f} {to_numpy:>11.3f} {bridge:>12.3f} {png / bridge:>7.1f}x")
+    app.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# 分块并行渲染基准：比较整图单线程渲染与不同线程数下分块渲染的耗时
+# 用法: python benchmarks/bench_tiled_render.py [--megapixels 12] [--radius 2] [--repeat N]
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+
+from adjustments import AdjustmentParams, channel_histogram, filter_halo, render_adjustments, render_tiled, tile_layout
+
+PARAMS = AdjustmentParams(1.1, 1.2, 1.3, 1.5, (1.0, 0.9, 1.1, 1.0), 1.2, "模糊")
+
+
+def best_of(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--megapixels", type=float, default=12)
+    parser.add_argument("--radius", type=float, default=2.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    width = int((args.megapixels * 1e6 * 1.5) ** 0.5)
+    height = int(args.megapixels * 1e6 / width)
+    pixels = np.random.default_rng(0).integers(0, 256, (height, width, 4), dtype=np.uint8)
+    image = Image.fromarray(pixels, "RGBA")
+    params = PARAMS._replace(filter_radius=args.radius)
+    histogram = channel_histogram(image)
+
+    baseline = best_of(lambda: render_adjustments(image, params, histogram), args.repeat)
+    print(f"图像 {width}x{height}, 模糊半径 {args.radius}, CPU 核数 {os.cpu_count()}")
+    print(f"{'线程数':>6} {'块大小':>8} {'耗时(s)':>10} {'加速比':>8}")
+    print(f"{'整图':>6} {'-':>8} {baseline:>10.3f} {1.0:>7.2f}x")
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            elapsed = best_of(lambda: render_tiled(image, params, histogram, executor=executor, workers=workers),
+                              args.repeat)
+        tile_size = tile_layout(width, height, filter_halo(params), workers)
+        print(f"{workers:>6} {tile_size or '整图':>8} {elapsed:>10.3f} {baseline / elapsed:>7.2f}x")
+        workers *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# 印章笔刷引擎：沿笔画按间距放置预先生成的笔刷印（dab）
+# 笔刷印按直径和硬度缓存为 Alpha8 图像，每个笔刷印只需一次贴图
+# 笔刷印以流量累积到笔画遮罩上，再按不透明度把颜色合成到笔画开始前的像素上，
+# 所以同一笔画内反复涂抹不会超过设定的不透明度
+import math
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+from PyQt5.QtCore import QPointF, QRect, QRectF
+from PyQt5.QtGui import QColor, QImage, QPainter
+
+# diameter: 直径（像素），hardness/opacity/flow: 0-1，spacing: 相邻笔刷印间距占直径的比例
+BrushSettings = namedtuple("BrushSettings", ["diameter", "hardness", "opacity", "flow", "spacing"])
+
+DAB_CACHE_SIZE = 128
+# 笔画开始前的像素按图块保存，只复制笔画触及的图块
+SNAPSHOT_TILE_SIZE = 128
+# 笔画遮罩只覆盖笔画的外接矩形，扩展时四周多留这么多像素，减少重新分配
+MASK_GROW_MARGIN = 256
+
+
+@lru_cache(maxsize=DAB_CACHE_SIZE)
+def dab_image(diameter, hardness):
+    # 中心到 hardness * 半径 内完全不透明，之后平滑衰减到边缘，边缘抗锯齿
+    size = int(math.ceil(diameter)) + 2
+    radius = diameter / 2
+    offsets = np.arange(size, dtype=np.float32) + 0.5 - size / 2
+    distance = np.hypot(offsets[None, :], offsets[:, None])
+    inner = radius * hardness
+    t = np.clip((distance - inner) / max(radius - inner, 1e-3), 0, 1)
+    alpha = (1 - t * t * (3 - 2 * t)) * np.clip(radius + 0.5 - distance, 0, 1)
+    data = np.ascontiguousarray((alpha * 255 + 0.5).astype(np.uint8))
+    return QImage(data.data, size, size, size, QImage.Format_Alpha8).copy()
+
+
+class DabStroke:
+    def __init__(self, image, settings, color, erase=False):
+        self.image = image
+        self.settings = settings
+        self.color = color
+        self.erase = erase
+        # 笔画开始前的像素，(列, 行) -> 图块；每帧从它重新合成脏区域
+        self.snapshot = {}
+        # 笔画遮罩及其在图层中的位置，随笔画范围扩大
+        self.mask = None
+        self.mask_rect = QRect()
+        # 滑块取整数，按 0.01 量化硬度以提高缓存命中率
+        self.dab = dab_image(float(settings.diameter), round(settings.hardness, 2))
+        self.spacing = max(1.0, settings.diameter * settings.spacing)
+        self.distance = 0.0  # 距离下一个笔刷印的长度
+        self.last_point = None
+        self.dab_count = 0
+
+    def stamp_polyline(self, points):
+        # 沿折线按间距放置笔刷印，间距余量跨调用保留；返回笔画遮罩的脏矩形
+        half = self.dab.width() / 2
+        corners = []  # 各笔刷印左上角的整数坐标
+        for point in points:
+            if self.last_point is None:
+                corners.append((round(point.x() - half), round(point.y() - half)))
+                self.distance = self.spacing
+                self.last_point = point
+                continue
+            delta = point - self.last_point
+            length = math.hypot(delta.x(), delta.y())
+            while self.distance <= length:
+                dab_point = self.last_point + delta * (self.distance / length)
+                corners.append((round(dab_point.x() - half), round(dab_point.y() - half)))
+                self.distance += self.spacing
+            self.distance -= length
+            self.last_point = point
+        if not corners:
+            return QRectF()
+        xs = [x for x, _ in corners]
+        ys = [y for _, y in corners]
+        dirty = QRect(min(xs), min(ys), max(xs) - min(xs) + self.dab.width(), max(ys) - min(ys) + self.dab.height())
+        self.ensure_mask(dirty)
+        painter = QPainter(self.mask)
+        painter.setOpacity(self.settings.flow)
+        left, top = self.mask_rect.x(), self.mask_rect.y()
+        for x, y in corners:
+            painter.drawImage(x - left, y - top, self.dab)
+        painter.end()
+        self.dab_count += len(corners)
+        return QRectF(dirty)
+
+    def ensure_mask(self, rect):
+        # 遮罩不覆盖 rect 时按并集重新分配，旧遮罩原样拷入
+        rect = rect.intersected(self.image.rect())
+        if rect.isEmpty() or self.mask_rect.contains(rect):
+            return
+        margin = MASK_GROW_MARGIN
+        grown = self.mask_rect.united(rect.adjusted(-margin, -margin, margin, margin)).intersected(self.image.rect())
+        mask = QImage(grown.size(), QImage.Format_Alpha8)
+        mask.fill(0)
+        if self.mask is not None:
+            painter = QPainter(mask)
+            painter.setCompositionMode(QPainter.CompositionMode_Source)
+            painter.drawImage(self.mask_rect.topLeft() - grown.topLeft(), self.mask)
+            painter.end()
+        self.mask = mask
+        self.mask_rect = grown
+
+    def capture(self, rect):
+        # 首次触及的图块在合成前复制，之后一直保留笔画开始前的像素
+        size = SNAPSHOT_TILE_SIZE
+        tiles = []
+        for row in range(rect.top() // size, rect.bottom() // size + 1):
+            for column in range(rect.left() // size, rect.right() // size + 1):
+                tile_rect = QRect(column * size, row * size, size, size).intersected(self.image.rect())
+                tile = self.snapshot.get((column, row))
+                if tile is None:
+                    tile = self.snapshot[(column, row)] = self.image.copy(tile_rect)
+                tiles.append((tile_rect, tile))
+        return tiles
+
+    def composite(self, rect):
+        # 图层像素 = 笔画前像素 叠加 (颜色 × 笔画遮罩 × 不透明度)，擦除时改为按遮罩扣除
+        rect = rect.toAlignedRect().intersected(self.image.rect())
+        if rect.isEmpty():
+            return
+        colored = QImage(rect.size(), QImage.Format_ARGB32_Premultiplied)
+        # 擦除强度只取决于遮罩和不透明度，与颜色无关
+        colored.fill(QColor(0, 0, 0) if self.erase else self.color)
+        painter = QPainter(colored)
+        painter.setCompositionMode(QPainter.CompositionMode_DestinationIn)
+        painter.drawImage(0, 0, self.mask, rect.x() - self.mask_rect.x(), rect.y() - self.mask_rect.y(),
+                          rect.width(), rect.height())
+        painter.end()
+
+        tiles = self.capture(rect)
+        painter = QPainter(self.image)
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        for tile_rect, tile in tiles:
+            part = tile_rect.intersected(rect)
+            painter.drawImage(part.topLeft(), tile, part.translated(-tile_rect.topLeft()))
+        if self.erase:
+            painter.setCompositionMode(QPainter.CompositionMode_DestinationOut)
+        else:
+            painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
+        painter.setOpacity(self.settings.opacity)
+        painter.drawImage(rect.topLeft(), colored)
+        painter.end()
@@ -1,72 +1,201 @@
 import sys
 import os
+import argparse
+import glob
 import logging
+import math
+import threading
+import time
+import zlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import numpy as np
 from PyQt5.QtWidgets import (
-    QApplication, QMainWindow, QFileDialog, QAction, QGraphicsView, QGraphicsScene,
+    QApplication, QMainWindow, QFileDialog, QAction, QActionGroup, QGraphicsView, QGraphicsScene,
     QGraphicsPixmapItem, QGraphicsItem, QGraphicsTextItem, QGraphicsRectItem,
     QTreeWidget, QTreeWidgetItem, QDockWidget, QInputDialog, QMessageBox, QToolBar,
     QLabel, QLineEdit, QPushButton, QColorDialog, QFontDialog, QSlider, QHBoxLayout,
     QWidget, QVBoxLayout, QGraphicsEllipseItem, QDialog, QSpinBox, QComboBox, QCheckBox,
-    QPlainTextEdit, QUndoStack, QUndoCommand, QAbstractItemView, QListWidget, QTreeWidgetItemIterator
+    QPlainTextEdit, QUndoStack, QUndoCommand, QAbstractItemView, QListWidget, QTreeView,
+    QProgressBar, QStyle, QStyleOptionGraphicsItem
 )
 from PyQt5.QtGui import (
     QPixmap, QImage, QTransform, QPainter, QColor, QFont, QCursor, QPen, QBrush, QIcon,
-    QWheelEvent, QDoubleValidator, QMouseEvent, QTextCursor, QTextBlockFormat, QKeySequence
+    QWheelEvent, QDoubleValidator, QMouseEvent, QTextCursor, QTextBlockFormat, QKeySequence, QRegion,
+    QGuiApplication, QPainterPath, QPixmapCache
 )
 from PyQt5.QtCore import (
-    Qt, QPointF, QRectF, QBuffer, QIODevice, QThread, pyqtSignal, QObject, QTimer,
-    QLineF, QEvent, QItemSelectionModel, QMimeData
+    Qt, QPointF, QRect, QRectF, QThread, pyqtSignal, QObject, QTimer,
+    QLineF, QEvent, QItemSelectionModel, QMimeData, QSize
 )
-from PIL import Image, ImageEnhance, ImageFilter
-from rembg import remove
-from io import BytesIO
+from background_removal import MODEL_NAMES, DEFAULT_MODEL, PROXY_SIDE, remove_background, session_manager
+from adjustments import (
+    AdjustmentParams, IDENTITY_PARAMS, RADIUS_FILTERS, StageCache, channel_histogram, is_identity,
+    render_adjustments, render_region, render_stack, proxy_factor, scale_params
+)
+from brush_engine import BrushSettings, DabStroke
+from inference_worker import inference_worker
+from pixel_bridge import (
+    qimage_to_numpy, qimage_pixels32, numpy_to_pil, numpy_to_qimage, qpixmap_to_pil, pil_to_qimage
+)
+from layer_model import THUMBNAIL_SIZE, LayerListModel
+from undo_memory import (
+    UNDO_MEMORY_BUDGET, PixmapPayload, TilesPayload, UndoMemoryManager, pixmap_nbytes
+)
+
+# 预设画布尺寸，界面与批处理共用
+PREDEFINED_CANVAS_SIZES = {
+    "1:1": (1000, 1000),
+    "4:3": (1600, 1200),
+    "16:9": (1920, 1080),
+    "9:16": (1080, 1920)  # 默认手机尺寸
+}
+
+# 图层的Z值随列表位置递增；相邻图层Z值之差小于 LAYER_Z_EPSILON 时整体重新编号
+LAYER_Z_EPSILON = 1e-6
+# 裁剪框、旋转句柄等编辑辅助项始终显示在所有图层之上
+OVERLAY_Z_VALUE = 1e9
+# 静态图层按设备坐标缓存为像素图，拖动时只需贴图；像素内容或缩放、旋转变化时才重建
+# 缓存存放在 QPixmapCache 中，默认 10 MB 容不下几十个图层，启动时调大
+LAYER_CACHE_LIMIT_KB = 256 * 1024
+# 缓存只覆盖图层在视口内可见的部分，四周多留这么多设备像素，小幅拖动、滚动时不必重建
+LAYER_CACHE_MARGIN = 256
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# 日志信号桥，后台线程的日志通过排队信号交给GUI线程显示
+class LogSignalBridge(QObject):
+    message = pyqtSignal(str)
+
 # 日志处理器，用于将日志输出到GUI
 class GuiLogger(logging.Handler):
     def __init__(self, widget):
         super().__init__()
         self.widget = widget
+        self.bridge = LogSignalBridge()
+        self.bridge.message.connect(self.widget.appendPlainText)
 
     def emit(self, record):
         msg = self.format(record)
-        self.widget.appendPlainText(msg)
+        self.bridge.message.emit(msg)
 
 # 线程类用于去除背景
 class RemoveBackgroundThread(QThread):
-    finished = pyqtSignal(QPixmap, object)
+    finished = pyqtSignal(QImage, object)
     error = pyqtSignal(str)
 
-    def __init__(self, pixmap, item):
+    def __init__(self, pixmap, item, model_name=DEFAULT_MODEL, proxy_side=None, use_process=False):
         super().__init__()
-        self.pixmap = pixmap
+        # QPixmap 只能在GUI线程使用，这里先转成 QImage
+        self.image = pixmap.toImage()
         self.item = item
+        self.model_name = model_name
+        self.proxy_side = proxy_side
+        self.use_process = use_process
 
     def run(self):
         try:
-            buffer = QBuffer()
-            buffer.open(QIODevice.WriteOnly)
-            self.pixmap.save(buffer, "PNG")
-            input_bytes = buffer.data().data()
+            pixels = qimage_to_numpy(self.image)
+            input_image = numpy_to_pil(pixels)
 
             logging.debug(f"开始去除背景，图层: {self.item.layer_name}")
 
-            # 使用 rembg 去除背景
-            output_bytes = remove(input_bytes)
-            output_image = Image.open(BytesIO(output_bytes)).convert("RGBA")
+            if self.use_process:
+                # 像素经共享内存交给推理进程，本线程只阻塞等待结果
+                output_pixels = inference_worker().remove_background(pixels, self.model_name, self.proxy_side)
+                self.finished.emit(numpy_to_qimage(output_pixels).copy(), self.item)
+                return
 
-            # 转换回QPixmap
-            data = output_image.tobytes("raw", "RGBA")
-            qimage = QImage(data, output_image.width, output_image.height, QImage.Format_RGBA8888)
-            output_pixmap = QPixmap.fromImage(qimage)
+            # 先查蒙版缓存，未命中时使用共享的 rembg 会话推理
+            output_image = remove_background(input_image, self.model_name, pixels, proxy_side=self.proxy_side)
 
-            self.finished.emit(output_pixmap, self.item)
+            # 转换回QImage，由GUI线程生成QPixmap
+            self.finished.emit(pil_to_qimage(output_image), self.item)
         except Exception as e:
             logging.error(f"背景去除失败: {e}")
             self.error.emit(str(e))
 
+# 线程类用于渲染调整预览，只渲染最新一次请求，过期结果直接丢弃
+# 预览渲染所需的底图快照，在GUI线程中创建后随每个请求交给渲染线程：
+# 编辑项之前的调整已渲染进 image，later 为编辑项之后的调整；proxies 与 cache 只由渲染线程填充
+# 切换编辑项时换用新快照，渲染线程手中的旧快照不会被改动
+PreviewSource = namedtuple("PreviewSource", ["image", "histogram", "proxies", "cache", "later"])
+
+
+class PreviewRenderThread(QThread):
+    rendered = pyqtSignal(QImage, QRectF, int, float)
+    error = pyqtSignal(str)
+
+    def __init__(self, render_func):
+        super().__init__()
+        self.render_func = render_func
+        self.condition = threading.Condition()
+        self.pending = None
+        self.stopped = False
+
+    def request(self, generation, source, params, region, input_time):
+        with self.condition:
+            # 新请求直接覆盖尚未开始的旧请求
+            self.pending = (generation, source, params, region, input_time)
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.pending = None
+            self.condition.notify()
+        self.wait()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                generation, source, params, region, input_time = self.pending
+                self.pending = None
+            try:
+                image, rect = self.render_func(source, params, region)
+            except Exception as e:
+                logging.error(f"预览渲染失败: {e}")
+                self.error.emit(str(e))
+                continue
+            with self.condition:
+                # 渲染期间已有更新的请求，本次结果已过期
+                stale = self.pending is not None or self.stopped
+            if not stale:
+                self.rendered.emit(image, rect, generation, input_time)
+
+# 线程类用于确认调整时渲染全分辨率结果
+class FullRenderThread(QThread):
+    progress = pyqtSignal(int)
+    finished = pyqtSignal(QImage)
+    error = pyqtSignal(str)
+
+    def __init__(self, image, adjustments, histogram):
+        super().__init__()
+        self.image = image
+        self.adjustments = adjustments
+        self.histogram = histogram
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+        self.wait()
+
+    def run(self):
+        try:
+            result = render_stack(self.image, self.adjustments, self.histogram,
+                                  progress=self.progress.emit, cancelled=lambda: self.cancelled)
+            if result is not None:
+                self.finished.emit(pil_to_qimage(result))
+        except Exception as e:
+            logging.error(f"全分辨率渲染失败: {e}")
+            self.error.emit(str(e))
+
 # 自定义图层类型，支持选中时显示边框和拖动缩放
 class ResizableGraphicsPixmapItem(QGraphicsPixmapItem):
     def __init__(self, pixmap, layer_name):
@@ -74,7 +203,8 @@ class ResizableGraphicsPixmapItem(QGraphicsPixmapItem):
         self.setFlags(
             QGraphicsItem.ItemIsSelectable |
             QGraphicsItem.ItemIsMovable |
-            QGraphicsItem.ItemSendsGeometryChanges
+            QGraphicsItem.ItemSendsGeometryChanges |
+            QGraphicsItem.ItemUsesExtendedStyleOption
         )
         self.setAcceptHoverEvents(True)
         self.layer_name = layer_name
@@ -85,6 +215,24 @@ class ResizableGraphicsPixmapItem(QGraphicsPixmapItem):
         self.setTransformOriginPoint(self.rotation_center)
         self.scale_factor = 1.0
         self.show_border = True  # 底图边框显示开关
+        # 调整预览，覆盖在原图的 preview_rect 区域上绘制，不改变图层尺寸
+        self.preview_pixmap = None
+        self.preview_rect = None
+        # 非破坏性调整：不可变的源图加有序的调整栈，显示的像素按需渲染并缓存
+        self.source_pixmap = pixmap
+        self.adjustments = []
+        self.render_dirty = False
+        # 显示时在后台线程渲染调整栈，完成前继续显示上一次渲染的像素；源图或调整栈变化时代数递增
+        self.render_thread = None
+        self.render_generation = 0
+        self.render_failed = None
+        self.render_listener = None  # 后台渲染完成后通知，由编辑器设置
+        # 画笔的持久后备图像：笔画直接画在 QImage 上，只重绘脏矩形，读取像素时再同步为 QPixmap
+        self.paint_image = None
+        self.paint_dirty = False
+        # 设备坐标缓存：由编辑器按“缓存静态图层”开关设置
+        self.device_caching = False
+        self.device_cache_key = None
 
     def hoverMoveEvent(self, event):
         if not self.locked:
@@ -101,23 +249,265 @@ class ResizableGraphicsPixmapItem(QGraphicsPixmapItem):
             self.setCursor(Qt.OpenHandCursor)
         super().mouseReleaseEvent(event)
 
+    def setPixmap(self, pixmap):
+        # 直接替换像素（去除背景、裁剪等）时，新像素成为源图，原有调整视为已烘焙
+        self.paint_image = None
+        self.paint_dirty = False
+        self.source_pixmap = pixmap
+        self.adjustments = []
+        self.render_dirty = False
+        self.cancel_render()
+        super().setPixmap(pixmap)
+
+    def pixmap(self):
+        self.sync_painted()
+        self.ensure_rendered()
+        return super().pixmap()
+
+    def displayed_image(self):
+        # 当前显示的像素，不触发同步或渲染；QImage 隐式共享，之后写入时各自分离
+        if self.paint_dirty:
+            return QImage(self.paint_image)
+        if self.render_dirty and not self.adjustments:
+            return self.source_pixmap.toImage()
+        return QGraphicsPixmapItem.pixmap(self).toImage()
+
+    def backing_image(self):
+        if self.paint_image is None:
+            self.paint_image = self.pixmap().toImage().convertToFormat(QImage.Format_ARGB32_Premultiplied)
+        return self.paint_image
+
+    def mark_painted(self, rect):
+        self.paint_dirty = True
+        self.update(rect)
+
+    def sync_painted(self):
+        # 画笔绘制的结果成为新的源图，与直接替换像素一致
+        if not self.paint_dirty:
+            return
+        self.paint_dirty = False
+        pixmap = QPixmap.fromImage(self.paint_image)
+        self.source_pixmap = pixmap
+        self.adjustments = []
+        self.render_dirty = False
+        self.cancel_render()
+        QGraphicsPixmapItem.setPixmap(self, pixmap)
+
+    def set_adjustments(self, adjustments, rendered=None):
+        self.sync_painted()
+        # 调整改变了显示的像素，画笔的后备图像需要重新创建
+        self.paint_image = None
+        adjustments = list(adjustments)
+        if rendered is not None:
+            # 调用方已渲染好结果，直接作为缓存
+            self.adjustments = adjustments
+            self.render_dirty = False
+            self.cancel_render()
+            QGraphicsPixmapItem.setPixmap(self, rendered)
+            return
+        if adjustments == self.adjustments:
+            return
+        self.adjustments = adjustments
+        self.render_dirty = True
+        self.cancel_render()
+        self.update()
+
+    def cancel_render(self):
+        # 源图或调整栈已变化，正在进行的后台渲染作废
+        self.render_generation += 1
+        if self.render_thread is not None:
+            self.render_thread.cancel()
+            self.render_thread = None
+
+    def schedule_render(self):
+        # 绘制时不在界面线程渲染整幅调整栈，交给后台线程，完成后替换显示的像素
+        if self.render_thread is not None or self.render_failed == self.render_generation:
+            return
+        thread = FullRenderThread(qpixmap_to_pil(self.source_pixmap), list(self.adjustments), None)
+        generation = self.render_generation
+        thread.finished.connect(lambda image: self.on_render_finished(thread, generation, image))
+        thread.error.connect(lambda error_message: self.on_render_error(thread, generation))
+        self.render_thread = thread
+        thread.start()
+
+    def on_render_finished(self, thread, generation, image):
+        if thread is not self.render_thread:
+            return
+        thread.wait()
+        self.render_thread = None
+        if generation != self.render_generation or not self.render_dirty:
+            return
+        self.render_dirty = False
+        QGraphicsPixmapItem.setPixmap(self, QPixmap.fromImage(image))
+        logging.debug(f"后台渲染调整栈完成: {self.layer_name} ({len(self.adjustments)} 项)")
+        if self.render_listener is not None:
+            self.render_listener(self)
+
+    def on_render_error(self, thread, generation):
+        if thread is not self.render_thread:
+            return
+        thread.wait()
+        self.render_thread = None
+        # 同一状态不再重试，读取像素时仍会同步渲染
+        self.render_failed = generation
+
+    def show_rendered(self, widget):
+        # 视口绘制只使用已有的像素：没有调整时直接显示源图，否则安排后台渲染
+        # 导出等离屏绘制（scene.render 没有 widget）需要准确像素，同步渲染
+        if not self.render_dirty:
+            return
+        if self.adjustments and widget is not None:
+            self.schedule_render()
+        else:
+            self.ensure_rendered()
+
+    def ensure_rendered(self):
+        # 需要准确像素时（读取、合并、保存）同步渲染
+        if not self.render_dirty:
+            return
+        self.render_dirty = False
+        self.cancel_render()
+        if not self.adjustments:
+            QGraphicsPixmapItem.setPixmap(self, self.source_pixmap)
+            return
+        result = render_stack(qpixmap_to_pil(self.source_pixmap), self.adjustments)
+        QGraphicsPixmapItem.setPixmap(self, QPixmap.fromImage(pil_to_qimage(result)))
+        logging.debug(f"重新渲染调整栈: {self.layer_name} ({len(self.adjustments)} 项)")
+
+    def pixel_nbytes(self):
+        # 源图加调整后的渲染缓存、画笔后备图像
+        total = pixmap_nbytes(self.source_pixmap)
+        if self.adjustments:
+            total += pixmap_nbytes(QGraphicsPixmapItem.pixmap(self))
+        if self.paint_image is not None:
+            total += self.paint_image.sizeInBytes()
+        return total
+
+    def release_pixels(self):
+        # 撤销栈换出不在场景中的图层：交出源图并释放像素，调整栈和几何信息保留
+        self.sync_painted()
+        source = self.source_pixmap
+        self.paint_image = None
+        self.source_pixmap = QPixmap()
+        self.render_dirty = False
+        self.cancel_render()
+        QGraphicsPixmapItem.setPixmap(self, QPixmap())
+        return source
+
+    def restore_pixels(self, source):
+        self.cancel_render()
+        self.source_pixmap = source
+        QGraphicsPixmapItem.setPixmap(self, source)
+        # 有调整时在下次显示或读取像素时重新渲染
+        self.render_dirty = bool(self.adjustments)
+
+    def set_preview(self, pixmap, rect):
+        self.preview_pixmap = pixmap
+        self.preview_rect = rect
+        self.update()
+
+    def clear_preview(self):
+        if self.preview_pixmap is not None:
+            self.preview_pixmap = None
+            self.preview_rect = None
+            self.update()
+
     def paint(self, painter, option, widget):
-        super().paint(painter, option, widget)
-        if self.layer_name == "底图" and self.show_border:
-            # 绘制底图边框
-            pen = QPen(Qt.blue, 2, Qt.SolidLine)
-            painter.setPen(pen)
-            painter.setBrush(Qt.NoBrush)
-            painter.drawRect(self.boundingRect())
-        if self.isSelected():
-            pen = QPen(Qt.red, 2, Qt.DashLine)
-            painter.setPen(pen)
-            painter.setBrush(Qt.NoBrush)
-            painter.drawRect(self.boundingRect())
+        if self.paint_dirty:
+            # 画笔绘制中，只从后备图像绘制需要重绘的区域
+            exposed = option.exposedRect.intersected(QRectF(self.paint_image.rect()))
+            painter.drawImage(exposed, self.paint_image, exposed)
+        elif self.preview_pixmap is not None:
+            self.show_rendered(widget)
+            full_rect = QRectF(QGraphicsPixmapItem.pixmap(self).rect())
+            if self.preview_rect != full_rect:
+                # 局部预览之外的区域仍显示原图
+                painter.save()
+                painter.setClipRegion(QRegion(full_rect.toAlignedRect()).subtracted(QRegion(self.preview_rect.toAlignedRect())))
+                super().paint(painter, content_option(option), widget)
+                painter.restore()
+            painter.drawPixmap(self.preview_rect, self.preview_pixmap, QRectF(self.preview_pixmap.rect()))
+        else:
+            self.show_rendered(widget)
+            # 设备坐标缓存只用于视口，离屏绘制的变换各不相同，直接绘制
+            if not (self.device_caching and widget is not None and self.paint_cached(painter, widget)):
+                super().paint(painter, content_option(option), widget)
+        # 底图边框和选中框由视图在前景层绘制，图层内容的缓存与选中状态无关
+
+    def paint_cached(self, painter, widget):
+        # Qt 自带的 DeviceCoordinateCache 遇到任意角度旋转会每帧重建缓存，这里自行按设备坐标缓存：
+        # 键只包含像素内容和变换的线性部分，平移（拖动、滚动）时按整像素偏移贴图
+        view = widget.parentWidget()
+        if not isinstance(view, GraphicsView):
+            return False
+        transform = painter.worldTransform()
+        visible = transform.mapRect(self.boundingRect()).toAlignedRect().intersected(widget.rect())
+        if visible.isEmpty():
+            return False
+        ratio = painter.device().devicePixelRatioF()
+        offset = self.offset()
+        key = (f"layer-{id(self)}-{QGraphicsPixmapItem.pixmap(self).cacheKey()}-{int(self.transformationMode())}-"
+               f"{offset.x()},{offset.y()}-{transform.m11():.6f},{transform.m12():.6f},{transform.m21():.6f},{transform.m22():.6f}-{ratio}")
+        cached = None
+        if self.device_cache_key is not None and self.device_cache_key[0] == key:
+            cached = QPixmapCache.find(key)
+        if cached is not None:
+            _, cache_rect, dx, dy = self.device_cache_key
+            shift_x, shift_y = round(transform.dx() - dx), round(transform.dy() - dy)
+            if not cache_rect.translated(shift_x, shift_y).contains(visible):
+                # 平移后露出了缓存之外的部分
+                cached = None
+        if cached is None:
+            margin = LAYER_CACHE_MARGIN
+            cache_rect = transform.mapRect(self.boundingRect()).toAlignedRect().intersected(
+                widget.rect().adjusted(-margin, -margin, margin, margin))
+            nbytes = math.ceil(cache_rect.width() * ratio) * math.ceil(cache_rect.height() * ratio) * 4
+        else:
+            nbytes = cached.width() * cached.height() * 4
+        # 一帧内用到的缓存总量超过 QPixmapCache 的容量时，各图层的缓存会在每帧互相挤出；
+        # 预算取容量的一半，给平移时可见面积的变化和其它缓存留出余量，超出预算后其余图层本帧直接绘制
+        if view.layer_cache_bytes + nbytes > QPixmapCache.cacheLimit() * 1024 // 2:
+            if self.device_cache_key is not None:
+                QPixmapCache.remove(self.device_cache_key[0])
+                self.device_cache_key = None
+            return False
+        view.layer_cache_bytes += nbytes
+        if cached is None:
+            if self.device_cache_key is not None:
+                QPixmapCache.remove(self.device_cache_key[0])
+            cached = QPixmap(cache_rect.size() * ratio)
+            cached.setDevicePixelRatio(ratio)
+            cached.fill(Qt.transparent)
+            cache_painter = QPainter(cached)
+            cache_painter.setRenderHints(painter.renderHints())
+            cache_painter.setWorldTransform(transform * QTransform.fromTranslate(-cache_rect.x(), -cache_rect.y()))
+            option = QStyleOptionGraphicsItem()
+            option.exposedRect = self.boundingRect()
+            super().paint(cache_painter, option, widget)
+            cache_painter.end()
+            QPixmapCache.insert(key, cached)
+            self.device_cache_key = (key, cache_rect, transform.dx(), transform.dy())
+            shift_x = shift_y = 0
+        painter.save()
+        painter.setWorldTransform(QTransform())
+        painter.drawPixmap(QPointF(cache_rect.x() + shift_x, cache_rect.y() + shift_y), cached)
+        painter.restore()
+        return True
 
     # 添加 render 方法以支持图层合并
     def render(self, painter, option=None, widget=None):
-        super().paint(painter, option, widget)
+        self.sync_painted()
+        self.ensure_rendered()
+        # QGraphicsPixmapItem.paint 会读取 option，不能传空
+        super().paint(painter, option or QStyleOptionGraphicsItem(), widget)
+
+# 图层只绘制内容：去掉选中状态，Qt 默认的选中虚线框改由视图的前景层绘制
+def content_option(option):
+    if not option.state & QStyle.State_Selected:
+        return option
+    option = QStyleOptionGraphicsItem(option)
+    option.state &= ~QStyle.State_Selected
+    return option
 
 # 自定义文字图层
 class ResizableGraphicsTextItem(QGraphicsTextItem):
@@ -168,7 +558,7 @@ class ResizableGraphicsTextItem(QGraphicsTextItem):
         painter.setBrush(QBrush(self.background_color))
         painter.setPen(Qt.NoPen)
         painter.drawRect(self.boundingRect())
-        super().paint(painter, option, widget)
+        super().paint(painter, content_option(option), widget)
 
     def set_background_color(self, color):
         self.background_color = color
@@ -206,6 +596,7 @@ class CropOverlay(QGraphicsRectItem):
         self.setAcceptHoverEvents(True)
         self.setFlag(QGraphicsItem.ItemIsMovable, True)
         self.setFlag(QGraphicsItem.ItemIsSelectable, True)
+        self.setZValue(OVERLAY_Z_VALUE)
         self.setFlag(QGraphicsItem.ItemSendsGeometryChanges, True)
         self.updateHandlesPos()
 
@@ -301,7 +692,7 @@ class RotationHandle(QGraphicsEllipseItem):
         self.setBrush(QBrush(Qt.blue))
         self.setFlags(QGraphicsItem.ItemIsMovable | QGraphicsItem.ItemSendsScenePositionChanges)
         self.setCursor(Qt.SizeAllCursor)
-        self.setZValue(parent_item.zValue() + 1)  # 确保在父项之上显示
+        self.setZValue(OVERLAY_Z_VALUE)  # 确保在所有图层之上显示
 
     def itemChange(self, change, value):
         if change == QGraphicsItem.ItemPositionChange:
@@ -341,8 +732,32 @@ class BrushTool(QWidget):
         self.mode_btn.clicked.connect(self.toggle_mode)
         layout.addWidget(self.mode_btn)
 
+        # 笔刷类型：硬边画笔或印章笔刷
+        self.brush_type_combo = QComboBox()
+        self.brush_type_combo.addItems(["硬边", "印章"])
+        self.brush_type_combo.currentIndexChanged.connect(self.update_stamp_controls)
+        layout.addWidget(QLabel("笔刷:"))
+        layout.addWidget(self.brush_type_combo)
+
+        # 印章笔刷参数（百分比）
+        self.stamp_sliders = {}
+        for key, label, value in (("hardness", "硬度", 50), ("opacity", "不透明度", 100),
+                                  ("flow", "流量", 50), ("spacing", "间距", 10)):
+            slider = QSlider(Qt.Horizontal)
+            slider.setRange(1, 100)
+            slider.setValue(value)
+            layout.addWidget(QLabel(f"{label}:"))
+            layout.addWidget(slider)
+            self.stamp_sliders[key] = slider
+        self.update_stamp_controls()
+
         self.setLayout(layout)
 
+    def update_stamp_controls(self):
+        enabled = self.brush_type_combo.currentText() == "印章"
+        for slider in self.stamp_sliders.values():
+            slider.setEnabled(enabled)
+
     def choose_color(self):
         color = QColorDialog.getColor()
         if color.isValid():
@@ -357,6 +772,196 @@ class BrushTool(QWidget):
             self.mode = 'draw'
             self.mode_btn.setText("模式: 绘画")
 
+    def pen(self):
+        return QPen(self.current_color, self.size_slider.value(), Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin)
+
+    def composition_mode(self):
+        if self.mode == 'erase':
+            return QPainter.CompositionMode_Clear
+        return QPainter.CompositionMode_SourceOver
+
+    def brush_settings(self):
+        # 硬边画笔返回 None
+        if self.brush_type_combo.currentText() != "印章":
+            return None
+        values = {key: slider.value() / 100 for key, slider in self.stamp_sliders.items()}
+        return BrushSettings(self.size_slider.value(), values["hardness"], values["opacity"], values["flow"],
+                             values["spacing"])
+
+# 笔画引擎：缓冲鼠标输入点，平滑后用 Catmull-Rom 样条插值，每个显示帧只绘制一次
+class StrokeEngine(QObject):
+    # 新输入点的权重，越小越平滑但跟手性越差
+    SMOOTHING = 0.5
+    # 与上一个点距离小于该值（图层像素）的输入点直接丢弃
+    MIN_DISTANCE = 0.5
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.flush)
+        self.layer = None
+        self.pen = None
+        self.composition_mode = None
+        self.points = []
+        self.drawn = 0  # 下一段待绘制线段的起点下标
+        self.paint_count = 0
+        self.recorder = None
+        self.dab_stroke = None
+
+    def is_active(self):
+        return self.layer is not None
+
+    def begin(self, layer, scene_point, pen, composition_mode, brush=None):
+        # brush 为 BrushSettings 时使用印章笔刷，否则用 pen 描绘路径
+        self.layer = layer
+        self.pen = pen
+        self.composition_mode = composition_mode
+        self.points = [layer.mapFromScene(scene_point)]
+        self.drawn = 0
+        self.recorder = TileRecorder(layer)
+        self.dab_stroke = None
+        if brush is not None:
+            self.dab_stroke = DabStroke(layer.backing_image(), brush, pen.color(),
+                                        composition_mode == QPainter.CompositionMode_Clear)
+        # 按屏幕刷新率确定帧间隔
+        screen = QGuiApplication.primaryScreen()
+        refresh_rate = screen.refreshRate() if screen else 60.0
+        self.timer.start(max(1, int(1000 / (refresh_rate or 60.0))))
+
+    def add_point(self, scene_point):
+        if self.layer is None:
+            return
+        point = self.layer.mapFromScene(scene_point)
+        last = self.points[-1]
+        smoothed = last + (point - last) * self.SMOOTHING
+        if QLineF(last, smoothed).length() >= self.MIN_DISTANCE:
+            self.points.append(smoothed)
+
+    def end(self, scene_point=None):
+        # 返回记录了本次笔画触及图块的 TileRecorder，没有笔画时返回 None
+        if self.layer is None:
+            return None
+        if scene_point is not None:
+            # 抬笔时补上真实的终点，消除平滑带来的滞后
+            point = self.layer.mapFromScene(scene_point)
+            if QLineF(self.points[-1], point).length() >= self.MIN_DISTANCE:
+                self.points.append(point)
+        self.flush(final=True)
+        self.timer.stop()
+        recorder = self.recorder
+        self.layer = None
+        self.points = []
+        self.recorder = None
+        self.dab_stroke = None
+        return recorder
+
+    def flush(self, final=False):
+        points = self.points
+        # 线段 i -> i+1 需要下一个点 i+2 确定切线，最后一段等到抬笔时再画
+        last_segment = len(points) - 1 if final else len(points) - 2
+        path = QPainterPath()
+        # 单击只画一个点
+        dot = points[0] if final and len(points) == 1 else None
+        for i in range(self.drawn, last_segment):
+            p0 = points[max(i - 1, 0)]
+            p1 = points[i]
+            p2 = points[i + 1]
+            p3 = points[min(i + 2, len(points) - 1)]
+            if i == self.drawn:
+                path.moveTo(p1)
+            path.cubicTo(p1 + (p2 - p0) / 6, p2 - (p3 - p1) / 6, p2)
+        if path.isEmpty() and dot is None:
+            return
+        self.drawn = max(self.drawn, last_segment)
+        # 只保留后续线段计算切线所需的点
+        if self.drawn > 1:
+            del points[:self.drawn - 1]
+            self.drawn = 1
+
+        if self.dab_stroke is not None:
+            self.flush_dabs(path, dot)
+            return
+        rect = QRectF(dot, dot) if dot is not None else path.controlPointRect()
+        margin = self.pen.widthF() / 2 + 1
+        rect = rect.adjusted(-margin, -margin, margin, margin)
+        # 落笔前保存将被修改的图块
+        self.recorder.capture(rect)
+        painter = QPainter(self.layer.backing_image())
+        painter.setCompositionMode(self.composition_mode)
+        painter.setPen(self.pen)
+        if dot is not None:
+            painter.drawPoint(dot)
+        else:
+            painter.drawPath(path)
+        painter.end()
+        self.paint_count += 1
+        self.layer.mark_painted(rect)
+
+    def flush_dabs(self, path, dot):
+        # 笔刷印先累积到笔画遮罩，再只合成遮罩变化的区域
+        if dot is not None:
+            polyline = [dot]
+        else:
+            # 复制坐标：迭代 QPolygonF 得到的是内部元素的引用，多边形释放后会失效
+            polyline = [QPointF(point) for polygon in path.toSubpathPolygons() for point in polygon]
+        rect = self.dab_stroke.stamp_polyline(polyline)
+        if rect.isEmpty():
+            return
+        self.recorder.capture(rect)
+        self.dab_stroke.composite(rect)
+        self.paint_count += 1
+        self.layer.mark_painted(rect)
+
+# 图块差分记录：编辑前保存将被修改的图块，编辑后再取同一批图块，均按图块压缩保存
+class TileRecorder:
+    TILE_SIZE = 128
+
+    def __init__(self, layer):
+        self.layer = layer
+        # 图层有尚未烘焙的调整栈时，笔画画在调整后的像素上，同步时调整栈会烘焙进源图；
+        # 记下笔画前的源图和调整栈，撤销时原样恢复，而不是只还原图块
+        self.source_pixmap = None
+        self.adjustments = []
+        if layer.adjustments and not layer.paint_dirty:
+            self.source_pixmap = layer.source_pixmap
+            self.adjustments = list(layer.adjustments)
+        self.image = layer.backing_image()
+        self.before = {}  # (列, 行) -> 压缩的修改前像素
+
+    def tile_rect(self, key):
+        size = self.TILE_SIZE
+        return QRect(key[0] * size, key[1] * size, size, size).intersected(self.image.rect())
+
+    def tiles_in(self, rect):
+        rect = rect.toAlignedRect().intersected(self.image.rect())
+        if rect.isEmpty():
+            return []
+        size = self.TILE_SIZE
+        return [(column, row)
+                for row in range(rect.top() // size, rect.bottom() // size + 1)
+                for column in range(rect.left() // size, rect.right() // size + 1)]
+
+    def read_tile(self, pixels, key):
+        rect = self.tile_rect(key)
+        tile = pixels[rect.top():rect.bottom() + 1, rect.left():rect.right() + 1]
+        return zlib.compress(tile.tobytes(), 1)
+
+    def capture(self, rect):
+        keys = [key for key in self.tiles_in(rect) if key not in self.before]
+        if not keys:
+            return
+        pixels = qimage_pixels32(self.image)
+        for key in keys:
+            self.before[key] = self.read_tile(pixels, key)
+
+    def is_empty(self):
+        return not self.before
+
+    def tiles(self):
+        # (列, 行) -> (修改前, 修改后)
+        pixels = qimage_pixels32(self.image)
+        return {key: (before, self.read_tile(pixels, key)) for key, before in self.before.items()}
+
 # 调整对话框
 class AdjustmentDialog(QDialog):
     def __init__(self, item, parent=None):
@@ -371,15 +976,42 @@ class AdjustmentDialog(QDialog):
         self.original_pixmap = None
         self.original_text = None
         self.preview_timer = None
+        self.preview_source = None  # 当前编辑项的预览底图快照
+        self.preview_thread = None
+        self.full_render_thread = None
+        self.preview_generation = 0  # 每次参数变化递增
+        self.submitted_generation = 0  # 最近一次提交渲染的参数版本，用于识别过期结果
+        self.drawn_generation = 0
+        self.last_input_time = 0.0
+        # 正在编辑的调整栈副本，edit_index 等于栈长度时表示新建一项
+        self.adjustments = []
+        self.edit_index = 0
+        self.new_adjustments = None
 
         if isinstance(item, ResizableGraphicsPixmapItem):
-            self.original_pixmap = item.pixmap()
+            # 先同步画笔尚未写回的像素
+            item.sync_painted()
+            self.original_pixmap = item.source_pixmap
+            self.adjustments = list(item.adjustments)
+            self.edit_index = max(0, len(self.adjustments) - 1)
             self.init_image_adjustments()
         elif isinstance(item, ResizableGraphicsTextItem):
             self.original_text = item.toHtml()
             self.init_text_adjustments()
 
     def init_image_adjustments(self):
+        # 调整栈：选择要编辑的调整项，预览始终从源图重新渲染
+        stack_label = QLabel("调整记录")
+        self.stack_combo = QComboBox()
+        self.stack_combo.currentIndexChanged.connect(self.select_adjustment)
+        self.delete_adjustment_btn = QPushButton("删除此调整")
+        self.delete_adjustment_btn.clicked.connect(self.delete_adjustment)
+        stack_layout = QHBoxLayout()
+        stack_layout.addWidget(self.stack_combo)
+        stack_layout.addWidget(self.delete_adjustment_btn)
+        self.layout.addWidget(stack_label)
+        self.layout.addLayout(stack_layout)
+
         # 对比度
         contrast_label = QLabel("对比度")
         self.contrast_slider = QSlider(Qt.Horizontal)
@@ -446,20 +1078,101 @@ class AdjustmentDialog(QDialog):
         self.filter_combo.addItem("模糊")
         self.filter_combo.addItem("锐化")
         self.filter_combo.addItem("浮雕")
+        self.filter_combo.addItem("方框模糊")
         self.filter_combo.currentIndexChanged.connect(self.update_preview)
         self.layout.addWidget(filter_label)
         self.layout.addWidget(self.filter_combo)
 
+        # 模糊/锐化半径，滑块值为半径的 10 倍
+        self.radius_label = QLabel("半径")
+        self.radius_slider = QSlider(Qt.Horizontal)
+        self.radius_slider.setRange(5, 1000)
+        self.radius_slider.setValue(20)
+        self.radius_slider.valueChanged.connect(self.update_preview)
+        self.filter_combo.currentIndexChanged.connect(self.update_radius_enabled)
+        self.layout.addWidget(self.radius_label)
+        self.layout.addWidget(self.radius_slider)
+        self.update_radius_enabled()
+
+        # 预览延迟显示
+        self.latency_label = QLabel("预览延迟: -")
+        self.layout.addWidget(self.latency_label)
+
+        # 全分辨率渲染进度
+        self.render_progress = QProgressBar()
+        self.render_progress.setRange(0, 100)
+        self.render_progress.hide()
+        self.layout.addWidget(self.render_progress)
+
+        # 合并短时间内的滑块事件，最多每个间隔提交一次渲染
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(30)
+        self.preview_timer.timeout.connect(self.submit_preview)
+
         # 按钮
         button_layout = QHBoxLayout()
-        apply_btn = QPushButton("确定")
-        apply_btn.clicked.connect(self.apply_adjustments)
+        self.apply_btn = QPushButton("确定")
+        self.apply_btn.clicked.connect(self.apply_adjustments)
         cancel_btn = QPushButton("取消")
         cancel_btn.clicked.connect(self.cancel_adjustments)
-        button_layout.addWidget(apply_btn)
+        button_layout.addWidget(self.apply_btn)
         button_layout.addWidget(cancel_btn)
         self.layout.addLayout(button_layout)
 
+        self.refresh_stack_combo()
+
+    def refresh_stack_combo(self):
+        self.stack_combo.blockSignals(True)
+        self.stack_combo.clear()
+        for index in range(len(self.adjustments)):
+            self.stack_combo.addItem(f"调整 {index + 1}")
+        self.stack_combo.addItem("新建调整")
+        self.stack_combo.setCurrentIndex(self.edit_index)
+        self.stack_combo.blockSignals(False)
+        self.select_adjustment(self.edit_index)
+
+    def select_adjustment(self, index):
+        if index < 0:
+            return
+        self.edit_index = index
+        self.delete_adjustment_btn.setEnabled(index < len(self.adjustments))
+        # 编辑项之前的调整构成新的预览底图，下次提交时重建快照；旧底图上仍在途的结果全部过期
+        self.preview_source = None
+        self.submitted_generation = -1
+        params = self.adjustments[index] if index < len(self.adjustments) else IDENTITY_PARAMS
+        self.load_params(params)
+        self.update_preview()
+
+    def delete_adjustment(self):
+        if self.edit_index < len(self.adjustments):
+            del self.adjustments[self.edit_index]
+            self.edit_index = max(0, min(self.edit_index, len(self.adjustments) - 1))
+            self.refresh_stack_combo()
+
+    def update_radius_enabled(self):
+        enabled = self.filter_combo.currentText() in RADIUS_FILTERS
+        self.radius_label.setEnabled(enabled)
+        self.radius_slider.setEnabled(enabled)
+
+    def load_params(self, params):
+        widgets = [self.brightness_slider, self.contrast_slider, self.saturation_slider, self.sharpen_slider,
+                   self.gamma_slider, self.filter_combo, self.radius_slider] + self.rgba_sliders
+        for widget in widgets:
+            widget.blockSignals(True)
+        self.brightness_slider.setValue(round(params.brightness * 100))
+        self.contrast_slider.setValue(round(params.contrast * 100))
+        self.saturation_slider.setValue(round(params.saturation * 100))
+        self.sharpen_slider.setValue(round(params.sharpness * 100))
+        self.gamma_slider.setValue(round(params.gamma * 100))
+        for slider, gain in zip(self.rgba_sliders, params.rgba):
+            slider.setValue(round(gain * 100))
+        self.filter_combo.setCurrentText(params.filter_name)
+        self.radius_slider.setValue(round(params.filter_radius * 10))
+        for widget in widgets:
+            widget.blockSignals(False)
+        self.update_radius_enabled()
+
     def init_text_adjustments(self):
         # 字体选择
         font_label = QLabel("字体:")
@@ -532,55 +1245,11 @@ class AdjustmentDialog(QDialog):
 
     def update_preview(self):
         if isinstance(self.item, ResizableGraphicsPixmapItem):
-            # 临时应用调整
-            contrast = self.contrast_slider.value() / 100
-            brightness = self.brightness_slider.value() / 100
-            saturation = self.saturation_slider.value() / 100
-            sharpen = self.sharpen_slider.value() / 100
-            gamma = self.gamma_slider.value() / 100
-
-            pil_image = self.qpixmap_to_pil(self.original_pixmap)
-
-            # 调整亮度
-            enhancer = ImageEnhance.Brightness(pil_image)
-            pil_image = enhancer.enhance(brightness)
-
-            # 调整对比度
-            enhancer = ImageEnhance.Contrast(pil_image)
-            pil_image = enhancer.enhance(contrast)
-
-            # 调整饱和度
-            enhancer = ImageEnhance.Color(pil_image)
-            pil_image = enhancer.enhance(saturation)
-
-            # 调整锐化
-            enhancer = ImageEnhance.Sharpness(pil_image)
-            pil_image = enhancer.enhance(sharpen)
-
-            # RGBA 调整
-            rgba_values = [slider.value() / 100 for slider in self.rgba_sliders]
-            r, g, b, a = pil_image.split()
-            r = r.point(lambda i: i * rgba_values[0])
-            g = g.point(lambda i: i * rgba_values[1])
-            b = b.point(lambda i: i * rgba_values[2])
-            a = a.point(lambda i: i * rgba_values[3])
-            pil_image = Image.merge('RGBA', (r, g, b, a))
-
-            # Gamma 调整
-            pil_image = pil_image.point(lambda i: ((i / 255.0) ** (1 / gamma)) * 255)
-
-            # 滤镜
-            filter_name = self.filter_combo.currentText()
-            if filter_name == "模糊":
-                pil_image = pil_image.filter(ImageFilter.BLUR)
-            elif filter_name == "锐化":
-                pil_image = pil_image.filter(ImageFilter.SHARPEN)
-            elif filter_name == "浮雕":
-                pil_image = pil_image.filter(ImageFilter.EMBOSS)
-
-            # 更新图层
-            qimage = self.pil_image_to_qimage(pil_image)
-            self.item.setPixmap(QPixmap.fromImage(qimage))
+            # 只记录参数变化，渲染交给后台线程
+            self.preview_generation += 1
+            self.last_input_time = time.perf_counter()
+            if not self.preview_timer.isActive():
+                self.preview_timer.start()
 
         elif isinstance(self.item, ResizableGraphicsTextItem):
             font = self.item.font()
@@ -597,12 +1266,158 @@ class AdjustmentDialog(QDialog):
             alignment = self.align_combo.currentIndex()
             self.change_alignment(self.item, alignment)
 
+    def ensure_source_image(self):
+        # 源图转换必须在GUI线程完成；编辑项之前的调整先渲染进底图，只做一次
+        if self.preview_source is None:
+            image = self.qpixmap_to_pil(self.original_pixmap)
+            image = render_stack(image, self.adjustments[:self.edit_index])
+            # 预览流水线各阶段的中间结果缓存在快照里，随快照一起失效
+            self.preview_source = PreviewSource(image, channel_histogram(image), {}, StageCache(),
+                                                tuple(self.adjustments[self.edit_index + 1:]))
+        return self.preview_source
+
+    def preview_region(self):
+        # 根据当前视图变换决定预览方式：缩小显示时用代理图，放大显示时只处理可见区域
+        full_rect = self.original_pixmap.rect()
+        scene = self.item.scene()
+        if scene is None or not scene.views():
+            return 1, full_rect
+        view = scene.views()[0]
+        transform = self.item.deviceTransform(view.viewportTransform())
+        display_scale = math.hypot(transform.m11(), transform.m12())
+        if display_scale < 1.0:
+            return proxy_factor(display_scale), full_rect
+        visible = self.item.mapFromScene(view.mapToScene(view.viewport().rect())).boundingRect().toAlignedRect()
+        visible = visible.intersected(full_rect)
+        if visible.isEmpty():
+            return 1, full_rect
+        return 1, visible
+
+    def render_image(self, source, params, region):
+        # 在工作线程中调用，只读取请求携带的快照，不访问对话框状态；返回结果及其在图层中的位置
+        factor, rect = region
+        if factor > 1:
+            proxy = source.proxies.get(factor)
+            if proxy is None:
+                proxy = source.image.reduce(factor)
+                source.proxies[factor] = proxy
+            pil_image = render_adjustments(proxy, scale_params(params, factor), source.histogram,
+                                           source.cache, ("proxy", factor))
+        else:
+            box = (rect.left(), rect.top(), rect.right() + 1, rect.bottom() + 1)
+            pil_image = render_region(source.image, params, box, source.histogram, source.cache)
+        # 编辑项之后的调整直接作用在预览结果上，预览中边缘与对比度均值为近似值
+        for later_params in source.later:
+            pil_image = render_adjustments(pil_image, scale_params(later_params, factor))
+        return self.pil_image_to_qimage(pil_image), QRectF(rect)
+
+    def submit_preview(self):
+        source = self.ensure_source_image()
+        if self.preview_thread is None:
+            self.preview_thread = PreviewRenderThread(self.render_image)
+            self.preview_thread.rendered.connect(self.on_preview_rendered)
+            self.preview_thread.start()
+        self.submitted_generation = self.preview_generation
+        self.preview_thread.request(self.submitted_generation, source, self.current_params(),
+                                    self.preview_region(), self.last_input_time)
+
+    def on_preview_rendered(self, image, rect, generation, input_time):
+        if generation != self.submitted_generation:
+            # 已提交更新的参数，丢弃过期结果
+            return
+        self.item.set_preview(QPixmap.fromImage(image), rect)
+        self.drawn_generation = generation
+        latency = (time.perf_counter() - input_time) * 1000
+        self.latency_label.setText(f"预览延迟: {latency:.0f} ms ({image.width()}x{image.height()})")
+        if self.preview_source is not None:
+            logging.debug(f"预览延迟: {latency:.1f} ms, 阶段缓存: {self.preview_source.cache.summary()}")
+
+    def stop_preview(self):
+        if self.preview_timer is not None:
+            self.preview_timer.stop()
+        if self.preview_thread is not None:
+            self.preview_thread.stop()
+            self.preview_thread = None
+        # 使仍在事件队列中的结果全部过期
+        self.submitted_generation = -1
+
+    def stop_full_render(self):
+        if self.full_render_thread is not None:
+            self.full_render_thread.cancel()
+            self.full_render_thread = None
+
+    def done(self, result):
+        self.stop_preview()
+        self.stop_full_render()
+        if isinstance(self.item, ResizableGraphicsPixmapItem):
+            self.item.clear_preview()
+            if self.preview_source is not None:
+                logging.info(f"调整阶段缓存: {self.preview_source.cache.summary()}")
+                self.preview_source = None
+        super().done(result)
+
+    def current_params(self):
+        return AdjustmentParams(
+            brightness=self.brightness_slider.value() / 100,
+            contrast=self.contrast_slider.value() / 100,
+            saturation=self.saturation_slider.value() / 100,
+            sharpness=self.sharpen_slider.value() / 100,
+            rgba=tuple(slider.value() / 100 for slider in self.rgba_sliders),
+            gamma=self.gamma_slider.value() / 100,
+            filter_name=self.filter_combo.currentText(),
+            filter_radius=self.radius_slider.value() / 10
+        )
+
     def apply_adjustments(self):
+        if isinstance(self.item, ResizableGraphicsPixmapItem):
+            if self.full_render_thread is not None:
+                return
+            self.stop_preview()
+            params = self.current_params()
+            before = self.adjustments[:self.edit_index]
+            after = self.adjustments[self.edit_index + 1:]
+            self.new_adjustments = before + ([] if is_identity(params) else [params]) + after
+            if self.new_adjustments == self.item.adjustments:
+                self.accept()
+                return
+            # 全分辨率结果只在确认时于后台渲染一次
+            source = self.ensure_source_image()
+            self.apply_btn.setEnabled(False)
+            self.render_progress.setValue(0)
+            self.render_progress.show()
+            self.full_render_thread = FullRenderThread(source.image, [params] + after, source.histogram)
+            self.full_render_thread.progress.connect(self.render_progress.setValue)
+            self.full_render_thread.finished.connect(self.on_full_render_finished)
+            self.full_render_thread.error.connect(self.on_full_render_error)
+            self.full_render_thread.start()
+            logging.info(f"开始全分辨率渲染: {source.image.width}x{source.image.height}")
+            return
+        self.accept()
+
+    def on_full_render_finished(self, image):
+        if self.full_render_thread is None:
+            # 渲染已被取消
+            return
+        self.full_render_thread.wait()
+        self.full_render_thread = None
+        self.item.clear_preview()
+        self.item.set_adjustments(self.new_adjustments, QPixmap.fromImage(image))
         self.accept()
 
+    def on_full_render_error(self, error_message):
+        if self.full_render_thread is None:
+            return
+        self.full_render_thread.wait()
+        self.full_render_thread = None
+        self.render_progress.hide()
+        self.apply_btn.setEnabled(True)
+        QMessageBox.critical(self, "错误", f"调整失败: {error_message}")
+
     def cancel_adjustments(self):
         if isinstance(self.item, ResizableGraphicsPixmapItem):
-            self.item.setPixmap(self.original_pixmap)
+            self.stop_preview()
+            self.stop_full_render()
+            self.item.clear_preview()
         elif isinstance(self.item, ResizableGraphicsTextItem):
             self.item.setHtml(self.original_text)
         self.reject()
@@ -625,17 +1440,10 @@ class AdjustmentDialog(QDialog):
             self.bg_color_button.setStyleSheet(f"background-color: {color.name()};")
 
     def qpixmap_to_pil(self, pixmap):
-        buffer = QBuffer()
-        buffer.open(QIODevice.WriteOnly)
-        pixmap.save(buffer, "PNG")
-        input_bytes = buffer.data().data()
-        pil_image = Image.open(BytesIO(input_bytes)).convert("RGBA")
-        return pil_image
+        return qpixmap_to_pil(pixmap)
 
     def pil_image_to_qimage(self, pil_image):
-        data = pil_image.tobytes("raw", "RGBA")
-        qimage = QImage(data, pil_image.width, pil_image.height, QImage.Format_RGBA8888)
-        return qimage
+        return pil_to_qimage(pil_image)
 
     def change_alignment(self, item, index):
         alignments = [Qt.AlignLeft, Qt.AlignCenter, Qt.AlignRight]
@@ -902,7 +1710,11 @@ class PropertyPanel(QWidget):
         self.rotation_angle_input.setText(str(value))
         if self.parent.rotation_target_items:
             item = self.parent.rotation_target_items[0]
+            before = capture_transform(item)
             item.setRotation(value)
+            # 拖动滑块的连续变化合并为一个撤销步骤
+            self.parent.push_transform([(item, before, capture_transform(item))], "旋转图层",
+                                       self.parent.transform_gesture(("rotation_angle", (item,))))
             logging.info(f"旋转角度已设置为: {value}°")
 
     def change_rotation_angle_input(self):
@@ -911,46 +1723,383 @@ class PropertyPanel(QWidget):
             self.rotation_angle_slider.setValue(int(angle))
             if self.parent.rotation_target_items:
                 item = self.parent.rotation_target_items[0]
+                before = capture_transform(item)
                 item.setRotation(angle)
+                self.parent.push_transform([(item, before, capture_transform(item))], "旋转图层",
+                                           self.parent.transform_gesture(("rotation_angle", (item,))))
                 logging.info(f"旋转角度已设置为: {angle}°")
         except ValueError:
             QMessageBox.warning(self, "警告", "请输入有效的角度值。")
 
+# 去除背景任务面板：限制同时运行的任务数，结果按提交顺序应用
+class BackgroundJobPanel(QWidget):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.parent = parent  # 引用父级 ImageEditor
+        self.jobs = []  # 按提交顺序排列
+        self.layout = QVBoxLayout()
+        self.setLayout(self.layout)
+
+        limit_layout = QHBoxLayout()
+        limit_layout.addWidget(QLabel("并发数:"))
+        self.worker_spin = QSpinBox()
+        self.worker_spin.setRange(1, 8)
+        self.worker_spin.setValue(2)
+        self.worker_spin.valueChanged.connect(self.start_pending_jobs)
+        limit_layout.addWidget(self.worker_spin)
+        clear_btn = QPushButton("清除已结束")
+        clear_btn.clicked.connect(self.clear_finished_jobs)
+        limit_layout.addWidget(clear_btn)
+        self.layout.addLayout(limit_layout)
+
+        self.job_tree = QTreeWidget()
+        self.job_tree.setHeaderLabels(["图层", "状态", "进度", ""])
+        self.job_tree.setRootIsDecorated(False)
+        self.layout.addWidget(self.job_tree)
+
+    def submit(self, item, model_name, proxy_side=None, use_process=False):
+        tree_item = QTreeWidgetItem([item.layer_name, "等待", "", ""])
+        self.job_tree.addTopLevelItem(tree_item)
+        progress_bar = QProgressBar()
+        progress_bar.setRange(0, 100)
+        progress_bar.setValue(0)
+        self.job_tree.setItemWidget(tree_item, 2, progress_bar)
+        cancel_btn = QPushButton("取消")
+        self.job_tree.setItemWidget(tree_item, 3, cancel_btn)
+        job = {
+            "item": item,
+            "model_name": model_name,
+            "proxy_side": proxy_side,
+            "use_process": use_process,
+            "status": "等待",
+            "thread": None,
+            "result": None,
+            "tree_item": tree_item,
+            "progress_bar": progress_bar,
+            "cancel_btn": cancel_btn,
+        }
+        cancel_btn.clicked.connect(lambda: self.cancel_job(job))
+        self.jobs.append(job)
+        self.start_pending_jobs()
+
+    def set_status(self, job, status, progress=None):
+        job["status"] = status
+        job["tree_item"].setText(1, status)
+        progress_bar = job["progress_bar"]
+        if status == "处理中":
+            # 推理无法报告真实进度，运行期间显示为忙碌状态
+            progress_bar.setRange(0, 0)
+        elif progress_bar.maximum() == 0:
+            progress_bar.setRange(0, 100)
+        if progress is not None:
+            progress_bar.setValue(progress)
+        if status in ("完成", "失败", "已取消", "取消中"):
+            job["cancel_btn"].setEnabled(False)
+
+    def start_pending_jobs(self):
+        # 线程仍在运行的任务（包括已取消但推理未结束的）都占用并发名额
+        running = sum(1 for job in self.jobs if job["thread"] is not None)
+        for job in self.jobs:
+            if running >= self.worker_spin.value():
+                break
+            if job["status"] == "等待":
+                self.start_job(job)
+                running += 1
+
+    def start_job(self, job):
+        item = job["item"]
+        try:
+            thread = RemoveBackgroundThread(item.pixmap(), item, job["model_name"], job["proxy_side"],
+                                            job["use_process"])
+        except Exception as e:
+            logging.error(f"背景去除失败: {e}")
+            self.set_status(job, "失败")
+            job["tree_item"].setToolTip(1, str(e))
+            return
+        thread.finished.connect(lambda image, layer: self.on_job_finished(job, image))
+        thread.error.connect(lambda message: self.on_job_error(job, message))
+        # 保留线程引用，避免线程对象被回收
+        job["thread"] = thread
+        self.set_status(job, "处理中")
+        thread.start()
+        logging.info(f"启动去除背景线程，图层: {item.layer_name}")
+
+    def release_thread(self, job):
+        if job["thread"] is not None:
+            job["thread"].wait()
+            job["thread"] = None
+
+    def on_job_finished(self, job, image):
+        self.release_thread(job)
+        if job["status"] == "取消中":
+            self.set_status(job, "已取消")
+        elif job["status"] != "已取消":
+            job["result"] = image
+            self.set_status(job, "待应用", 100)
+        self.apply_ready_results()
+        self.start_pending_jobs()
+
+    def on_job_error(self, job, message):
+        self.release_thread(job)
+        if job["status"] == "取消中":
+            self.set_status(job, "已取消")
+        elif job["status"] != "已取消":
+            self.set_status(job, "失败")
+            job["tree_item"].setToolTip(1, message)
+        self.apply_ready_results()
+        self.start_pending_jobs()
+
+    def cancel_job(self, job):
+        if job["status"] in ("等待", "处理中", "待应用"):
+            # 正在推理的任务无法中断，显示为“取消中”直到推理结束，结果直接丢弃
+            job["result"] = None
+            self.set_status(job, "取消中" if job["thread"] is not None else "已取消")
+            logging.info(f"已取消去除背景任务，图层: {job['item'].layer_name}")
+            self.apply_ready_results()
+            self.start_pending_jobs()
+
+    def apply_ready_results(self):
+        # 按提交顺序应用结果，前面的任务未结束时后面的结果先等待
+        for job in self.jobs:
+            if job["status"] in ("等待", "处理中"):
+                break
+            if job["status"] == "待应用":
+                self.parent.apply_background_removal(job["item"], job["result"])
+                job["result"] = None
+                self.set_status(job, "完成")
+
+    def clear_finished_jobs(self):
+        for job in list(self.jobs):
+            if job["status"] in ("完成", "失败", "已取消") and job["thread"] is None:
+                self.jobs.remove(job)
+                index = self.job_tree.indexOfTopLevelItem(job["tree_item"])
+                self.job_tree.takeTopLevelItem(index)
+
+    def shutdown(self):
+        for job in self.jobs:
+            if job["status"] in ("等待", "处理中", "待应用", "取消中"):
+                self.set_status(job, "已取消")
+        for job in self.jobs:
+            self.release_thread(job)
+
 # 撤销命令类
 class AddLayerCommand(QUndoCommand):
     def __init__(self, editor, layer):
         super().__init__("添加图层")
         self.editor = editor
         self.layer = layer
+        self.payload = editor.undo_memory.store.item_payload(layer)
+
+    def payloads(self):
+        return [self.payload]
 
     def undo(self):
         self.editor.scene.removeItem(self.layer)
-        self.editor.layers.remove(self.layer)
-        self.editor.update_layer_list()
+        self.editor.layer_model.remove_layer(self.layer)
         self.editor.add_history(f"撤销添加图层: {self.layer.layer_name}")
 
     def redo(self):
+        self.payload.load()
         self.editor.scene.addItem(self.layer)
-        self.editor.layers.append(self.layer)
-        self.editor.update_layer_list()
+        self.editor.layer_model.append_layer(self.layer)
         self.editor.add_history(f"添加图层: {self.layer.layer_name}")
 
+class AdjustLayerCommand(QUndoCommand):
+    def __init__(self, editor, layer, old_adjustments, new_adjustments):
+        super().__init__("调整图层")
+        self.editor = editor
+        self.layer = layer
+        # 只记录调整参数，像素由图层的源图按需重新渲染
+        self.old_adjustments = list(old_adjustments)
+        self.new_adjustments = list(new_adjustments)
+
+    def undo(self):
+        self.layer.set_adjustments(self.old_adjustments)
+        self.editor.layer_model.pixels_changed(self.layer)
+        self.editor.add_history(f"撤销调整图层: {self.layer.layer_name}")
+
+    def redo(self):
+        self.layer.set_adjustments(self.new_adjustments)
+        self.editor.layer_model.pixels_changed(self.layer)
+        self.editor.add_history(f"调整图层: {self.layer.layer_name}")
+
+class ReplacePixmapCommand(QUndoCommand):
+    def __init__(self, editor, layer, new_pixmap, text="替换图层像素"):
+        super().__init__(text)
+        self.editor = editor
+        self.layer = layer
+        layer.sync_painted()
+        store = editor.undo_memory.store
+        self.old_pixmap = PixmapPayload(store, layer.source_pixmap, layer)
+        self.old_adjustments = list(layer.adjustments)
+        self.new_pixmap = PixmapPayload(store, new_pixmap, layer)
+
+    def payloads(self):
+        return [self.old_pixmap, self.new_pixmap]
+
+    def undo(self):
+        self.layer.setPixmap(self.old_pixmap.load())
+        self.layer.set_adjustments(self.old_adjustments)
+        self.editor.layer_model.pixels_changed(self.layer)
+        self.editor.add_history(f"撤销{self.text()}: {self.layer.layer_name}")
+
+    def redo(self):
+        self.layer.setPixmap(self.new_pixmap.load())
+        self.editor.layer_model.pixels_changed(self.layer)
+        self.editor.add_history(f"{self.text()}: {self.layer.layer_name}")
+
+# 图层几何状态：变换矩阵、位置、旋转和缩放
+def capture_transform(item):
+    return (QTransform(item.transform()), QPointF(item.pos()), item.rotation(), item.scale())
+
+def apply_transform(item, state):
+    transform, pos, rotation, scale = state
+    item.setTransform(transform)
+    item.setPos(pos)
+    item.setRotation(rotation)
+    item.setScale(scale)
+    item.scale_factor = scale
+
+# 同一来源的连续变换（滚轮、滑块、按钮）间隔小于该值（秒）时合并为一个撤销步骤
+TRANSFORM_MERGE_INTERVAL = 0.6
+
+class TransformLayersCommand(QUndoCommand):
+    ID = 1
+
+    def __init__(self, editor, states, text="变换图层", gesture=None):
+        super().__init__(text)
+        self.editor = editor
+        # [(图层, 变换前状态, 变换后状态)]，只保存几何信息，不涉及像素
+        self.states = states
+        # 同一手势的命令可以合并，None 表示不合并
+        self.gesture = gesture
+        # 将被合并进上一条命令时不再单独记录操作
+        self.quiet = False
+
+    def id(self):
+        return -1 if self.gesture is None else self.ID
+
+    def can_merge(self, other):
+        return (self.gesture is not None and other.gesture == self.gesture and
+                [item for item, _, _ in self.states] == [item for item, _, _ in other.states])
+
+    def mergeWith(self, other):
+        if not isinstance(other, TransformLayersCommand) or not self.can_merge(other):
+            return False
+        # 保留最初的变换前状态，采用最新的变换后状态
+        self.states = [(item, before, after) for (item, before, _), (_, _, after) in zip(self.states, other.states)]
+        return True
+
+    def layer_names(self):
+        return ", ".join(item.layer_name for item, _, _ in self.states)
+
+    def undo(self):
+        for item, before, _ in self.states:
+            apply_transform(item, before)
+        self.editor.add_history(f"撤销{self.text()}: {self.layer_names()}")
+
+    def redo(self):
+        for item, _, after in self.states:
+            apply_transform(item, after)
+        if self.quiet:
+            self.quiet = False
+            return
+        self.editor.add_history(f"{self.text()}: {self.layer_names()}")
+
+# 文字图层样式：HTML 内容、字体、文字颜色和背景颜色
+def capture_text_style(item):
+    return (item.toHtml(), QFont(item.font()), QColor(item.defaultTextColor()), QColor(item.background_color))
+
+class TextStyleCommand(QUndoCommand):
+    def __init__(self, editor, layer, old_style, new_style):
+        super().__init__("调整文字")
+        self.editor = editor
+        self.layer = layer
+        self.old_style = old_style
+        self.new_style = new_style
+
+    def apply(self, style):
+        html, font, color, background_color = style
+        self.layer.setHtml(html)
+        self.layer.setFont(font)
+        self.layer.setDefaultTextColor(color)
+        self.layer.set_background_color(background_color)
+        self.editor.layer_model.pixels_changed(self.layer)
+
+    def undo(self):
+        self.apply(self.old_style)
+        self.editor.add_history(f"撤销调整图层: {self.layer.layer_name}")
+
+    def redo(self):
+        self.apply(self.new_style)
+        self.editor.add_history(f"调整图层: {self.layer.layer_name}")
+
+class PaintTilesCommand(QUndoCommand):
+    def __init__(self, editor, layer, tiles, tile_size, text="画笔", source_pixmap=None, adjustments=()):
+        super().__init__(text)
+        self.editor = editor
+        self.layer = layer
+        # 只保存被修改图块的压缩像素，内存与绘制面积成正比
+        self.tiles = TilesPayload(editor.undo_memory.store, tiles)
+        self.tile_size = tile_size
+        # 笔画烘焙了调整栈时，撤销恢复笔画前的源图和调整栈
+        self.source = None
+        if source_pixmap is not None:
+            self.source = PixmapPayload(editor.undo_memory.store, source_pixmap, layer)
+        self.adjustments = list(adjustments)
+
+    def payloads(self):
+        return [self.tiles] + ([self.source] if self.source is not None else [])
+
+    def apply(self, index):
+        tiles = self.tiles.load()
+        image = self.layer.backing_image()
+        pixels = qimage_pixels32(image)
+        size = self.tile_size
+        dirty = QRect()
+        for (column, row), states in tiles.items():
+            rect = QRect(column * size, row * size, size, size).intersected(image.rect())
+            tile = np.frombuffer(zlib.decompress(states[index]), np.uint8)
+            pixels[rect.top():rect.bottom() + 1, rect.left():rect.right() + 1] = \
+                tile.reshape(rect.height(), rect.width(), 4)
+            dirty = dirty.united(rect)
+        self.layer.mark_painted(QRectF(dirty))
+        self.editor.layer_model.pixels_changed(self.layer)
+
+    def undo(self):
+        if self.source is not None:
+            self.layer.setPixmap(self.source.load())
+            self.layer.set_adjustments(self.adjustments)
+            self.editor.layer_model.pixels_changed(self.layer)
+        else:
+            self.apply(0)
+        self.editor.add_history(f"撤销{self.text()}: {self.layer.layer_name}")
+
+    def redo(self):
+        self.apply(1)
+        self.editor.add_history(f"{self.text()}: {self.layer.layer_name}")
+
 class DeleteLayerCommand(QUndoCommand):
     def __init__(self, editor, layer):
         super().__init__("删除图层")
         self.editor = editor
         self.layer = layer
+        self.payload = editor.undo_memory.store.item_payload(layer)
+
+    def payloads(self):
+        return [self.payload]
 
     def undo(self):
+        self.payload.load()
         self.editor.scene.addItem(self.layer)
-        self.editor.layers.append(self.layer)
-        self.editor.update_layer_list()
+        # 恢复到删除前的位置
+        self.editor.layer_model.insert_layer(self.position, self.layer)
         self.editor.add_history(f"撤销删除图层: {self.layer.layer_name}")
 
     def redo(self):
         self.editor.scene.removeItem(self.layer)
-        self.editor.layers.remove(self.layer)
-        self.editor.update_layer_list()
+        self.position = self.editor.layers.index(self.layer)
+        self.editor.layer_model.remove_layer(self.layer)
         self.editor.add_history(f"删除图层: {self.layer.layer_name}")
 
 class CropCommand(QUndoCommand):
@@ -959,29 +2108,32 @@ class CropCommand(QUndoCommand):
         self.editor = editor
         self.old_item = old_item
         self.new_item = new_item
+        store = editor.undo_memory.store
+        self.old_payload = store.item_payload(old_item)
+        self.new_payload = store.item_payload(new_item)
+
+    def payloads(self):
+        return [self.old_payload, self.new_payload]
+
+    def replace(self, current, replacement):
+        model = self.editor.layer_model
+        if current in model.layers:
+            model.replace_layer(current, replacement)
+        else:
+            model.insert_layer(0, replacement)  # 默认插入位置
 
     def undo(self):
-        try:
-            index = self.editor.layers.index(self.new_item)
-        except ValueError:
-            index = 0  # 默认插入位置
+        self.old_payload.load()
         self.editor.scene.removeItem(self.new_item)
         self.editor.scene.addItem(self.old_item)
-        self.editor.layers.insert(index, self.old_item)
-        self.editor.layers.remove(self.new_item)
-        self.editor.update_layer_list()
+        self.replace(self.new_item, self.old_item)
         self.editor.add_history(f"撤销裁剪图层: {self.old_item.layer_name}")
 
     def redo(self):
-        try:
-            index = self.editor.layers.index(self.old_item)
-        except ValueError:
-            index = 0  # 默认插入位置
+        self.new_payload.load()
         self.editor.scene.removeItem(self.old_item)
         self.editor.scene.addItem(self.new_item)
-        self.editor.layers.insert(index, self.new_item)
-        self.editor.layers.remove(self.old_item)
-        self.editor.update_layer_list()
+        self.replace(self.old_item, self.new_item)
         self.editor.add_history(f"裁剪图层: {self.new_item.layer_name}")
 
 class MergeLayersCommand(QUndoCommand):
@@ -990,23 +2142,38 @@ class MergeLayersCommand(QUndoCommand):
         self.editor = editor
         self.layers = layers
         self.merged_layer = None
+        self.layer_payloads = [editor.undo_memory.store.item_payload(layer) for layer in layers]
+        self.merged_payload = None
+
+    def payloads(self):
+        payloads = list(self.layer_payloads)
+        if self.merged_payload is not None:
+            payloads.append(self.merged_payload)
+        return payloads
 
     def undo(self):
         self.editor.scene.removeItem(self.merged_layer)
-        for layer in self.layers:
+        self.editor.layer_model.remove_layer(self.merged_layer)
+        for payload in self.layer_payloads:
+            payload.load()
+        # 按原位置自下而上插回
+        for position, layer in self.positions:
             self.editor.scene.addItem(layer)
-            self.editor.layers.append(layer)
-        self.editor.update_layer_list()
+            self.editor.layer_model.insert_layer(position, layer)
         self.editor.add_history("撤销合并图层")
 
     def redo(self):
+        self.positions = sorted((self.editor.layers.index(layer), layer) for layer in self.layers)
         for layer in self.layers:
             self.editor.scene.removeItem(layer)
-            self.editor.layers.remove(layer)
-        self.merged_layer = self.editor.merge_layers(self.layers)
+            self.editor.layer_model.remove_layer(layer)
+        # 重做时复用首次合并的结果，不再重新合成
+        if self.merged_layer is None:
+            self.merged_layer = self.editor.merge_layers(self.layers)
+            self.merged_payload = self.editor.undo_memory.store.item_payload(self.merged_layer)
+        self.merged_payload.load()
         self.editor.scene.addItem(self.merged_layer)
-        self.editor.layers.append(self.merged_layer)
-        self.editor.update_layer_list()
+        self.editor.layer_model.append_layer(self.merged_layer)
         self.editor.add_history("合并图层")
 
 # 主图像编辑器类
@@ -1024,8 +2191,7 @@ class ImageEditor(QMainWindow):
         self.view.setDragMode(QGraphicsView.RubberBandDrag)
         self.setCentralWidget(self.view)
 
-        # 图层列表
-        self.layers = []  # 图层列表
+        # 图层列表由图层面板的模型持有，见 layers 属性
         self.rotation_handles = []  # 旋转中心句柄列表
         self.rotation_target_items = []  # 当前旋转目标图层
         self.init_layer_panel()
@@ -1038,7 +2204,17 @@ class ImageEditor(QMainWindow):
 
         # 操作记录
         self.undo_stack = QUndoStack(self)
+        # 撤销栈内存预算：超出时把离当前位置最远的像素换出到磁盘
+        self.undo_memory = UndoMemoryManager(self.undo_stack, UNDO_MEMORY_BUDGET, self)
+        # 变换手势，用于合并连续的变换撤销命令
+        self.transform_gesture_id = 0
+        self.transform_gesture_key = None
+        self.transform_gesture_time = 0.0
         self.init_history_panel()
+        self.init_status_bar()
+
+        # 去除背景任务面板
+        self.init_background_job_panel()
 
         # 日志面板
         self.init_log_panel()
@@ -1068,6 +2244,7 @@ class ImageEditor(QMainWindow):
 
         # 当前绘图图层
         self.current_brush_layer = None
+        self.stroke_engine = StrokeEngine(self)
 
         # 旋转与镜像
         self.rotating = False
@@ -1081,39 +2258,126 @@ class ImageEditor(QMainWindow):
         # 安装事件过滤器
         self.view.viewport().installEventFilter(self)
 
+        # 主窗口显示后在后台预热去除背景模型
+        self.rembg_warmed_up = False
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if not self.rembg_warmed_up:
+            self.rembg_warmed_up = True
+            QTimer.singleShot(0, lambda: self.warm_up_rembg(self.rembg_model))
+
+    def warm_up_rembg(self, model_name):
+        if self.rembg_process_act.isChecked():
+            inference_worker().warm_up(model_name)
+        else:
+            session_manager().warm_up_async(model_name)
+
+    def set_rembg_model(self, model_name):
+        if model_name == self.rembg_model:
+            return
+        self.rembg_model = model_name
+        logging.info(f"去除背景模型已切换为: {model_name}")
+        self.warm_up_rembg(model_name)
+
+    def set_rembg_process(self, checked):
+        logging.info(f"去除背景推理方式: {'独立进程' if checked else '进程内线程'}")
+        if checked:
+            inference_worker().warm_up(self.rembg_model)
+
     def init_layer_panel(self):
-        self.layer_tree = QTreeWidget()
-        self.layer_tree.setHeaderLabel("图层")
-        self.layer_tree.setSelectionMode(QAbstractItemView.ExtendedSelection)
-        self.layer_tree.setDragDropMode(QAbstractItemView.InternalMove)
-        self.layer_tree.itemChanged.connect(self.toggle_layer_visibility)
-        self.layer_tree.itemDoubleClicked.connect(self.toggle_layer_lock)
-        self.layer_tree.itemClicked.connect(self.select_layer_from_list)
-        self.layer_tree.model().rowsMoved.connect(self.update_layer_order)
+        # 锁定图标只在启动时加载一次
+        self.layer_model = LayerListModel({
+            True: self.load_lock_icon("lock_closed.png", QApplication.style().SP_DialogCloseButton),
+            False: self.load_lock_icon("lock_open.png", QApplication.style().SP_DialogOpenButton),
+        }, self)
+        self.layer_model.layer_placed.connect(self.place_layer_z)
+        self.layer_model.layer_placed.connect(self.apply_render_policy)
+        self.layer_caching = True
+        QPixmapCache.setCacheLimit(max(QPixmapCache.cacheLimit(), LAYER_CACHE_LIMIT_KB))
+        self.layer_view = QTreeView()
+        self.layer_view.setModel(self.layer_model)
+        self.layer_view.setRootIsDecorated(False)
+        self.layer_view.setUniformRowHeights(True)
+        self.layer_view.setIconSize(QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        self.layer_view.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.layer_view.setDragDropMode(QAbstractItemView.InternalMove)
+        self.layer_view.setDefaultDropAction(Qt.MoveAction)
+        self.layer_view.doubleClicked.connect(self.toggle_layer_lock)
+        self.layer_view.selectionModel().selectionChanged.connect(self.select_layers_from_panel)
+        # 面板中已选中的图层，与场景选择比较增量；syncing_selection 防止双向同步互相触发
+        self.panel_selection = set()
+        self.syncing_selection = False
 
         # 创建图层面板
         dock = QDockWidget("图层", self)
-        dock.setWidget(self.layer_tree)
+        dock.setWidget(self.layer_view)
         self.addDockWidget(Qt.RightDockWidgetArea, dock)
 
-    def update_layer_order(self, parent, start, end, destination, row):
-        # 根据列表顺序更新图层的Z值
-        for index in range(self.layer_tree.topLevelItemCount()):
-            tree_item = self.layer_tree.topLevelItem(index)
-            layer_item = tree_item.data(0, Qt.UserRole)
-            if layer_item:
-                layer_item.setZValue(index)
-        self.scene.update()
-
-    def select_layer_from_list(self, tree_item, column):
-        item = tree_item.data(0, Qt.UserRole)
-        if item:
-            # 取消当前选中
-            for obj in self.scene.selectedItems():
-                obj.setSelected(False)
-            # 选中对应图层
-            item.setSelected(True)
-            self.scene.update()
+    @property
+    def layers(self):
+        # 自底向上的图层列表，只读；增删改须通过 layer_model，面板才能收到对应的行信号
+        return self.layer_model.layers
+
+    def load_lock_icon(self, path, fallback):
+        if os.path.exists(path):
+            return QIcon(path)
+        # 使用默认图标代替
+        return self.style().standardIcon(fallback)
+
+    def place_layer_z(self, layer):
+        # 图层插入或移动后只修改它自己的Z值：取上下相邻图层Z值的中点，越靠上Z值越大
+        # setZValue 只重绘该图层所占区域
+        layers = self.layers
+        position = self.layer_model.position_of(layer)
+        below = layers[position - 1].zValue() if position > 0 else None
+        above = layers[position + 1].zValue() if position + 1 < len(layers) else None
+        if below is None and above is None:
+            return
+        if above is None:
+            layer.setZValue(below + 1)
+        elif below is None:
+            layer.setZValue(above - 1)
+        elif above - below > LAYER_Z_EPSILON:
+            layer.setZValue((below + above) / 2)
+        else:
+            # 多次在同一处插入后中点精度耗尽，按位置整体重新编号
+            for index, item in enumerate(layers):
+                item.setZValue(index)
+
+    def apply_render_policy(self, layer):
+        if isinstance(layer, ResizableGraphicsPixmapItem):
+            layer.device_caching = self.layer_caching
+            # 后台渲染完调整栈后刷新缩略图
+            layer.render_listener = self.layer_model.pixels_changed
+            layer.update()
+        else:
+            # 文字图层较小且编辑时要刷新光标，使用 Qt 自带的缓存，update() 即失效
+            layer.setCacheMode(QGraphicsItem.DeviceCoordinateCache if self.layer_caching else QGraphicsItem.NoCache)
+
+    def set_layer_caching(self, enabled):
+        self.layer_caching = enabled
+        for layer in self.layers:
+            self.apply_render_policy(layer)
+        logging.info(f"图层缓存: {'开启' if enabled else '关闭'}")
+
+    def select_layers_from_panel(self, selected, deselected):
+        # 面板选择变化只同步变化的行
+        if self.syncing_selection:
+            return
+        self.syncing_selection = True
+        try:
+            for index in deselected.indexes():
+                item = self.layer_model.data(index, Qt.UserRole)
+                if item is not None and item.scene() is self.scene:
+                    item.setSelected(False)
+            for index in selected.indexes():
+                item = self.layer_model.data(index, Qt.UserRole)
+                if item is not None and item.scene() is self.scene:
+                    item.setSelected(True)
+        finally:
+            self.syncing_selection = False
+        self.update_layer_selection()
 
     def init_log_panel(self):
         # 创建日志面板
@@ -1130,6 +2394,72 @@ class ImageEditor(QMainWindow):
         handler.setFormatter(formatter)
         logging.getLogger().addHandler(handler)
 
+    def init_background_job_panel(self):
+        self.background_job_panel = BackgroundJobPanel(parent=self)
+        self.background_job_dock = QDockWidget("去除背景任务", self)
+        self.background_job_dock.setWidget(self.background_job_panel)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.background_job_dock)
+
+    def closeEvent(self, event):
+        # 先关闭推理进程，等待其结果的线程随即以错误结束
+        inference_worker().shutdown()
+        # 等待仍在运行的去除背景线程结束，避免线程对象在运行中被销毁
+        self.background_job_panel.shutdown()
+        # 停止图层调整栈的后台渲染
+        for layer in self.layers:
+            if isinstance(layer, ResizableGraphicsPixmapItem):
+                layer.cancel_render()
+        self.undo_memory.shutdown()
+        self.layer_model.shutdown()
+        # 场景随后销毁，不再同步选择
+        self.scene.selectionChanged.disconnect(self.update_layer_selection)
+        super().closeEvent(event)
+
+    def new_transform_gesture(self):
+        self.transform_gesture_id += 1
+        self.transform_gesture_key = None
+        return self.transform_gesture_id
+
+    def transform_gesture(self, key):
+        # 同一来源、同一批图层的连续操作间隔不超过 TRANSFORM_MERGE_INTERVAL 时沿用当前手势
+        now = time.perf_counter()
+        if key != self.transform_gesture_key or now - self.transform_gesture_time > TRANSFORM_MERGE_INTERVAL:
+            self.transform_gesture_id += 1
+            self.transform_gesture_key = key
+        self.transform_gesture_time = now
+        return self.transform_gesture_id
+
+    def push_transform(self, states, text, gesture=None):
+        # states: [(图层, 变换前状态, 变换后状态)]，没有实际变化的图层不记录
+        states = [(item, before, after) for item, before, after in states if before != after]
+        if not states:
+            return
+        command = TransformLayersCommand(self, states, text, gesture)
+        top = self.undo_stack.command(self.undo_stack.index() - 1)
+        command.quiet = isinstance(top, TransformLayersCommand) and top.can_merge(command)
+        self.undo_stack.push(command)
+
+    def init_status_bar(self):
+        self.undo_memory_label = QLabel()
+        self.statusBar().addPermanentWidget(self.undo_memory_label)
+        self.undo_memory.usage_changed.connect(self.update_undo_memory_label)
+        self.update_undo_memory_label(0, 0)
+
+    def update_undo_memory_label(self, memory_bytes, disk_bytes):
+        text = (f"撤销内存: {memory_bytes / 1024 / 1024:.1f} / "
+                f"{self.undo_memory.budget / 1024 / 1024:.0f} MB")
+        if disk_bytes:
+            text += f"，磁盘: {disk_bytes / 1024 / 1024:.1f} MB"
+        self.undo_memory_label.setText(text)
+
+    def set_undo_memory_budget(self):
+        megabytes, ok = QInputDialog.getInt(
+            self, "撤销内存上限", "撤销栈可占用的内存 (MB):",
+            self.undo_memory.budget // (1024 * 1024), 16, 65536)
+        if ok:
+            self.undo_memory.set_budget(megabytes * 1024 * 1024)
+            self.log_message(f"撤销内存上限设置为 {megabytes} MB")
+
     def init_history_panel(self):
         # 创建操作记录面板
         self.history_list = QListWidget()
@@ -1167,6 +2497,26 @@ class ImageEditor(QMainWindow):
         self.remove_bg_act.triggered.connect(self.remove_background)
         self.remove_bg_act.setShortcut(QKeySequence("Ctrl+Shift+R"))
 
+        # 去除背景模型选择
+        self.rembg_model = DEFAULT_MODEL
+        self.rembg_model_group = QActionGroup(self)
+        self.rembg_model_acts = []
+        for model_name in MODEL_NAMES:
+            action = QAction(model_name, self, checkable=True)
+            action.setChecked(model_name == self.rembg_model)
+            action.triggered.connect(lambda checked, name=model_name: self.set_rembg_model(name))
+            self.rembg_model_group.addAction(action)
+            self.rembg_model_acts.append(action)
+
+        self.rembg_proxy_act = QAction(f"大图代理推理 (长边 > {PROXY_SIDE})", self, checkable=True)
+        self.rembg_proxy_act.setChecked(True)
+
+        self.rembg_process_act = QAction("在独立进程中推理", self, checkable=True)
+        self.rembg_process_act.toggled.connect(self.set_rembg_process)
+
+        self.undo_budget_act = QAction("撤销内存上限...", self)
+        self.undo_budget_act.triggered.connect(self.set_undo_memory_budget)
+
         self.add_text_act = QAction("&添加文字", self)
         self.add_text_act.triggered.connect(self.add_text)
         self.add_text_act.setShortcut(QKeySequence("Ctrl+T"))
@@ -1192,6 +2542,10 @@ class ImageEditor(QMainWindow):
         self.zoom_out_act.triggered.connect(self.zoom_out)
         self.zoom_out_act.setShortcut(QKeySequence("Ctrl+-"))
 
+        self.layer_cache_act = QAction("缓存静态图层", self, checkable=True)
+        self.layer_cache_act.setChecked(True)
+        self.layer_cache_act.toggled.connect(self.set_layer_caching)
+
         self.actual_size_act = QAction("实际尺寸", self)
         self.actual_size_act.triggered.connect(self.actual_size)
         self.actual_size_act.setShortcut(QKeySequence("Ctrl+1"))
@@ -1200,12 +2554,7 @@ class ImageEditor(QMainWindow):
         self.set_canvas_size_act.triggered.connect(self.set_canvas_size)
 
         # 画布尺寸预设
-        self.predefined_sizes = {
-            "1:1": (1000, 1000),
-            "4:3": (1600, 1200),
-            "16:9": (1920, 1080),
-            "9:16": (1080, 1920)  # 默认手机尺寸
-        }
+        self.predefined_sizes = PREDEFINED_CANVAS_SIZES
 
         # 旋转与镜像
         self.rotate_act = QAction("旋转", self)
@@ -1284,6 +2633,12 @@ class ImageEditor(QMainWindow):
         # 编辑菜单
         edit_menu = menubar.addMenu("&编辑")
         edit_menu.addAction(self.remove_bg_act)
+        rembg_model_menu = edit_menu.addMenu("去除背景模型")
+        for action in self.rembg_model_acts:
+            rembg_model_menu.addAction(action)
+        rembg_model_menu.addSeparator()
+        rembg_model_menu.addAction(self.rembg_proxy_act)
+        rembg_model_menu.addAction(self.rembg_process_act)
         edit_menu.addSeparator()
         edit_menu.addAction(self.add_text_act)
         edit_menu.addAction(self.add_image_act)
@@ -1304,12 +2659,14 @@ class ImageEditor(QMainWindow):
         edit_menu.addSeparator()
         edit_menu.addAction(self.undo_act)
         edit_menu.addAction(self.redo_act)
+        edit_menu.addAction(self.undo_budget_act)
 
         # 视图菜单
         view_menu = menubar.addMenu("&视图")
         view_menu.addAction(self.zoom_in_act)
         view_menu.addAction(self.zoom_out_act)
         view_menu.addAction(self.actual_size_act)
+        view_menu.addAction(self.layer_cache_act)
         view_menu.addSeparator()
 
         # 画布尺寸设置
@@ -1418,8 +2775,9 @@ class ImageEditor(QMainWindow):
     def create_transparent_canvas(self):
         # 清空场景
         self.scene.clear()
-        self.layers = []
-        self.layer_tree.clear()
+        self.layer_model.clear()
+        # 旧图层已随场景销毁，撤销记录不再有效
+        self.undo_stack.clear()
 
         # 创建透明底图
         canvas = QPixmap(self.canvas_width, self.canvas_height)
@@ -1427,8 +2785,7 @@ class ImageEditor(QMainWindow):
         self.base_canvas = ResizableGraphicsPixmapItem(canvas, "底图")
         self.base_canvas.setZValue(-2)  # 放在最底层
         self.scene.addItem(self.base_canvas)
-        self.layers.append(self.base_canvas)
-        self.add_layer_to_tree(self.base_canvas)
+        self.layer_model.append_layer(self.base_canvas)
 
         # 设置画布背景颜色并添加条纹
         pattern_pixmap = QPixmap(20, 20)
@@ -1448,64 +2805,14 @@ class ImageEditor(QMainWindow):
 
         logging.info(f"初始化底图: {self.canvas_width}x{self.canvas_height}")
 
-    def add_layer_to_tree(self, item, parent=None):
-        layer_name = item.layer_name
-        tree_item = QTreeWidgetItem()
-        tree_item.setText(0, layer_name)
-        tree_item.setFlags(tree_item.flags() | Qt.ItemIsUserCheckable | Qt.ItemIsSelectable | Qt.ItemIsDragEnabled)
-        tree_item.setCheckState(0, Qt.Checked)
-        tree_item.setData(0, Qt.UserRole, item)
-        # 添加锁定图标
-        lock_icon_path = "lock_closed.png" if item.locked else "lock_open.png"
-        if os.path.exists(lock_icon_path):
-            lock_icon = QIcon(lock_icon_path)
-        else:
-            # 使用默认图标代替
-            lock_icon = self.style().standardIcon(QApplication.style().SP_DialogCloseButton) if item.locked else self.style().standardIcon(QApplication.style().SP_DialogOpenButton)
-        tree_item.setIcon(0, lock_icon)
-        if parent:
-            parent.addChild(tree_item)
-        else:
-            self.layer_tree.insertTopLevelItem(0, tree_item)
-
-    def update_layer_list(self):
-        self.layer_tree.clear()
-        for item in reversed(self.layers):
-            self.add_layer_to_tree(item)
-
-    def toggle_layer_visibility(self, tree_item, column):
-        item = tree_item.data(0, Qt.UserRole)
-        if item and not item.locked:
-            item.setVisible(tree_item.checkState(0) == Qt.Checked)
-            logging.debug(f"图层可见性切换: {item.layer_name} 可见={item.isVisible()}")
-
-    def toggle_layer_lock(self, tree_item, column):
-        item = tree_item.data(0, Qt.UserRole)
+    def toggle_layer_lock(self, index):
+        item = self.layer_model.data(index, Qt.UserRole)
         if item and (isinstance(item, ResizableGraphicsPixmapItem) or isinstance(item, ResizableGraphicsTextItem)):
             item.locked = not item.locked
-            if item.locked:
-                # 更新锁定图标
-                lock_icon_path = "lock_closed.png"
-                if os.path.exists(lock_icon_path):
-                    lock_icon = QIcon(lock_icon_path)
-                else:
-                    lock_icon = self.style().standardIcon(QApplication.style().SP_DialogCloseButton)
-                tree_item.setIcon(0, lock_icon)
-            else:
-                lock_icon_path = "lock_open.png"
-                if os.path.exists(lock_icon_path):
-                    lock_icon = QIcon(lock_icon_path)
-                else:
-                    lock_icon = self.style().standardIcon(QApplication.style().SP_DialogOpenButton)
-                tree_item.setIcon(0, lock_icon)
+            # 更新列表项的锁定图标和文本
+            self.layer_model.layer_changed(item)
             # 更新边框样式
-            if isinstance(item, ResizableGraphicsPixmapItem) or isinstance(item, ResizableGraphicsTextItem):
-                item.update()
-            # 更新列表项文本
-            if item.locked:
-                tree_item.setText(0, f"{item.layer_name} (锁定)")
-            else:
-                tree_item.setText(0, item.layer_name)
+            item.update()
             logging.info(f"图层锁定状态切换: {item.layer_name} 锁定={item.locked}")
 
     def open_image(self):
@@ -1526,9 +2833,7 @@ class ImageEditor(QMainWindow):
                 item = ResizableGraphicsPixmapItem(image, f"图像：{os.path.basename(file_path)}")
                 # 初始位置为(0,0)
                 item.setPos(0, 0)
-                self.scene.addItem(item)
-                self.layers.append(item)
-                self.add_layer_to_tree(item)
+                # 命令负责加入场景和图层列表
                 self.undo_stack.push(AddLayerCommand(self, item))
 
                 # 调整视图以适应整个画布
@@ -1613,44 +2918,32 @@ class ImageEditor(QMainWindow):
                 if item.locked:
                     QMessageBox.warning(self, "警告", f"图层已锁定，无法编辑: {item.layer_name}")
                     continue
-                try:
-                    # 使用线程去除背景
-                    thread = RemoveBackgroundThread(item.pixmap(), item)
-                    thread.finished.connect(self.on_background_removed)
-                    thread.error.connect(self.on_background_remove_error)
-                    thread.start()
-                    logging.info(f"启动去除背景线程，图层: {item.layer_name}")
-                except Exception as e:
-                    logging.error(f"背景去除失败: {e}")
-                    QMessageBox.critical(self, "错误", f"背景去除失败: {e}")
-
-    def on_background_removed(self, pixmap, item):
+                # 交给任务队列，按并发上限依次处理
+                proxy_side = PROXY_SIDE if self.rembg_proxy_act.isChecked() else None
+                self.background_job_panel.submit(item, self.rembg_model, proxy_side,
+                                                 self.rembg_process_act.isChecked())
+        self.background_job_dock.show()
+        self.background_job_dock.raise_()
+
+    def apply_background_removal(self, item, image):
+        if item.scene() is not self.scene:
+            logging.warning(f"图层已被移除，跳过去除背景结果: {item.layer_name}")
+            return
         try:
-            # 保存操作以便撤销
-            self.undo_stack.push(AddLayerCommand(self, item))
-            item.setPixmap(pixmap)
-            # 更新工具栏中的大小和比例信息
-            new_width = pixmap.width()
-            new_height = pixmap.height()
+            # 每个结果作为一个可撤销步骤
+            self.undo_stack.push(ReplacePixmapCommand(self, item, QPixmap.fromImage(image), "去除背景"))
             self.status_label.setText(f"选中图层: {item.layer_name}")
             logging.info(f"成功去除背景，图层: {item.layer_name}")
-            QMessageBox.information(self, "成功", f"背景已成功去除: {item.layer_name}")
         except Exception as e:
             logging.error(f"更新图层失败: {e}")
             QMessageBox.critical(self, "错误", f"更新图层失败: {e}")
 
-    def on_background_remove_error(self, error_message):
-        QMessageBox.critical(self, "错误", f"背景去除失败: {error_message}")
-
     def add_text(self):
         text, ok = QInputDialog.getText(self, "添加文字", "请输入要添加的文字:")
         if ok and text:
             try:
                 item = ResizableGraphicsTextItem(text, f"文字：{text}")
                 item.setPos(50, 50)
-                self.scene.addItem(item)
-                self.layers.append(item)
-                self.add_layer_to_tree(item)
                 self.undo_stack.push(AddLayerCommand(self, item))
                 logging.info(f"成功添加文字: {text}")
             except Exception as e:
@@ -1670,9 +2963,6 @@ class ImageEditor(QMainWindow):
                     raise ValueError("无法加载图片。")
                 item = ResizableGraphicsPixmapItem(image, f"图像：{os.path.basename(file_path)}")
                 item.setPos(100, 100)
-                self.scene.addItem(item)
-                self.layers.append(item)
-                self.add_layer_to_tree(item)
                 self.undo_stack.push(AddLayerCommand(self, item))
                 logging.info(f"成功添加图像: {file_path}")
             except Exception as e:
@@ -1711,6 +3001,7 @@ class ImageEditor(QMainWindow):
             # 隐藏其他工具相关元素
             self.hide_tool_related_elements()
         else:
+            self.finish_stroke()
             self.brush_tool.hide()
             self.current_brush_layer = None
             self.view.setCursor(Qt.ArrowCursor)
@@ -1719,6 +3010,15 @@ class ImageEditor(QMainWindow):
             # 恢复其他工具相关元素
             self.show_tool_related_elements()
 
+    def finish_stroke(self, scene_point=None):
+        # 结束当前笔画，并把触及的图块记录为一条撤销命令
+        layer = self.stroke_engine.layer
+        recorder = self.stroke_engine.end(scene_point)
+        if recorder is not None and not recorder.is_empty():
+            self.undo_stack.push(PaintTilesCommand(self, layer, recorder.tiles(), recorder.TILE_SIZE,
+                                                   source_pixmap=recorder.source_pixmap,
+                                                   adjustments=recorder.adjustments))
+
     def toggle_crop_mode(self, checked):
         if checked:
             selected_items = self.scene.selectedItems()
@@ -1792,8 +3092,13 @@ class ImageEditor(QMainWindow):
 
     def set_rotation_angle(self, angle):
         if self.rotation_target_items:
+            states = []
             for item in self.rotation_target_items:
+                before = capture_transform(item)
                 item.setRotation(angle)
+                states.append((item, before, capture_transform(item)))
+            self.push_transform(states, "旋转图层",
+                                self.transform_gesture(("rotation_angle", tuple(self.rotation_target_items))))
             self.property_panel.rotation_angle_slider.setValue(int(angle))
             self.property_panel.rotation_angle_input.setText(str(angle))
 
@@ -1812,7 +3117,9 @@ class ImageEditor(QMainWindow):
         if event.type() == QEvent.MouseButtonPress:
             if self.brush_tool.isVisible():
                 if event.button() == Qt.LeftButton and self.current_brush_layer:
-                    self.last_point = self.view.mapToScene(event.pos())
+                    self.stroke_engine.begin(self.current_brush_layer, self.view.mapToScene(event.pos()),
+                                             self.brush_tool.pen(), self.brush_tool.composition_mode(),
+                                             self.brush_tool.brush_settings())
                     return True
             elif self.crop_mode:
                 if event.button() == Qt.LeftButton:
@@ -1826,10 +3133,9 @@ class ImageEditor(QMainWindow):
                     return True
         elif event.type() == QEvent.MouseMove:
             if self.brush_tool.isVisible():
-                if event.buttons() & Qt.LeftButton and self.current_brush_layer:
-                    current_point = self.view.mapToScene(event.pos())
-                    self.paint_on_layer(self.current_brush_layer, self.last_point, current_point)
-                    self.last_point = current_point
+                if event.buttons() & Qt.LeftButton and self.stroke_engine.is_active():
+                    # 只缓冲输入点，由笔画引擎按帧绘制
+                    self.stroke_engine.add_point(self.view.mapToScene(event.pos()))
                     return True
             elif self.crop_mode:
                 if event.buttons() & Qt.LeftButton and self.crop_overlay:
@@ -1838,7 +3144,11 @@ class ImageEditor(QMainWindow):
                     self.crop_overlay.setRect(rect)
                     return True
         elif event.type() == QEvent.MouseButtonRelease:
-            if self.crop_mode:
+            if self.stroke_engine.is_active():
+                if event.button() == Qt.LeftButton:
+                    self.finish_stroke(self.view.mapToScene(event.pos()))
+                    return True
+            elif self.crop_mode:
                 return True
         return super().eventFilter(source, event)
 
@@ -1873,27 +3183,6 @@ class ImageEditor(QMainWindow):
             return
         super().mouseReleaseEvent(event)
 
-    def paint_on_layer(self, layer, start_point, end_point):
-        if isinstance(layer, ResizableGraphicsTextItem):
-            # 文字图层不支持画笔工具
-            pass
-        else:
-            # 对图像图层进行绘制
-            pixmap = layer.pixmap()
-            image = pixmap.toImage()
-            painter = QPainter(image)
-            pen = QPen(self.brush_tool.current_color, self.brush_tool.size_slider.value(), Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin)
-            if self.brush_tool.mode == 'erase':
-                painter.setCompositionMode(QPainter.CompositionMode_Clear)
-            else:
-                painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
-            painter.setPen(pen)
-            layer_point_start = layer.mapFromScene(start_point)
-            layer_point_end = layer.mapFromScene(end_point)
-            painter.drawLine(layer_point_start, layer_point_end)
-            painter.end()
-            layer.setPixmap(QPixmap.fromImage(image))
-
     def confirm_crop(self):
         if not self.crop_overlay or not self.crop_target_item:
             return
@@ -1901,11 +3190,7 @@ class ImageEditor(QMainWindow):
             rect = self.crop_overlay.rect()
             # 获取 QPixmap 并转换为 PIL Image
             pixmap = self.crop_target_item.pixmap()
-            buffer = QBuffer()
-            buffer.open(QIODevice.WriteOnly)
-            pixmap.save(buffer, "PNG")
-            input_bytes = buffer.data().data()
-            input_image = Image.open(BytesIO(input_bytes)).convert("RGBA")
+            input_image = qpixmap_to_pil(pixmap)
 
             # 计算裁剪区域相对于图像的位置
             crop_rect = self.crop_target_item.mapFromScene(rect).boundingRect()
@@ -1972,20 +3257,22 @@ class ImageEditor(QMainWindow):
         if not selected_items:
             QMessageBox.warning(self, "警告", "请选择一个图层来镜像。")
             return
+        states = []
         for item in selected_items:
             if (isinstance(item, ResizableGraphicsPixmapItem) or isinstance(item, ResizableGraphicsTextItem)) and not item.locked:
-                # 保存操作以便撤销
-                self.undo_stack.push(AddLayerCommand(self, item))
-
+                before = capture_transform(item)
                 transform = item.transform()
                 scale_x = -1 if horizontal else 1
                 scale_y = -1 if vertical else 1
                 transform.scale(scale_x, scale_y)
                 item.setTransform(transform)
+                states.append((item, before, capture_transform(item)))
                 logging.info(f"图层已镜像: {item.layer_name} 水平={horizontal} 垂直={vertical}")
-                self.add_history(f"镜像图层: {item.layer_name}")
             else:
                 QMessageBox.warning(self, "警告", f"图层 {item.layer_name} 无法镜像，可能已锁定。")
+        if states:
+            # 一次镜像的所有图层作为一个可撤销步骤
+            self.undo_stack.push(TransformLayersCommand(self, states, "镜像图层"))
 
     def adjust_layer(self):
         selected_items = self.scene.selectedItems()
@@ -2001,22 +3288,36 @@ class ImageEditor(QMainWindow):
             return
 
         # 打开调整对话框
+        if isinstance(item, ResizableGraphicsPixmapItem):
+            old_adjustments = list(item.adjustments)
+        else:
+            old_style = capture_text_style(item)
         dialog = AdjustmentDialog(item, self)
         result = dialog.exec_()
         if result == QDialog.Accepted:
-            # 保存操作以便撤销
-            self.undo_stack.push(AddLayerCommand(self, item))
-            logging.info(f"图层已调整: {item.layer_name}")
-            self.add_history(f"调整图层: {item.layer_name}")
+            if isinstance(item, ResizableGraphicsPixmapItem):
+                if item.adjustments != old_adjustments:
+                    self.undo_stack.push(AdjustLayerCommand(self, item, old_adjustments, item.adjustments))
+                    logging.info(f"图层已调整: {item.layer_name} ({len(item.adjustments)} 项调整)")
+                return
+            new_style = capture_text_style(item)
+            if new_style != old_style:
+                self.undo_stack.push(TextStyleCommand(self, item, old_style, new_style))
+                logging.info(f"图层已调整: {item.layer_name}")
 
     def zoom_in(self):
         selected_items = self.scene.selectedItems()
         if selected_items:
+            states = []
             for item in selected_items:
                 if isinstance(item, ResizableGraphicsPixmapItem) or isinstance(item, ResizableGraphicsTextItem):
+                    before = capture_transform(item)
                     scale_factor = 1.1
                     item.scale_factor *= scale_factor
                     item.setScale(item.scale_factor)
+                    states.append((item, before, capture_transform(item)))
+            # 连续点击合并为一次缩放
+            self.push_transform(states, "缩放图层", self.transform_gesture(("zoom_in", tuple(selected_items))))
         else:
             # 如果没有选中图层，放大视图
             self.view.scale(1.1, 1.1)
@@ -2024,11 +3325,16 @@ class ImageEditor(QMainWindow):
     def zoom_out(self):
         selected_items = self.scene.selectedItems()
         if selected_items:
+            states = []
             for item in selected_items:
                 if isinstance(item, ResizableGraphicsPixmapItem) or isinstance(item, ResizableGraphicsTextItem):
+                    before = capture_transform(item)
                     scale_factor = 0.9
                     item.scale_factor *= scale_factor
                     item.setScale(item.scale_factor)
+                    states.append((item, before, capture_transform(item)))
+            # 连续点击合并为一次缩放
+            self.push_transform(states, "缩放图层", self.transform_gesture(("zoom_out", tuple(selected_items))))
         else:
             # 如果没有选中图层，缩小视图
             self.view.scale(0.9, 0.9)
@@ -2077,36 +3383,39 @@ class ImageEditor(QMainWindow):
             if reply == QMessageBox.Yes:
                 try:
                     # 保存操作以便撤销
+                    # 命令负责从场景和图层列表移除
                     self.undo_stack.push(DeleteLayerCommand(self, item))
-
-                    self.layers.remove(item)
-                    self.scene.removeItem(item)
-                    # 从列表中移除
-                    self.update_layer_list()
                     self.status_label.setText("未选中图层")
                     logging.info(f"图层已删除: {item.layer_name}")
-                    self.add_history(f"删除图层: {item.layer_name}")
                 except Exception as e:
                     logging.error(f"删除图层失败: {e}")
                     QMessageBox.critical(self, "错误", f"删除图层失败: {e}")
 
     def update_layer_selection(self):
+        if self.syncing_selection:
+            return
+        # 场景只维护选中项集合，selectedItems 的开销与选中数量成正比
         selected_items = self.scene.selectedItems()
+        selected_layers = {item for item in selected_items if self.layer_model.contains(item)}
+        self.syncing_selection = True
+        try:
+            selection_model = self.layer_view.selectionModel()
+            for item in self.panel_selection - selected_layers:
+                if self.layer_model.contains(item):
+                    selection_model.select(self.layer_model.index_of(item), QItemSelectionModel.Deselect)
+            for item in selected_layers - self.panel_selection:
+                selection_model.select(self.layer_model.index_of(item), QItemSelectionModel.Select)
+        finally:
+            self.syncing_selection = False
+        self.panel_selection = selected_layers
         if selected_items:
             item = selected_items[0]
-            # 找到对应的列表项
-            iterator = QTreeWidgetItemIterator(self.layer_tree)
-            while iterator.value():
-                tree_item = iterator.value()
-                layer_item = tree_item.data(0, Qt.UserRole)
-                if layer_item == item:
-                    tree_item.setSelected(True)
-                    # 更新工具栏信息
-                    self.update_toolbar_info(item)
-                    # 更新属性面板
-                    self.property_panel.update_properties(item)
-                    return
-                iterator += 1
+            if item in selected_layers:
+                # 更新工具栏信息
+                self.update_toolbar_info(item)
+                # 更新属性面板
+                self.property_panel.update_properties(item)
+                return
         else:
             self.status_label.setText("未选中图层")
             self.current_brush_layer = None
@@ -2120,9 +3429,7 @@ class ImageEditor(QMainWindow):
             self.status_label.setText("未选中图层")
 
     def pil_image_to_qimage(self, pil_image):
-        data = pil_image.tobytes("raw", "RGBA")
-        qimage = QImage(data, pil_image.width, pil_image.height, QImage.Format_RGBA8888)
-        return qimage
+        return pil_to_qimage(pil_image)
 
     def auto_fit_image(self):
         # 调整视图以适应整个画布
@@ -2135,6 +3442,7 @@ class ImageEditor(QMainWindow):
         if not selected_items:
             QMessageBox.warning(self, "警告", "请选择要对齐的图层。")
             return
+        before = [capture_transform(item) for item in selected_items]
         if alignment in ['left', 'hcenter', 'right']:
             if alignment == 'left':
                 min_x = min(item.sceneBoundingRect().left() for item in selected_items)
@@ -2166,7 +3474,8 @@ class ImageEditor(QMainWindow):
                     offset = max_y - item.sceneBoundingRect().bottom()
                     item.setY(item.y() + offset)
         logging.info(f"图层已对齐: {alignment}")
-        self.add_history(f"图层对齐: {alignment}")
+        self.push_transform([(item, state, capture_transform(item)) for item, state in zip(selected_items, before)],
+                            f"图层对齐({alignment})")
 
     def merge_selected_layers(self):
         selected_items = self.scene.selectedItems()
@@ -2215,6 +3524,20 @@ class GraphicsView(QGraphicsView):
         self.rotation_start_pos = None
         self.parent = parent  # 引用父级 ImageEditor
         self.dragging = False
+        # 一次拖动或旋转手势开始时的图层几何状态
+        self.gesture_states = []
+        # 当前这一帧中图层缓存占用的字节数，见 ResizableGraphicsPixmapItem.paint_cached
+        self.layer_cache_bytes = 0
+
+    def capture_gesture(self, items):
+        self.gesture_states = [(item, capture_transform(item)) for item in items
+                               if isinstance(item, (ResizableGraphicsPixmapItem, ResizableGraphicsTextItem))]
+
+    def finish_gesture(self, text):
+        # 整个手势只推入一条撤销命令
+        states = [(item, before, capture_transform(item)) for item, before in self.gesture_states]
+        self.gesture_states = []
+        self.parent.push_transform(states, text, self.parent.new_transform_gesture())
 
     def wheelEvent(self, event):
         selected_items = self.scene().selectedItems()
@@ -2222,10 +3545,14 @@ class GraphicsView(QGraphicsView):
             # 仅对第一个选中的图层进行缩放
             item = selected_items[0]
             if isinstance(item, ResizableGraphicsPixmapItem) or isinstance(item, ResizableGraphicsTextItem):
+                before = capture_transform(item)
                 angle = event.angleDelta().y()
                 factor = 1.25 if angle > 0 else 0.8
                 item.scale_factor *= factor
                 item.setScale(item.scale_factor)
+                # 连续滚动合并为一个撤销步骤
+                self.parent.push_transform([(item, before, capture_transform(item))], "缩放图层",
+                                           self.parent.transform_gesture(("wheel", (item,))))
                 return
         # 如果没有选中图层，进行视图缩放
         if event.angleDelta().y() > 0:
@@ -2240,9 +3567,13 @@ class GraphicsView(QGraphicsView):
             if item and item in self.parent.rotation_target_items:
                 self.rotating = True
                 self.rotation_start_pos = scene_pos
+                self.capture_gesture(self.parent.rotation_target_items)
                 event.accept()
                 return
         super().mousePressEvent(event)
+        if event.button() == Qt.LeftButton:
+            # 按下后选中的图层即为将被拖动的图层
+            self.capture_gesture(self.scene().selectedItems())
 
     def mouseMoveEvent(self, event):
         if self.parent.rotate_btn.isChecked() and self.rotating:
@@ -2259,11 +3590,35 @@ class GraphicsView(QGraphicsView):
     def mouseReleaseEvent(self, event):
         if self.parent.rotate_btn.isChecked() and self.rotating:
             self.rotating = False
+            self.finish_gesture("旋转图层")
             event.accept()
             return
         super().mouseReleaseEvent(event)
+        if event.button() == Qt.LeftButton and self.gesture_states:
+            self.finish_gesture("移动图层")
+
+    def drawForeground(self, painter, rect):
+        # 编辑辅助的轮廓单独绘制在所有图层之上，不进入图层缓存，开销与选中数量成正比
+        super().drawForeground(painter, rect)
+        painter.save()
+        painter.setBrush(Qt.NoBrush)
+        base_canvas = getattr(self.parent, "base_canvas", None)
+        if base_canvas is not None and base_canvas.scene() is self.scene() and base_canvas.show_border:
+            # 绘制底图边框；线宽不随缩放变化，始终落在图层重绘区域内
+            pen = QPen(Qt.blue, 2, Qt.SolidLine)
+            pen.setCosmetic(True)
+            painter.setPen(pen)
+            painter.drawPolygon(base_canvas.mapToScene(base_canvas.boundingRect()))
+        pen = QPen(Qt.red, 2, Qt.DashLine)
+        pen.setCosmetic(True)
+        painter.setPen(pen)
+        for item in self.scene().selectedItems():
+            if isinstance(item, (ResizableGraphicsPixmapItem, ResizableGraphicsTextItem)):
+                painter.drawPolygon(item.mapToScene(item.boundingRect()))
+        painter.restore()
 
     def paintEvent(self, event):
+        self.layer_cache_bytes = 0
         super().paintEvent(event)
         if self.dragging:
             # Draw guidelines
@@ -2277,7 +3632,178 @@ class GraphicsView(QGraphicsView):
             painter.drawLine(self.mapFromScene(QPointF(rect.left(), center_y)), self.mapFromScene(QPointF(rect.right(), center_y)))
             painter.end()
 
+# 批处理：无界面地对整个目录执行 去除背景 -> 放置到画布 -> 导出 PNG
+BATCH_IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+# 每个工作进程各自加载一个 rembg 会话（数百 MB），默认只开少量进程
+BATCH_DEFAULT_JOBS = min(2, os.cpu_count() or 1)
+
+# 每个工作进程持有一个 QGuiApplication，QImage/QPainter 需要它
+_batch_app = None
+
+
+def init_batch_worker(threads=None):
+    global _batch_app
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    if threads:
+        # rembg 按 OMP_NUM_THREADS 设置 ONNX Runtime 的线程数，各进程分摊 CPU 核心，避免超额订阅
+        os.environ["OMP_NUM_THREADS"] = str(threads)
+    if QGuiApplication.instance() is None:
+        _batch_app = QGuiApplication([])
+
+
+def collect_batch_inputs(patterns, exclude_dir=None):
+    # 目录参数递归遍历所有子目录，输出按 batch_output_paths 镜像子目录结构
+    # exclude_dir（输出目录）位于输入目录内时跳过，重新运行不会把上次的输出当作输入
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            candidates = [os.path.join(directory, name)
+                          for directory, _, names in os.walk(pattern) for name in names]
+        else:
+            candidates = glob.glob(pattern, recursive=True)
+        paths.extend(path for path in candidates
+                     if os.path.isfile(path) and path.lower().endswith(BATCH_IMAGE_EXTENSIONS))
+    paths = set(os.path.abspath(path) for path in paths)
+    if exclude_dir is not None:
+        prefix = os.path.join(os.path.abspath(exclude_dir), "")
+        paths = {path for path in paths if not path.startswith(prefix)}
+    # 去重并保持稳定顺序
+    return sorted(paths)
+
+
+def batch_output_paths(inputs, output_dir):
+    # 输出按输入相对于公共目录的路径镜像，不同子目录中的同名文件互不覆盖
+    # 扩展名不同的同名文件（x.jpg 与 x.png）仍会映射到同一输出，作为冲突返回
+    try:
+        root = os.path.commonpath([os.path.dirname(path) for path in inputs])
+    except ValueError:
+        root = None  # 跨驱动器，无法求公共目录
+    outputs = {}
+    for input_path in inputs:
+        relative = os.path.relpath(input_path, root) if root else os.path.basename(input_path)
+        output_path = os.path.join(output_dir, os.path.splitext(relative)[0] + ".png")
+        outputs.setdefault(output_path, []).append(input_path)
+    mapping = [(paths[0], output_path) for output_path, paths in outputs.items() if len(paths) == 1]
+    conflicts = {output_path: paths for output_path, paths in outputs.items() if len(paths) > 1}
+    return mapping, conflicts
+
+
+def batch_process_file(input_path, output_path, canvas_size=None, margin=0, trim=False,
+                       model_name=DEFAULT_MODEL, proxy_side=PROXY_SIDE):
+    start = time.perf_counter()
+    image = QImage(input_path)
+    if image.isNull():
+        raise ValueError("无法加载图片。")
+    pixels = qimage_to_numpy(image)
+    output_image = remove_background(numpy_to_pil(pixels), model_name, pixels, proxy_side=proxy_side)
+    if trim:
+        # 裁掉四周的全透明区域，按主体放置
+        bbox = output_image.getchannel("A").getbbox()
+        if bbox:
+            output_image = output_image.crop(bbox)
+    cutout = pil_to_qimage(output_image)
+
+    # 画布未指定时与图片同尺寸，与打开图片时一致
+    width, height = canvas_size or (cutout.width(), cutout.height())
+    canvas = QImage(width, height, QImage.Format_ARGB32)
+    canvas.fill(Qt.transparent)
+    # 等比缩放到画布内（扣除边距）并居中
+    scale = min((width - 2 * margin) / cutout.width(), (height - 2 * margin) / cutout.height())
+    if scale <= 0:
+        raise ValueError("边距过大，画布上没有可用空间。")
+    target = QRectF(0, 0, cutout.width() * scale, cutout.height() * scale)
+    target.moveCenter(QPointF(width / 2, height / 2))
+    painter = QPainter(canvas)
+    painter.setRenderHint(QPainter.SmoothPixmapTransform)
+    painter.drawImage(target, cutout)
+    painter.end()
+
+    # 先写临时文件再改名，中断时不会留下被当作已完成的半成品
+    temp_path = f"{output_path}.part"
+    if not canvas.save(temp_path, "PNG"):
+        raise IOError(f"无法写入: {temp_path}")
+    os.replace(temp_path, output_path)
+    return time.perf_counter() - start
+
+
+def parse_canvas_size(text):
+    if text in PREDEFINED_CANVAS_SIZES:
+        return PREDEFINED_CANVAS_SIZES[text]
+    try:
+        width, height = map(int, text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的画布尺寸: {text}")
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError("尺寸必须为正整数。")
+    return width, height
+
+
+def batch_main(argv=None):
+    parser = argparse.ArgumentParser(prog="image_editor.py batch", description="批量去除背景并导出 PNG")
+    parser.add_argument("inputs", nargs="+", help="输入目录（含子目录）或通配符，如 'photos/**/*.jpg'")
+    parser.add_argument("-o", "--output", required=True, help="输出目录")
+    parser.add_argument("--canvas", type=parse_canvas_size, default=None,
+                        help=f"画布尺寸，{'/'.join(PREDEFINED_CANVAS_SIZES)} 或 宽x高；默认与图片同尺寸")
+    parser.add_argument("--margin", type=int, default=0, help="画布边距（像素）")
+    parser.add_argument("--trim", action="store_true", help="放置前裁掉四周透明区域")
+    parser.add_argument("--model", choices=MODEL_NAMES, default=DEFAULT_MODEL)
+    parser.add_argument("--no-proxy", action="store_true", help="始终全分辨率推理")
+    parser.add_argument("-j", "--jobs", type=int, default=BATCH_DEFAULT_JOBS,
+                        help=f"并行进程数（每个进程加载一份模型），默认 {BATCH_DEFAULT_JOBS}")
+    parser.add_argument("--overwrite", action="store_true", help="重新处理已存在的输出")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    os.makedirs(args.output, exist_ok=True)
+    inputs = collect_batch_inputs(args.inputs, args.output)
+    mapping, conflicts = batch_output_paths(inputs, args.output)
+    # 多个输入对应同一输出时全部不处理，避免互相覆盖或被误判为已完成
+    for output_path, paths in conflicts.items():
+        print(f"输出冲突，已跳过: {output_path} <- {', '.join(paths)}")
+    conflicted = sum(len(paths) for paths in conflicts.values())
+    tasks = []
+    skipped = 0
+    for input_path, output_path in mapping:
+        if not args.overwrite and os.path.exists(output_path):
+            skipped += 1
+            continue
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        tasks.append((input_path, output_path))
+    threads = max(1, (os.cpu_count() or 1) // args.jobs)
+    print(f"共 {len(inputs)} 个文件，跳过已完成 {skipped} 个，输出冲突 {conflicted} 个，待处理 {len(tasks)} 个，"
+          f"进程数 {args.jobs}，每进程推理线程 {threads}")
+    if not tasks:
+        return 1 if conflicted else 0
+
+    proxy_side = None if args.no_proxy else PROXY_SIDE
+    failed = 0
+    start = time.perf_counter()
+    # 用 spawn 启动工作进程，不继承父进程的 Qt 状态
+    with ProcessPoolExecutor(max_workers=args.jobs, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=init_batch_worker, initargs=(threads,)) as executor:
+        futures = {
+            executor.submit(batch_process_file, input_path, output_path, args.canvas, args.margin, args.trim,
+                            args.model, proxy_side): input_path
+            for input_path, output_path in tasks
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            input_path = futures[future]
+            try:
+                elapsed = future.result()
+                print(f"[{done}/{len(tasks)}] {input_path}: {elapsed:.2f} s")
+            except Exception as e:
+                failed += 1
+                print(f"[{done}/{len(tasks)}] {input_path}: 失败: {e}")
+    total = time.perf_counter() - start
+    print(f"完成 {len(tasks) - failed} 个，失败 {failed} 个，总耗时 {total:.2f} s，"
+          f"吞吐 {(len(tasks) - failed) / total:.2f} 张/秒")
+    return 1 if failed or conflicted else 0
+
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        sys.exit(batch_main(sys.argv[2:]))
     app = QApplication(sys.argv)
     editor = ImageEditor()
     editor.show()
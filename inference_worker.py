@@ -0,0 +1,171 @@
+# 独立进程中的背景去除推理
+# 推理在子进程中运行，不与GUI进程争用 GIL，原生运行时崩溃也不会拖垮编辑器
+# 像素通过共享内存传递：父进程写入 RGBA 像素，子进程原地写回结果
+import itertools
+import logging
+import multiprocessing
+import queue
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from background_removal import DEFAULT_MODEL
+
+# 等待结果时检查子进程存活的间隔（秒）
+POLL_INTERVAL = 0.2
+# 关闭时等待子进程自行退出的时间（秒）
+SHUTDOWN_TIMEOUT = 2.0
+
+
+def _worker_main(requests, responses):
+    from PIL import Image
+
+    from background_removal import remove_background, session_manager
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [推理进程] %(message)s')
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        kind = request[0]
+        if kind == "warm_up":
+            session_manager().warm_up(request[1])
+            continue
+        _, job_id, shm_name, width, height, model_name, proxy_side = request
+        try:
+            shm = shared_memory.SharedMemory(name=shm_name)
+        except Exception as e:
+            responses.put((job_id, str(e)))
+            continue
+        pixels = image = output_image = None
+        try:
+            pixels = np.ndarray((height, width, 4), np.uint8, buffer=shm.buf)
+            image = Image.frombuffer("RGBA", (width, height), pixels, "raw", "RGBA", 0, 1)
+            output_image = remove_background(image, model_name, pixels, proxy_side=proxy_side)
+            # 结果与输入同尺寸，直接写回共享内存
+            pixels[:] = np.asarray(output_image.convert("RGBA"))
+            responses.put((job_id, None))
+        except Exception as e:
+            responses.put((job_id, str(e)))
+        finally:
+            # 关闭共享内存前须释放所有指向它的视图
+            pixels = image = output_image = None
+            shm.close()
+
+
+class InferenceWorker:
+    def __init__(self):
+        self.context = multiprocessing.get_context("spawn")
+        self.process = None
+        self.requests = None
+        self.responses = None
+        # 只保护启动进程和提交请求，等待结果时不持有，预热等调用不会被正在进行的推理阻塞
+        self.lock = threading.Lock()
+        self.job_ids = itertools.count(1)
+        self.stopped = False
+        # 收集线程把子进程的结果按任务号放入 results，等待方各自取走
+        self.condition = threading.Condition()
+        self.results = {}
+        self.drained = set()  # 已退出且结果已全部取出的子进程
+
+    def ensure_started(self):
+        if self.process is not None and self.process.is_alive():
+            return
+        if self.process is not None:
+            logging.warning(f"推理进程已退出 (退出码 {self.process.exitcode})，正在重启")
+        # 旧队列可能残留已退出进程的数据，重启时一并重建
+        self.requests = self.context.Queue()
+        self.responses = self.context.Queue()
+        self.process = self.context.Process(target=_worker_main, args=(self.requests, self.responses),
+                                            name="rembg-worker", daemon=True)
+        self.process.start()
+        threading.Thread(target=self.collect_results, args=(self.process, self.responses),
+                         name="rembg-worker-results", daemon=True).start()
+        logging.info(f"推理进程已启动: pid {self.process.pid}")
+
+    def collect_results(self, process, responses):
+        # 子进程退出后结束；重启时由新进程的收集线程接替
+        while True:
+            try:
+                job_id, error = responses.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if not process.is_alive():
+                    with self.condition:
+                        self.drained.add(process)
+                        self.condition.notify_all()
+                    return
+                continue
+            with self.condition:
+                self.results[job_id] = error
+                self.condition.notify_all()
+
+    def warm_up(self, model_name=DEFAULT_MODEL):
+        with self.lock:
+            if self.stopped:
+                return
+            self.ensure_started()
+            self.requests.put(("warm_up", model_name))
+
+    def remove_background(self, pixels, model_name=DEFAULT_MODEL, proxy_side=None):
+        # pixels 为 (高, 宽, 4) 的 RGBA 数组，返回同尺寸的去除背景结果
+        height, width = pixels.shape[:2]
+        shm = shared_memory.SharedMemory(create=True, size=max(1, height * width * 4))
+        buffer = np.ndarray((height, width, 4), np.uint8, buffer=shm.buf)
+        try:
+            buffer[:] = pixels
+            with self.lock:
+                if self.stopped:
+                    raise RuntimeError("推理进程已关闭。")
+                self.ensure_started()
+                job_id = next(self.job_ids)
+                process = self.process
+                self.requests.put(("remove", job_id, shm.name, width, height, model_name, proxy_side))
+            error = self.wait_for(job_id, process)
+            if error is not None:
+                raise RuntimeError(error)
+            return buffer.copy()
+        finally:
+            del buffer
+            shm.close()
+            shm.unlink()
+
+    def wait_for(self, job_id, process):
+        # 阻塞等待结果，期间检查处理本任务的子进程是否崩溃；退出前已写出的结果仍会被取到
+        with self.condition:
+            while job_id not in self.results:
+                if process in self.drained:
+                    raise RuntimeError(f"推理进程异常退出 (退出码 {process.exitcode})，将在下次任务时重启。")
+                self.condition.wait(POLL_INTERVAL)
+            return self.results.pop(job_id)
+
+    def shutdown(self):
+        # 通知子进程退出，超时则强制结束；仍在等待结果的调用会收到进程退出的错误
+        self.stopped = True
+        process = self.process
+        if process is None:
+            return
+        if process.is_alive():
+            try:
+                self.requests.put(None)
+            except Exception:
+                pass
+            process.join(SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        # 释放队列持有的信号量
+        self.requests = self.responses = None
+        logging.info("推理进程已关闭")
+
+
+_inference_worker = None
+_inference_worker_lock = threading.Lock()
+
+
+def inference_worker():
+    global _inference_worker
+    with _inference_worker_lock:
+        if _inference_worker is None:
+            _inference_worker = InferenceWorker()
+        return _inference_worker
@@ -0,0 +1,334 @@
+# 图层面板的数据模型
+# 模型持有编辑器的图层列表（自底向上），面板自顶向下显示：第 row 行对应 layers[len - 1 - row]
+# 增删、替换和移动只发出受影响行的信号，视图不再整表重建
+# positions 是图层到列表位置的反向索引，行号与图层互查都是 O(1)；
+# 插入、删除只重建受影响位置之后的索引，追加和移除顶层图层（最常见）只更新一项
+# 缩略图按图层缓存，只有像素变化时才失效；生成按节流批量提交给后台线程缩小，
+# 视图只为可见行请求数据，滚动时只读取缓存
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+
+from PyQt5.QtCore import (
+    QAbstractListModel, QByteArray, QMimeData, QModelIndex, QPoint, QThread, QTimer, Qt, pyqtSignal
+)
+from PyQt5.QtGui import QImage, QPainter, QPixmap
+from PyQt5.QtWidgets import QStyleOptionGraphicsItem
+
+LAYER_ROWS_MIME_TYPE = "application/x-image-editor-layer-rows"
+THUMBNAIL_SIZE = 48
+# 缩略图提交间隔（毫秒）与每次最多提交的图层数
+THUMBNAIL_INTERVAL = 200
+THUMBNAIL_BATCH = 16
+LOCK_BADGE_SIZE = 16
+
+
+def scale_thumbnail(image):
+    # 先快速缩到目标的 4 倍以内，再平滑缩放，大图不必整幅做平滑插值
+    if image.width() > THUMBNAIL_SIZE * 4 or image.height() > THUMBNAIL_SIZE * 4:
+        image = image.scaled(THUMBNAIL_SIZE * 4, THUMBNAIL_SIZE * 4, Qt.KeepAspectRatio, Qt.FastTransformation)
+    return image.scaled(THUMBNAIL_SIZE, THUMBNAIL_SIZE, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+
+# 后台缩略图线程：按提交顺序缩小图像，同一图层尚未处理的旧请求被新请求覆盖
+class ThumbnailThread(QThread):
+    generated = pyqtSignal(object, int, QImage)  # 图层, 版本, 缩略图
+
+    def __init__(self):
+        super().__init__()
+        self.condition = threading.Condition()
+        self.pending = OrderedDict()
+        self.stopped = False
+
+    def request(self, layer, version, image):
+        with self.condition:
+            self.pending[id(layer)] = (layer, version, image)
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.pending.clear()
+            self.condition.notify()
+        self.wait()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                _, (layer, version, image) = self.pending.popitem(last=False)
+            try:
+                thumbnail = scale_thumbnail(image)
+            except Exception as e:
+                logging.error(f"生成缩略图失败: {e}")
+                continue
+            self.generated.emit(layer, version, thumbnail)
+
+
+class LayerListModel(QAbstractListModel):
+    layer_placed = pyqtSignal(object)  # 图层插入或移动到新位置，编辑器据此只更新该图层的 Z 值
+
+    def __init__(self, lock_icons, parent=None):
+        super().__init__(parent)
+        self.layers = []
+        self.positions = {}
+        # {是否锁定: 图标}，启动时创建一次
+        self.lock_icons = lock_icons
+        self.lock_badges = {locked: icon.pixmap(LOCK_BADGE_SIZE, LOCK_BADGE_SIZE)
+                            for locked, icon in lock_icons.items()}
+        # 缩略图缓存：图层 -> (版本, 缩略图)，带锁定角标的显示图另行缓存
+        # 弱引用图层：删除后可撤销的图层仍由撤销栈持有，缓存随之保留；图层被释放时条目自动移除
+        self.thumbnails = weakref.WeakKeyDictionary()
+        self.decorations = weakref.WeakKeyDictionary()
+        # 图层像素版本，pixels_changed 时递增，用于丢弃过期的生成结果
+        self.versions = weakref.WeakKeyDictionary()
+        self.stale = OrderedDict()
+        self.thumbnail_timer = QTimer(self)
+        self.thumbnail_timer.setSingleShot(True)
+        self.thumbnail_timer.setInterval(THUMBNAIL_INTERVAL)
+        self.thumbnail_timer.timeout.connect(self.submit_thumbnails)
+        self.thumbnail_thread = None
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.layers)
+
+    def reindex(self, start, end=None):
+        for position in range(start, len(self.layers) if end is None else end):
+            self.positions[self.layers[position]] = position
+
+    def contains(self, layer):
+        return layer in self.positions
+
+    def position_of(self, layer):
+        return self.positions[layer]
+
+    def row_of(self, layer):
+        return len(self.layers) - 1 - self.positions[layer]
+
+    def layer_at(self, row):
+        return self.layers[len(self.layers) - 1 - row]
+
+    def index_of(self, layer):
+        return self.index(self.row_of(layer))
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        layer = self.layer_at(index.row())
+        if role == Qt.DisplayRole:
+            return f"{layer.layer_name} (锁定)" if layer.locked else layer.layer_name
+        if role == Qt.DecorationRole:
+            return self.decoration(layer)
+        if role == Qt.CheckStateRole:
+            return Qt.Checked if layer.isVisible() else Qt.Unchecked
+        if role == Qt.UserRole:
+            return layer
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.isValid() or role != Qt.CheckStateRole:
+            return False
+        layer = self.layer_at(index.row())
+        # 锁定的图层不能切换可见性
+        if layer.locked:
+            return False
+        layer.setVisible(value == Qt.Checked)
+        self.dataChanged.emit(index, index, [Qt.CheckStateRole])
+        return True
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return "图层"
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            # 只能放在行之间，不能放到某一行上
+            return Qt.ItemIsDropEnabled
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsUserCheckable | Qt.ItemIsDragEnabled
+
+    def supportedDropActions(self):
+        return Qt.MoveAction
+
+    def mimeTypes(self):
+        return [LAYER_ROWS_MIME_TYPE]
+
+    def mimeData(self, indexes):
+        data = QMimeData()
+        rows = sorted({index.row() for index in indexes})
+        data.setData(LAYER_ROWS_MIME_TYPE, QByteArray(",".join(map(str, rows)).encode()))
+        return data
+
+    def dropMimeData(self, data, action, row, column, parent):
+        if action != Qt.MoveAction or not data.hasFormat(LAYER_ROWS_MIME_TYPE):
+            return False
+        text = bytes(data.data(LAYER_ROWS_MIME_TYPE)).decode()
+        if not text:
+            return False
+        if row < 0:
+            row = parent.row() if parent.isValid() else len(self.layers)
+        layers = [self.layer_at(int(source)) for source in text.split(",")]
+        for layer in layers:
+            source = self.row_of(layer)
+            self.move_row(source, row)
+            # 上移的行落在 row 处，下一行放在它之后
+            if source >= row:
+                row += 1
+        # 移动已在这里完成，视图随后调用的 removeRows 保持默认的不处理
+        return True
+
+    def move_row(self, source, destination):
+        # destination 为移动前的行号，语义同 beginMoveRows
+        if destination in (source, source + 1):
+            return
+        self.beginMoveRows(QModelIndex(), source, source, QModelIndex(), destination)
+        count = len(self.layers)
+        old_position = count - 1 - source
+        new_position = count - 1 - (destination - 1 if destination > source else destination)
+        layer = self.layers.pop(old_position)
+        self.layers.insert(new_position, layer)
+        # 只有两个位置之间的图层索引发生变化
+        self.reindex(min(old_position, new_position), max(old_position, new_position) + 1)
+        self.endMoveRows()
+        self.layer_placed.emit(layer)
+
+    def insert_layer(self, position, layer):
+        # position 为图层列表中的位置，越大越靠上
+        row = len(self.layers) - position
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.layers.insert(position, layer)
+        self.reindex(position)
+        self.endInsertRows()
+        self.layer_placed.emit(layer)
+
+    def append_layer(self, layer):
+        self.insert_layer(len(self.layers), layer)
+
+    def remove_layer(self, layer):
+        row = self.row_of(layer)
+        position = self.positions.pop(layer)
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.layers[position]
+        self.reindex(position)
+        self.endRemoveRows()
+
+    def replace_layer(self, old_layer, new_layer):
+        # 原位替换（裁剪），只刷新一行
+        position = self.positions.pop(old_layer)
+        self.layers[position] = new_layer
+        self.positions[new_layer] = position
+        # 被替换的图层只由撤销命令持有，撤销时会重新生成缩略图，不必继续缓存
+        self.thumbnails.pop(old_layer, None)
+        self.decorations.pop(old_layer, None)
+        self.versions.pop(old_layer, None)
+        index = self.index(len(self.layers) - 1 - position)
+        self.dataChanged.emit(index, index)
+        self.layer_placed.emit(new_layer)
+
+    def layer_changed(self, layer):
+        # 锁定状态或名称变化，缩略图本身不变，只需重新叠加角标
+        self.decorations.pop(layer, None)
+        index = self.index_of(layer)
+        self.dataChanged.emit(index, index)
+
+    def pixels_changed(self, layer):
+        # 像素变化（替换、画笔、调整）后缩略图失效，可见时再按节流重新生成
+        self.versions[layer] = self.versions.get(layer, 0) + 1
+        if self.contains(layer):
+            index = self.index_of(layer)
+            self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    def decoration(self, layer):
+        version = self.versions.get(layer, 0)
+        cached = self.thumbnails.get(layer)
+        if cached is None or cached[0] != version:
+            self.request_thumbnail(layer)
+        if cached is None:
+            return self.lock_icons[bool(layer.locked)]
+        decoration = self.decorations.get(layer)
+        if decoration is None:
+            decoration = self.decorations[layer] = self.compose_decoration(cached[1], layer.locked)
+        return decoration
+
+    def compose_decoration(self, thumbnail, locked):
+        # 缩略图居中放在固定尺寸的画布上，右下角叠加锁定图标
+        pixmap = QPixmap(THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+        pixmap.fill(Qt.transparent)
+        painter = QPainter(pixmap)
+        painter.drawImage(QPoint((THUMBNAIL_SIZE - thumbnail.width()) // 2,
+                                 (THUMBNAIL_SIZE - thumbnail.height()) // 2), thumbnail)
+        badge = self.lock_badges[bool(locked)]
+        painter.drawPixmap(THUMBNAIL_SIZE - badge.width(), THUMBNAIL_SIZE - badge.height(), badge)
+        painter.end()
+        return pixmap
+
+    def request_thumbnail(self, layer):
+        self.stale[layer] = None
+        if not self.thumbnail_timer.isActive():
+            self.thumbnail_timer.start()
+
+    def submit_thumbnails(self):
+        # 每个间隔最多提交 THUMBNAIL_BATCH 个图层，其余留到下一次
+        if self.thumbnail_thread is None:
+            self.thumbnail_thread = ThumbnailThread()
+            self.thumbnail_thread.generated.connect(self.thumbnail_generated)
+            self.thumbnail_thread.start()
+        for _ in range(min(THUMBNAIL_BATCH, len(self.stale))):
+            layer, _ = self.stale.popitem(last=False)
+            if not self.contains(layer):
+                continue
+            version = self.versions.get(layer, 0)
+            image = self.layer_image(layer)
+            if image is not None:
+                self.thumbnail_thread.request(layer, version, image)
+        if self.stale:
+            self.thumbnail_timer.start()
+
+    def layer_image(self, layer):
+        if hasattr(layer, "displayed_image"):
+            # 取当前显示像素的隐式共享快照，不同步画笔、不渲染调整栈，也不复制整幅像素
+            image = layer.displayed_image()
+            return None if image.isNull() else image
+        # 文字图层直接按缩略图尺寸绘制，开销很小
+        rect = layer.boundingRect()
+        if rect.isEmpty():
+            return None
+        scale = min(THUMBNAIL_SIZE * 4 / rect.width(), THUMBNAIL_SIZE * 4 / rect.height(), 1.0)
+        image = QImage(max(1, int(rect.width() * scale)), max(1, int(rect.height() * scale)),
+                       QImage.Format_ARGB32_Premultiplied)
+        image.fill(Qt.transparent)
+        painter = QPainter(image)
+        painter.scale(scale, scale)
+        painter.translate(-rect.topLeft())
+        layer.paint(painter, QStyleOptionGraphicsItem(), None)
+        painter.end()
+        return image
+
+    def thumbnail_generated(self, layer, version, thumbnail):
+        # 生成期间像素又变化，或图层已不在列表中（重新显示时会再请求）
+        if self.versions.get(layer, 0) != version or not self.contains(layer):
+            return
+        self.thumbnails[layer] = (version, thumbnail)
+        self.decorations.pop(layer, None)
+        index = self.index_of(layer)
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    def shutdown(self):
+        self.thumbnail_timer.stop()
+        if self.thumbnail_thread is not None:
+            self.thumbnail_thread.stop()
+            self.thumbnail_thread = None
+
+    def clear(self):
+        self.beginResetModel()
+        self.layers.clear()
+        self.positions.clear()
+        self.thumbnails.clear()
+        self.decorations.clear()
+        self.versions.clear()
+        self.stale.clear()
+        self.endResetModel()
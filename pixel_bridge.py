@@ -0,0 +1,91 @@
+# QPixmap/QImage 与 PIL/NumPy 之间的像素缓冲桥接
+# 直接映射 QImage 的像素内存，避免 PNG 编码/解码往返
+import numpy as np
+from PyQt5.QtGui import QImage, QPixmap
+from PIL import Image
+
+
+# 持有源 QImage 的 ndarray 视图，保证底层缓冲在视图存活期间不被释放
+class _QImageArray(np.ndarray):
+    def __array_finalize__(self, obj):
+        self._owner = getattr(obj, "_owner", None)
+
+
+def _as_rgba8888(image):
+    if image.isNull():
+        raise ValueError("图像为空，无法转换。")
+    if image.format() != QImage.Format_RGBA8888:
+        image = image.convertToFormat(QImage.Format_RGBA8888)
+    return image
+
+
+def qimage_to_numpy(image, writable=False):
+    # 返回 (高, 宽, 4) 的 RGBA uint8 视图；默认只读，不复制像素
+    image = _as_rgba8888(image)
+    width, height = image.width(), image.height()
+    ptr = image.bits() if writable else image.constBits()
+    ptr.setsize(image.sizeInBytes())
+    rows = np.frombuffer(ptr, np.uint8).reshape(height, image.bytesPerLine())
+    array = rows[:, :width * 4].reshape(height, width, 4).view(_QImageArray)
+    array._owner = image
+    return array
+
+
+def qimage_pixels32(image):
+    # 32 位格式 QImage 的可写 (高, 宽, 4) 原始像素视图，不做格式转换，通道顺序取决于格式
+    if image.depth() != 32:
+        raise ValueError(f"不支持的图像位深: {image.depth()}")
+    width, height = image.width(), image.height()
+    ptr = image.bits()
+    ptr.setsize(image.sizeInBytes())
+    rows = np.frombuffer(ptr, np.uint8).reshape(height, image.bytesPerLine())
+    array = rows[:, :width * 4].reshape(height, width, 4).view(_QImageArray)
+    array._owner = image
+    return array
+
+
+def qpixmap_to_numpy(pixmap):
+    return qimage_to_numpy(pixmap.toImage())
+
+
+def numpy_to_pil(array):
+    if not array.flags.c_contiguous:
+        array = np.ascontiguousarray(array)
+    # frombuffer 会持有 array 的引用，若 array 是 QImage 视图则间接持有 QImage
+    return Image.frombuffer("RGBA", (array.shape[1], array.shape[0]), array, "raw", "RGBA", 0, 1)
+
+
+def qimage_to_pil(image):
+    return numpy_to_pil(qimage_to_numpy(image))
+
+
+def qpixmap_to_pil(pixmap):
+    return qimage_to_pil(pixmap.toImage())
+
+
+def numpy_to_qimage(array):
+    if array.ndim != 3 or array.shape[2] != 4 or array.dtype != np.uint8:
+        raise ValueError(f"不支持的数组格式: {array.shape} {array.dtype}")
+    if not array.flags.c_contiguous:
+        array = np.ascontiguousarray(array)
+    height, width = array.shape[:2]
+    image = QImage(array.data, width, height, array.strides[0], QImage.Format_RGBA8888)
+    # QImage 不拥有外部缓冲，需要保留源数组的引用；跨线程传递前须先 copy()
+    image._buffer = array
+    return image
+
+
+def numpy_to_qpixmap(array):
+    return QPixmap.fromImage(numpy_to_qimage(array))
+
+
+def pil_to_qimage(pil_image):
+    if pil_image.mode != "RGBA":
+        pil_image = pil_image.convert("RGBA")
+    data = pil_image.tobytes("raw", "RGBA")
+    # 复制到 QImage 自己的缓冲，结果可以安全地通过信号跨线程传递
+    return QImage(data, pil_image.width, pil_image.height, pil_image.width * 4, QImage.Format_RGBA8888).copy()
+
+
+def pil_to_qpixmap(pil_image):
+    return QPixmap.fromImage(pil_to_qimage(pil_image))
@@ -0,0 +1,75 @@
+# 调整流水线测试：查找表与 ImageEnhance 逐位一致，分块渲染与整图渲染一致
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image, ImageEnhance
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from adjustments import (
+    IDENTITY_PARAMS, apply_luts, channel_histogram, filter_halo, pre_tone_luts, render_adjustments, render_tiled,
+    tile_layout
+)
+
+# 滑块范围 0-200，对应系数 0.00-2.00
+SLIDER_FACTORS = [value / 100 for value in range(201)]
+
+
+def sample_images():
+    ramp = np.zeros((4, 256, 4), np.uint8)
+    ramp[..., :3] = np.arange(256, dtype=np.uint8)[None, :, None]
+    ramp[..., 3] = 255
+    rng = np.random.default_rng(7)
+    noise = rng.integers(0, 256, (48, 48, 4), dtype=np.uint8)
+    return [Image.fromarray(ramp, "RGBA"), Image.fromarray(noise, "RGBA")]
+
+
+def enhance(image, brightness, contrast):
+    if brightness != 1.0:
+        image = ImageEnhance.Brightness(image).enhance(brightness)
+    if contrast != 1.0:
+        image = ImageEnhance.Contrast(image).enhance(contrast)
+    return np.asarray(image)
+
+
+def tone(image, brightness, contrast):
+    params = IDENTITY_PARAMS._replace(brightness=brightness, contrast=contrast)
+    return np.asarray(apply_luts(image, pre_tone_luts(params, channel_histogram(image))))
+
+
+@pytest.mark.parametrize("image", sample_images(), ids=["ramp", "noise"])
+def test_brightness_and_contrast_match_image_enhance(image):
+    for factor in SLIDER_FACTORS:
+        assert np.array_equal(tone(image, factor, 1.0), enhance(image, factor, 1.0)), f"亮度 {factor}"
+        assert np.array_equal(tone(image, 1.0, factor), enhance(image, 1.0, factor)), f"对比度 {factor}"
+
+
+@pytest.mark.parametrize("image", sample_images(), ids=["ramp", "noise"])
+def test_chained_brightness_contrast_match_image_enhance(image):
+    for brightness in SLIDER_FACTORS[::7]:
+        for contrast in SLIDER_FACTORS[::9]:
+            assert np.array_equal(tone(image, brightness, contrast), enhance(image, brightness, contrast)), \
+                f"亮度 {brightness} 对比度 {contrast}"
+
+
+@pytest.mark.parametrize("filter_name, radius", [("模糊", 2.0), ("模糊", 12.0), ("方框模糊", 5.0), ("浮雕", 2.0)])
+def test_tiled_render_matches_whole_image(filter_name, radius):
+    image = sample_images()[1].resize((300, 220))
+    params = IDENTITY_PARAMS._replace(contrast=1.3, sharpness=1.6, filter_name=filter_name, filter_radius=radius)
+    whole = np.asarray(render_adjustments(image, params))
+    # 块比 halo 小也必须拼出与整图一致的结果
+    for tile_size in (64, 97):
+        assert np.array_equal(np.asarray(render_tiled(image, params, tile_size=tile_size)), whole)
+    assert np.array_equal(np.asarray(render_tiled(image, params, workers=1)), whole)
+
+
+def test_tile_layout_grows_with_halo_and_falls_back_to_whole_image():
+    assert tile_layout(4000, 3000, 9, workers=1) is None
+    assert tile_layout(4000, 3000, 9, workers=8) == 512
+    assert tile_layout(4000, 3000, 303, workers=8) >= 4 * 303
+    # halo 大到只能切出一两块时，分块只会多算重叠边
+    assert tile_layout(4000, 3000, 903, workers=8) is None
+    assert tile_layout(400, 300, 9, workers=8) is None
+    assert filter_halo(IDENTITY_PARAMS._replace(filter_name="模糊", filter_radius=100.0)) == 303
@@ -0,0 +1,81 @@
+# 批处理测试：递归收集输入、按子目录镜像输出、重新运行时跳过已完成的输出
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("PyQt5")
+pytest.importorskip("rembg")
+
+from PyQt5.QtGui import QColor, QGuiApplication, QImage
+
+from image_editor import batch_main, batch_output_paths, collect_batch_inputs
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb"):
+        pass
+
+
+@pytest.fixture
+def photos(tmp_path):
+    root = tmp_path / "photos"
+    for relative in ("a.jpg", "notes.txt", "sub/b.PNG", "sub/deeper/c.jpeg", "out/old.png"):
+        touch(str(root / relative))
+    return root
+
+
+def test_directory_inputs_are_collected_recursively(photos):
+    inputs = collect_batch_inputs([str(photos)], exclude_dir=str(photos / "out"))
+    assert inputs == sorted(str(photos / relative) for relative in ("a.jpg", "sub/b.PNG", "sub/deeper/c.jpeg"))
+    # 不排除输出目录时，上次的输出也会被当作输入
+    assert str(photos / "out" / "old.png") in collect_batch_inputs([str(photos)])
+
+
+def test_nested_inputs_mirror_the_directory_layout(photos, tmp_path):
+    inputs = collect_batch_inputs([str(photos)], exclude_dir=str(photos / "out"))
+    mapping, conflicts = batch_output_paths(inputs, str(tmp_path / "result"))
+    assert not conflicts
+    assert dict(mapping) == {
+        str(photos / "a.jpg"): str(tmp_path / "result" / "a.png"),
+        str(photos / "sub" / "b.PNG"): str(tmp_path / "result" / "sub" / "b.png"),
+        str(photos / "sub" / "deeper" / "c.jpeg"): str(tmp_path / "result" / "sub" / "deeper" / "c.png"),
+    }
+
+
+def write_image(path, color):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    image = QImage(40, 30, QImage.Format_ARGB32)
+    image.fill(color)
+    assert image.save(path)
+
+
+def test_batch_resumes_and_skips_finished_outputs(tmp_path, capsys):
+    app = QGuiApplication.instance() or QGuiApplication([])
+    write_image(str(tmp_path / "in" / "a.png"), QColor(250, 250, 250))
+    write_image(str(tmp_path / "in" / "sub" / "b.png"), QColor(20, 20, 20))
+    output = tmp_path / "out"
+    # 上次运行中断时留下的半成品不算已完成
+    os.makedirs(str(output / "sub"))
+    with open(str(output / "sub" / "b.png.part"), "wb") as f:
+        f.write(b"partial")
+    write_image(str(output / "a.png"), QColor(1, 2, 3))
+    argv = [str(tmp_path / "in"), "-o", str(output), "-j", "1"]
+
+    assert batch_main(argv) == 0
+    assert "跳过已完成 1 个" in capsys.readouterr().out
+    assert QImage(str(output / "a.png")).pixelColor(0, 0) == QColor(1, 2, 3)
+    assert not QImage(str(output / "sub" / "b.png")).isNull()
+    assert not os.path.exists(str(output / "sub" / "b.png.part"))
+
+    assert batch_main(argv) == 0
+    assert "跳过已完成 2 个" in capsys.readouterr().out
+
+    assert batch_main(argv + ["--overwrite"]) == 0
+    assert "待处理 2 个" in capsys.readouterr().out
+    assert QImage(str(output / "a.png")).pixelColor(0, 0) != QColor(1, 2, 3)
+    app.processEvents()
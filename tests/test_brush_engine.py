@@ -0,0 +1,52 @@
+# 印章笔刷测试：只保存笔画触及的图块，遮罩随笔画范围扩大，合成结果不超过设定的不透明度
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("PyQt5")
+
+from PyQt5.QtCore import QPointF
+from PyQt5.QtGui import QColor, QGuiApplication, QImage
+
+from brush_engine import SNAPSHOT_TILE_SIZE, BrushSettings, DabStroke
+
+
+@pytest.fixture
+def image():
+    app = QGuiApplication.instance() or QGuiApplication([])
+    image = QImage(2000, 1500, QImage.Format_ARGB32_Premultiplied)
+    image.fill(QColor(255, 255, 255))
+    yield image
+    app.processEvents()
+
+
+def paint(stroke, points):
+    stroke.composite(stroke.stamp_polyline(points))
+
+
+def test_stroke_keeps_only_touched_tiles(image):
+    stroke = DabStroke(image, BrushSettings(20, 1.0, 1.0, 1.0, 0.1), QColor(0, 0, 255))
+    paint(stroke, [QPointF(120, 60), QPointF(140, 60)])
+    paint(stroke, [QPointF(400, 60)])
+    assert set(stroke.snapshot) == {(0, 0), (1, 0), (2, 0), (3, 0)}
+    assert all(tile.width() <= SNAPSHOT_TILE_SIZE for tile in stroke.snapshot.values())
+    assert stroke.mask_rect.contains(390, 50) and stroke.mask_rect.contains(110, 50)
+    assert stroke.mask.width() * stroke.mask.height() < image.width() * image.height() // 4
+    assert image.pixelColor(130, 60) == QColor(0, 0, 255)
+    assert image.pixelColor(1900, 1400) == QColor(255, 255, 255)
+
+
+def test_overlapping_dabs_do_not_exceed_opacity(image):
+    stroke = DabStroke(image, BrushSettings(30, 1.0, 0.5, 1.0, 0.1), QColor(0, 0, 0))
+    for _ in range(5):
+        paint(stroke, [QPointF(1990, 700), QPointF(1990, 760)])
+    # 跨越图层右边缘的笔画同样只在遮罩范围内合成
+    assert stroke.mask_rect.right() == image.width() - 1
+    assert abs(image.pixelColor(1990, 730).red() - 128) <= 1
+    paint(stroke, [QPointF(1990, 1400)])
+    assert abs(image.pixelColor(1990, 730).red() - 128) <= 1
+    assert abs(image.pixelColor(1990, 1400).red() - 128) <= 1
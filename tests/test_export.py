@@ -0,0 +1,54 @@
+# 回归测试：导出（离屏 scene.render）总是使用调整栈的最新渲染结果，而不是视口尚未更新的像素
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("PyQt5")
+pytest.importorskip("rembg")
+
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QColor, QImage, QPainter, QPixmap
+from PyQt5.QtWidgets import QApplication
+
+from image_editor import IDENTITY_PARAMS, AddLayerCommand, AdjustLayerCommand, ImageEditor, ResizableGraphicsPixmapItem
+
+
+@pytest.fixture
+def editor():
+    app = QApplication.instance() or QApplication([])
+    editor = ImageEditor()
+    editor.show()
+    app.processEvents()
+    yield editor
+    editor.close()
+    app.processEvents()
+
+
+def export(editor):
+    image = QImage(editor.canvas_width, editor.canvas_height, QImage.Format_ARGB32)
+    image.fill(Qt.transparent)
+    painter = QPainter(image)
+    editor.scene.render(painter)
+    painter.end()
+    return image
+
+
+def test_export_right_after_adjustment_uses_new_pixels(editor):
+    pixmap = QPixmap(editor.canvas_width, editor.canvas_height)
+    pixmap.fill(QColor(100, 100, 100))
+    layer = ResizableGraphicsPixmapItem(pixmap, "导出")
+    editor.undo_stack.push(AddLayerCommand(editor, layer))
+    # 视口先以旧像素绘制一次
+    editor.view.viewport().repaint()
+
+    editor.undo_stack.push(AdjustLayerCommand(editor, layer, [], [IDENTITY_PARAMS._replace(brightness=1.5)]))
+    assert QColor(export(editor).pixel(10, 10)).red() == 150
+
+    editor.undo_stack.undo()
+    editor.view.viewport().repaint()
+    editor.undo_stack.redo()
+    assert QColor(export(editor).pixel(10, 10)).red() == 150
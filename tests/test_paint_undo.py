@@ -0,0 +1,92 @@
+# 回归测试：在有调整栈的图层上绘制后，撤销/重做笔画和调整都能恢复正确的像素与调整栈
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("PyQt5")
+pytest.importorskip("rembg")
+
+from PyQt5.QtCore import QPointF
+from PyQt5.QtGui import QColor, QPixmap
+from PyQt5.QtWidgets import QApplication
+
+from image_editor import (
+    IDENTITY_PARAMS, AddLayerCommand, AdjustLayerCommand, ImageEditor, ResizableGraphicsPixmapItem
+)
+
+
+@pytest.fixture
+def editor():
+    app = QApplication.instance() or QApplication([])
+    editor = ImageEditor()
+    yield editor
+    editor.close()
+    app.processEvents()
+
+
+def pixel(layer, x, y):
+    return layer.pixmap().toImage().pixelColor(x, y)
+
+
+def test_adjust_paint_undo_undo_redo(editor):
+    pixmap = QPixmap(64, 64)
+    pixmap.fill(QColor(100, 100, 100))
+    layer = ResizableGraphicsPixmapItem(pixmap, "画笔撤销")
+    editor.undo_stack.push(AddLayerCommand(editor, layer))
+    brightness = IDENTITY_PARAMS._replace(brightness=1.5)
+    editor.undo_stack.push(AdjustLayerCommand(editor, layer, [], [brightness]))
+    assert pixel(layer, 60, 60).red() == 150
+
+    # 在左上角画一笔，右下角保持调整后的像素
+    pen = editor.brush_tool.pen()
+    pen.setColor(QColor(0, 0, 255))
+    editor.stroke_engine.begin(layer, QPointF(5, 5), pen, editor.brush_tool.composition_mode())
+    editor.stroke_engine.add_point(QPointF(20, 5))
+    editor.finish_stroke(QPointF(20, 5))
+    assert pixel(layer, 10, 5).blue() == 255
+    assert pixel(layer, 60, 60).red() == 150
+
+    editor.undo_stack.undo()  # 撤销笔画
+    assert layer.adjustments == [brightness]
+    assert pixel(layer, 10, 5).red() == 150
+    assert pixel(layer, 60, 60).red() == 150
+
+    editor.undo_stack.undo()  # 撤销调整
+    assert layer.adjustments == []
+    assert pixel(layer, 60, 60).red() == 100
+
+    editor.undo_stack.redo()  # 重做调整，不会重复应用
+    assert layer.adjustments == [brightness]
+    assert pixel(layer, 60, 60).red() == 150
+
+    editor.undo_stack.redo()  # 重做笔画
+    assert pixel(layer, 10, 5).blue() == 255
+    assert pixel(layer, 60, 60).red() == 150
+
+
+def test_two_strokes_on_adjusted_layer_undo_in_order(editor):
+    pixmap = QPixmap(64, 64)
+    pixmap.fill(QColor(100, 100, 100))
+    layer = ResizableGraphicsPixmapItem(pixmap, "两笔撤销")
+    editor.undo_stack.push(AddLayerCommand(editor, layer))
+    brightness = IDENTITY_PARAMS._replace(brightness=1.5)
+    editor.undo_stack.push(AdjustLayerCommand(editor, layer, [], [brightness]))
+
+    pen = editor.brush_tool.pen()
+    pen.setColor(QColor(0, 0, 255))
+    for y in (5, 30):
+        editor.stroke_engine.begin(layer, QPointF(5, y), pen, editor.brush_tool.composition_mode())
+        editor.stroke_engine.add_point(QPointF(20, y))
+        editor.finish_stroke(QPointF(20, y))
+
+    editor.undo_stack.undo()  # 只撤销第二笔
+    assert pixel(layer, 10, 5).blue() == 255
+    assert pixel(layer, 10, 30).red() == 150
+
+    editor.undo_stack.undo()  # 撤销第一笔，恢复调整栈
+    assert layer.adjustments == [brightness]
+    assert pixel(layer, 10, 5).red() == 150
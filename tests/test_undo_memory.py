@@ -0,0 +1,95 @@
+# 撤销栈内存预算测试：超出预算的命令换出到磁盘，撤销/重做时读回，丢弃的命令不留下换出文件
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("PyQt5")
+pytest.importorskip("rembg")
+
+from PyQt5.QtCore import QPointF
+from PyQt5.QtGui import QColor, QPixmap
+from PyQt5.QtWidgets import QApplication
+
+from image_editor import AddLayerCommand, DeleteLayerCommand, ImageEditor, ResizableGraphicsPixmapItem
+
+
+@pytest.fixture
+def editor():
+    app = QApplication.instance() or QApplication([])
+    editor = ImageEditor()
+    yield editor
+    editor.close()
+    app.processEvents()
+
+
+def pixel(layer, x, y):
+    return layer.pixmap().toImage().pixelColor(x, y)
+
+
+def stroke(editor, layer, y, color):
+    pen = editor.brush_tool.pen()
+    pen.setColor(color)
+    editor.stroke_engine.begin(layer, QPointF(5, y), pen, editor.brush_tool.composition_mode())
+    editor.stroke_engine.add_point(QPointF(200, y))
+    editor.finish_stroke(QPointF(200, y))
+
+
+def spill_files(editor):
+    return [path for path in editor.undo_memory.store.files if os.path.exists(path)]
+
+
+def test_spilled_strokes_reload_on_undo_and_redo(editor):
+    pixmap = QPixmap(256, 256)
+    pixmap.fill(QColor(100, 100, 100))
+    layer = ResizableGraphicsPixmapItem(pixmap, "换出")
+    editor.undo_stack.push(AddLayerCommand(editor, layer))
+    colors = [QColor(255, 0, 0), QColor(0, 255, 0), QColor(0, 0, 255)]
+    for index, color in enumerate(colors):
+        stroke(editor, layer, 20 + index * 60, color)
+    editor.undo_memory.set_budget(0)
+    # 三条笔画的图块都已写入磁盘
+    assert len(spill_files(editor)) == 3
+    assert editor.undo_memory.memory_bytes == 0
+
+    for index in reversed(range(len(colors))):
+        editor.undo_stack.undo()
+        assert pixel(layer, 100, 20 + index * 60) == QColor(100, 100, 100)
+    assert len(spill_files(editor)) == 3
+    for index, color in enumerate(colors):
+        editor.undo_stack.redo()
+        assert pixel(layer, 100, 20 + index * 60) == color
+
+
+def test_deleted_layer_spills_and_restores(editor):
+    pixmap = QPixmap(128, 128)
+    pixmap.fill(QColor(10, 20, 30))
+    layer = ResizableGraphicsPixmapItem(pixmap, "删除后换出")
+    editor.undo_stack.push(AddLayerCommand(editor, layer))
+    editor.undo_stack.push(DeleteLayerCommand(editor, layer))
+    editor.undo_memory.set_budget(0)
+    assert len(spill_files(editor)) == 1
+    editor.undo_stack.undo()
+    assert layer.scene() is editor.scene
+    assert pixel(layer, 64, 64) == QColor(10, 20, 30)
+
+
+def test_discarded_redo_branch_removes_spill_files(editor):
+    pixmap = QPixmap(256, 256)
+    pixmap.fill(QColor(100, 100, 100))
+    layer = ResizableGraphicsPixmapItem(pixmap, "丢弃重做")
+    editor.undo_stack.push(AddLayerCommand(editor, layer))
+    stroke(editor, layer, 20, QColor(255, 0, 0))
+    stroke(editor, layer, 80, QColor(0, 255, 0))
+    editor.undo_memory.set_budget(0)
+    paths = spill_files(editor)
+    editor.undo_stack.undo()
+    editor.undo_stack.undo()
+    # 新笔画覆盖重做分支，被丢弃命令的换出文件随之删除
+    stroke(editor, layer, 140, QColor(0, 0, 255))
+    assert not any(os.path.exists(path) for path in paths)
+    assert pixel(layer, 100, 20) == QColor(100, 100, 100)
+    assert pixel(layer, 100, 140) == QColor(0, 0, 255)
@@ -0,0 +1,238 @@
+# 撤销栈内存预算
+# 统计每条撤销命令持有的像素字节数，超出预算时把离当前位置最远的命令的像素压缩写入临时目录，
+# 撤销/重做执行到该命令时再透明地读回
+import itertools
+import logging
+import os
+import pickle
+import shutil
+import struct
+import tempfile
+import weakref
+import zlib
+
+from PyQt5.QtCore import QObject, pyqtSignal
+from PyQt5.QtGui import QImage, QPixmap
+
+UNDO_MEMORY_BUDGET = 512 * 1024 * 1024
+
+_IMAGE_HEADER = struct.Struct("<iiii")  # 宽, 高, 每行字节数, 格式
+
+
+def pixmap_nbytes(pixmap):
+    if pixmap is None or pixmap.isNull():
+        return 0
+    return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+
+def encode_pixmap(pixmap):
+    image = pixmap.toImage()
+    bits = image.constBits()
+    bits.setsize(image.sizeInBytes())
+    header = _IMAGE_HEADER.pack(image.width(), image.height(), image.bytesPerLine(), int(image.format()))
+    return header + zlib.compress(bytes(bits), 1)
+
+
+def decode_pixmap(data):
+    width, height, bytes_per_line, image_format = _IMAGE_HEADER.unpack_from(data)
+    pixels = zlib.decompress(data[_IMAGE_HEADER.size:])
+    image = QImage(pixels, width, height, bytes_per_line, QImage.Format(image_format)).copy()
+    return QPixmap.fromImage(image)
+
+
+# 换出数据的临时文件存储，首次写入时才创建目录
+class SpillStore:
+    def __init__(self):
+        self.directory = None
+        self.ids = itertools.count(1)
+        self.disk_bytes = 0
+        self.files = {}  # 路径 -> 字节数
+        # 同一图层可能被多条命令引用（添加后又删除），共用一个换出记录
+        self.item_payloads = weakref.WeakKeyDictionary()
+
+    def item_payload(self, item):
+        payload = self.item_payloads.get(item)
+        if payload is None:
+            payload = self.item_payloads[item] = ItemPayload(self, item)
+        return payload
+
+    def write(self, data):
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix="image-editor-undo-")
+        path = os.path.join(self.directory, f"{next(self.ids)}.bin")
+        with open(path, "wb") as f:
+            f.write(data)
+        self.files[path] = len(data)
+        self.disk_bytes += len(data)
+        return path
+
+    def read(self, path):
+        # 读回后删除文件，数据重新由内存持有
+        with open(path, "rb") as f:
+            data = f.read()
+        self.discard(path)
+        return data
+
+    def discard(self, path):
+        self.disk_bytes -= self.files.pop(path)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def prune(self, reachable_paths):
+        # 删除撤销栈中已不存在的命令留下的换出文件
+        unreachable = [path for path in self.files if path not in reachable_paths]
+        for path in unreachable:
+            self.discard(path)
+        return len(unreachable)
+
+    def clear(self):
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+        self.files.clear()
+        self.disk_bytes = 0
+
+
+# 可换出的像素数据；nbytes 只统计由撤销栈单独持有、可以换出的内存
+class PixmapPayload:
+    def __init__(self, store, pixmap, layer=None):
+        self.store = store
+        self.pixmap = pixmap
+        self.layer = layer
+        self.path = None
+
+    def is_live(self):
+        # 与图层当前源图共享数据时换出也释放不了内存
+        source = getattr(self.layer, "source_pixmap", None)
+        return self.pixmap is not None and source is not None and source.cacheKey() == self.pixmap.cacheKey()
+
+    def nbytes(self):
+        if self.path is not None or self.is_live():
+            return 0
+        return pixmap_nbytes(self.pixmap)
+
+    def spill(self):
+        if self.path is not None or self.is_live() or self.pixmap is None:
+            return
+        self.path = self.store.write(encode_pixmap(self.pixmap))
+        self.pixmap = None
+
+    def load(self):
+        if self.path is not None:
+            self.pixmap = decode_pixmap(self.store.read(self.path))
+            self.path = None
+        return self.pixmap
+
+
+class TilesPayload:
+    def __init__(self, store, tiles):
+        self.store = store
+        self.tiles = tiles
+        self.path = None
+
+    def nbytes(self):
+        if self.path is not None:
+            return 0
+        return sum(len(before) + len(after) for before, after in self.tiles.values())
+
+    def spill(self):
+        if self.path is not None:
+            return
+        # 图块本身已压缩，直接序列化
+        self.path = self.store.write(pickle.dumps(self.tiles, pickle.HIGHEST_PROTOCOL))
+        self.tiles = None
+
+    def load(self):
+        if self.path is not None:
+            self.tiles = pickle.loads(self.store.read(self.path))
+            self.path = None
+        return self.tiles
+
+
+# 已从场景移除、只由撤销栈持有的图层；换出时保留图层对象和调整栈，只释放像素
+# 通过 SpillStore.item_payload 获取，保证每个图层只有一个实例
+class ItemPayload:
+    def __init__(self, store, item):
+        self.store = store
+        self.item = item
+        self.path = None
+
+    def spillable(self):
+        return self.path is None and hasattr(self.item, "release_pixels") and self.item.scene() is None
+
+    def nbytes(self):
+        if not self.spillable():
+            return 0
+        return self.item.pixel_nbytes()
+
+    def spill(self):
+        if not self.spillable():
+            return
+        source = self.item.release_pixels()
+        self.path = self.store.write(encode_pixmap(source))
+
+    def load(self):
+        if self.path is not None:
+            self.item.restore_pixels(decode_pixmap(self.store.read(self.path)))
+            self.path = None
+        return self.item
+
+
+class UndoMemoryManager(QObject):
+    usage_changed = pyqtSignal(int, int)  # 内存字节数, 磁盘字节数
+
+    def __init__(self, undo_stack, budget=UNDO_MEMORY_BUDGET, parent=None):
+        super().__init__(parent)
+        self.undo_stack = undo_stack
+        self.budget = budget
+        self.store = SpillStore()
+        self.memory_bytes = 0
+        undo_stack.indexChanged.connect(self.enforce)
+
+    def set_budget(self, budget):
+        self.budget = budget
+        self.enforce()
+
+    def command_payloads(self, index):
+        command = self.undo_stack.command(index)
+        payloads = getattr(command, "payloads", None)
+        return payloads() if payloads else []
+
+    def enforce(self):
+        count = self.undo_stack.count()
+        current = self.undo_stack.index()
+        # 按与当前位置的距离排序：下一次撤销执行 current-1，下一次重做执行 current
+        # 被多条命令共用的记录只计一次，距离取最近的那条命令
+        entries = {}
+        for index in range(count):
+            distance = current - 1 - index if index < current else index - current
+            for payload in self.command_payloads(index):
+                entry = entries.get(id(payload))
+                if entry is None:
+                    entries[id(payload)] = [distance, payload.nbytes(), payload]
+                elif distance < entry[0]:
+                    entry[0] = distance
+        # 被撤销栈丢弃的命令（新操作覆盖重做分支、超出撤销上限、清空）的换出文件不会再读回
+        pruned = self.store.prune({entry[2].path for entry in entries.values() if entry[2].path is not None})
+        if pruned:
+            logging.info(f"已删除 {pruned} 个不再可达的撤销换出文件")
+        total = sum(entry[1] for entry in entries.values())
+        if total > self.budget:
+            spilled = 0
+            for distance, size, payload in sorted(entries.values(), key=lambda entry: entry[0], reverse=True):
+                if total <= self.budget:
+                    break
+                if not size:
+                    continue
+                payload.spill()
+                total -= size
+                spilled += size
+            logging.info(f"撤销栈超出内存上限，已换出 {spilled / 1024 / 1024:.1f} MB 到磁盘")
+        self.memory_bytes = total
+        self.usage_changed.emit(total, self.store.disk_bytes)
+
+    def shutdown(self):
+        self.undo_stack.indexChanged.disconnect(self.enforce)
+        self.store.clear()